@@ -0,0 +1,194 @@
+"""
+score_config 流水线产物的列式格式（可选，需要 numpy）。
+
+一个产物是一个目录：每列一个 .npy 文件（加载时 mmap，不用再逐行切字符串），
+字符串列做字典编码，取值表和列信息放在 meta.json 里。
+带 file_line 列的行表（compiled_lines / skipped_lines）会被拆成 file/start_line/end_line，
+相邻且其余列都相同的行合并成一个区间；导出 CSV 时再按行展开，与原来的 CSV 完全一致。
+
+用法（导出 CSV，给 config.xlsx 之类的表格用）：
+    python columnar.py skipped_lines.cols skipped_lines.csv
+"""
+import csv
+import json
+import os
+import shutil
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+META_FILE = "meta.json"
+# iter_table_rows 每次从 mmap 的列里解码多少行
+ROW_CHUNK = 65536
+
+def require_numpy():
+    if np is None:
+        raise ImportError("列式格式需要 numpy")
+
+def is_columnar(path):
+    """path 是否是列式产物目录"""
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, META_FILE))
+
+def encode_strings(values):
+    """字典编码：返回 (codes, categories)"""
+    ids = {}
+    codes = np.fromiter((ids.setdefault(v, len(ids)) for v in values), dtype=np.int32, count=len(values))
+    return codes, list(ids)
+
+def write_columns(path, kind, arrays, categories=None, extra=None):
+    """
+    写列式目录。
+    arrays: {列名: 数组}；categories: {列名: 取值表}，有取值表的列是字典编码列
+    先写到临时目录再改名，中途被打断时不会留下写了一半的表。
+    """
+    require_numpy()
+    path = os.path.normpath(path)
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    meta = {"kind": kind, "columns": list(arrays), "categories": categories or {}}
+    meta.update(extra or {})
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp_path, name + ".npy"), np.asarray(arr))
+    with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    # 目录不能直接 os.replace 到非空目录上：旧目录先挪开，新目录改名到位后再删
+    old_path = None
+    if os.path.exists(path):
+        old_path = path + ".old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    if old_path is not None:
+        shutil.rmtree(old_path, ignore_errors=True)
+
+def read_columns(path, mmap=True):
+    """读列式目录，返回 (meta, {列名: 数组})，数组默认以只读 mmap 方式打开"""
+    require_numpy()
+    with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    arrays = {}
+    for name in meta["columns"]:
+        arrays[name] = np.load(os.path.join(path, name + ".npy"), mmap_mode="r" if mmap else None)
+    return meta, arrays
+
+def write_table(path, header, rows):
+    """
+    把行表（与 CSV 相同的 header/rows）写成列式目录。
+    整数列直接存 int64，其余列字典编码；file_line 列按区间压缩。
+    """
+    require_numpy()
+    columns = list(header)
+    if "file_line" in columns:
+        idx = columns.index("file_line")
+        rest = [i for i in range(len(columns)) if i != idx]
+
+        def intervals():
+            for row in rows:
+                path_, line = row[idx].rsplit(":", 1)
+                line = int(line)
+                yield (path_, line, line) + tuple(row[i] for i in rest)
+
+        write_interval_table(path, header, intervals())
+        return
+    _write_rows(path, header, columns, list(rows))
+
+def write_interval_table(path, header, intervals):
+    """
+    写带 file_line 列的行表，但输入直接是区间：(file, start, end, 其余列...)，其余列按 header 中除 file_line
+    以外的顺序。相邻且其余列都相同的区间会合并；内存与区间数成正比，不按行展开。
+    """
+    require_numpy()
+    rest = [name for name in header if name != "file_line"]
+    ranges = []  # [file, start, end, 其余列...]
+    for path_, start, end, *others in intervals:
+        last = ranges[-1] if ranges else None
+        if last and last[0] == path_ and last[2] + 1 == start and last[3:] == others:
+            last[2] = end
+        else:
+            ranges.append([path_, start, end] + others)
+    _write_rows(path, header, ["file", "start_line", "end_line"] + rest, ranges)
+
+def _write_rows(path, header, columns, rows):
+    arrays, categories = {}, {}
+    for i, name in enumerate(columns):
+        values = [row[i] for row in rows]
+        if values and all(isinstance(v, int) for v in values):
+            arrays[name] = np.asarray(values, dtype=np.int64)
+        else:
+            arrays[name], categories[name] = encode_strings([str(v) for v in values])
+    write_columns(path, "table", arrays, categories, extra={"header": list(header)})
+
+def iter_table_rows(path):
+    """
+    按原表头逐行读出列式表：产出与 csv.DictReader 相同形状的 dict（值都是字符串）。
+    同一个区间展开出来的行共用同一组字符串对象。
+    列保持 mmap，每次只解码 ROW_CHUNK 行。
+    """
+    meta, arrays = read_columns(path)
+    header = meta["header"]
+    columns = meta["columns"]
+    categories = meta["categories"]
+    n_rows = len(arrays[columns[0]]) if columns else 0
+    others = [name for name in header if name != "file_line"]
+    for lo in range(0, n_rows, ROW_CHUNK):
+        decoded = {}
+        for name in columns:
+            values = arrays[name][lo:lo + ROW_CHUNK].tolist()
+            if name in categories:
+                decoded[name] = [categories[name][c] for c in values]
+            else:
+                decoded[name] = [str(v) for v in values]
+        for r in range(len(decoded[columns[0]])):
+            base = {name: decoded[name][r] for name in others}
+            if "file_line" in header:
+                path_ = decoded["file"][r]
+                for line in range(int(decoded["start_line"][r]), int(decoded["end_line"][r]) + 1):
+                    row = dict(base)
+                    row["file_line"] = f"{path_}:{line}"
+                    yield row
+            else:
+                yield base
+
+def table_value_counts(path, column):
+    """
+    列式表中某个字典编码列的每个取值覆盖了多少行（file_line 区间按行数计），
+    直接在编码后的数组上 bincount，不展开成逐行。返回 {取值: 行数}
+    """
+    meta, arrays = read_columns(path)
+    categories = meta["categories"][column]
+    codes = arrays[column]
+    weights = None
+    if "file_line" in meta["header"]:
+        weights = arrays["end_line"] - arrays["start_line"] + 1
+    counts = np.bincount(codes, weights=weights, minlength=len(categories))
+    return {categories[i]: int(n) for i, n in enumerate(counts.tolist()) if n}
+
+def table_to_csv(path, csv_path):
+    """列式表 -> CSV（与直接写出的 CSV 相同）"""
+    meta, _ = read_columns(path)
+    header = meta["header"]
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(header)
+        for row in iter_table_rows(path):
+            w.writerow([row[name] for name in header])
+
+def export_csv(path, csv_path):
+    """任意列式产物 -> CSV；fileline 映射按 file_line,output_lines 旧格式导出"""
+    meta, _ = read_columns(path)
+    if meta["kind"] == "fileline_mapping":
+        from line_mapping import LineMapping
+        LineMapping.load_columnar(path).write_csv(csv_path)
+    else:
+        table_to_csv(path, csv_path)
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3:
+        print(f"用法: {sys.argv[0]} <列式目录> <输出 CSV>")
+        sys.exit(1)
+    export_csv(sys.argv[1], sys.argv[2])
@@ -0,0 +1,293 @@
+"""
+条件求值：判断一组条件（undertaker/kbuildparser 输出的 "CONFIG_X=y"，或 config_code_mapping.csv 里
+"!(CONFIG_MMU)"、"defined(CONFIG_A) && !defined(CONFIG_B)" 这样的表达式）在某个 .config 下是否满足。
+
+支持的条件写法：
+    CONFIG_X=y / =m / =n        tristate，未定义的 CONFIG 视作 n
+    CONFIG_X="str"              字符串（引号内比较）
+    CONFIG_X=64 / =0x40         整数，按数值比较（0x40 与 64 相同）
+    CONFIG_X!=v, !CONFIG_X=v, !(CONFIG_X=v), !CONFIG_X, CONFIG_X
+    预处理表达式：&& || ! ( ) == != < <= > >=、defined()、IS_ENABLED()、IS_BUILTIN()、
+                  IS_MODULE()、IS_REACHABLE()；非 CONFIG_ 宏按预处理器的规则视作 0
+
+tristate 语义：
+    module_as_built=False（默认，与原来的严格相等一致）：=y 只被 y 满足，m 不算编译进内核；
+    module_as_built=True：=y 也被 m 满足（m 视为"已编译"），对应 analyze_skipped 原来的宽松模式。
+
+每个条件集合第一次出现时编译成一个 Python 函数（按集合缓存，多个 .config 共用），
+ConditionEvaluator 再按集合记住当前 .config 下的结果，共享同一集合的行只算一次。
+"""
+import re
+from functools import lru_cache
+
+# CONFIG=值 字面量；值是单个 token，"==" 以及带 && || 等的 C 表达式交给 _ExprParser
+LITERAL_VALUE = r'("[^"]*"|[^\s&|()!<>="]*)'
+LITERAL_RE = re.compile(r"^(CONFIG_[A-Za-z0-9_]+)\s*(!=|=(?!=))\s*" + LITERAL_VALUE + r"\s*$")
+NEG_LITERAL_RE = re.compile(r"^!\s*\(\s*(CONFIG_[A-Za-z0-9_]+)\s*(!=|=(?!=))\s*" + LITERAL_VALUE + r"\s*\)$"
+                            r"|^!\s*(CONFIG_[A-Za-z0-9_]+)\s*(!=|=(?!=))\s*" + LITERAL_VALUE + r"\s*$")
+# CONFIG_X、defined(CONFIG_X)、!(CONFIG_X)、!defined(CONFIG_X) 等只涉及一个 CONFIG 的写法
+NAME_RE = re.compile(r"(!)?\s*\(?\s*(?:defined\s*\(?\s*)?(CONFIG_[A-Za-z0-9_]+)\s*\)?\s*\)?")
+TOKEN_RE = re.compile(r"\s*(?:(0[xX][0-9a-fA-F]+|\d+)[uUlL]*|([A-Za-z_][A-Za-z0-9_]*)|(&&|\|\||==|!=|<=|>=|[!()<>]))")
+MACRO_FUNCS = {
+    "IS_ENABLED": "_enabled",
+    "IS_REACHABLE": "_enabled",
+    "IS_BUILTIN": "_builtin",
+    "IS_MODULE": "_module",
+}
+
+def unquote(v):
+    if len(v) >= 2 and v[0] == '"' and v[-1] == '"':
+        return v[1:-1]
+    return v
+
+def to_int(v):
+    try:
+        return int(v, 0)
+    except (TypeError, ValueError):
+        return None
+
+def split_condition(cond):
+    """"CONFIG_X=y" -> ("CONFIG_X", "y")；不是简单的 CONFIG=值 形式时返回 None"""
+    m = LITERAL_RE.match(cond.strip())
+    if m and m.group(2) == "=":
+        return m.group(1), m.group(3).strip()
+    return None
+
+class _Helpers:
+    """编译出的函数里用到的辅助函数，c 是 {CONFIG: 值}"""
+
+    def __init__(self, module_as_built):
+        built = ("y", "m") if module_as_built else ("y",)
+        self.ns = {
+            "_enabled": lambda c, k: c.get(k, "n") in ("y", "m"),
+            "_builtin": lambda c, k: c.get(k, "n") == "y",
+            "_module": lambda c, k: c.get(k, "n") == "m",
+            # 任何非 n 的取值都算已定义（int/hex/string 也是）；module_as_built 只影响 =y 的比较
+            "_defined": lambda c, k: c.get(k, "n") not in ("n", ""),
+            "_num": lambda c, k: self.num(c.get(k, "n"), built),
+            "_int": to_int,
+            "_unquote": unquote,
+        }
+
+    @staticmethod
+    def num(v, built):
+        """#if CONFIG_X 里 CONFIG_X 的数值：y -> 1，n/未定义 -> 0，整数按数值，其余视为已定义的 1"""
+        if v in ("y", "m"):
+            return 1 if v in built else 0
+        if v == "n":
+            return 0
+        n = to_int(v)
+        return 1 if n is None else n
+
+def _literal_code(k, op, v, module_as_built):
+    """CONFIG=值 字面量 -> Python 表达式"""
+    v = v.strip()
+    get = f"c.get({k!r}, 'n')"
+    if v == "y":
+        code = f"{get} in ('y', 'm')" if module_as_built else f"{get} == 'y'"
+    elif v in ("m", "n"):
+        code = f"{get} == {v!r}"
+    elif v.startswith('"'):
+        code = f"_unquote({get}) == {unquote(v)!r}"
+    elif to_int(v) is not None:
+        code = f"_int({get}) == {to_int(v)!r}"
+    else:
+        code = f"{get} == {v!r}"
+    return f"(not ({code}))" if op == "!=" else f"({code})"
+
+class _ExprParser:
+    """预处理条件表达式 -> Python 表达式（递归下降）"""
+
+    def __init__(self, text):
+        self.tokens = []
+        text = text.replace("\\\n", " ").replace("\\", " ").strip()
+        pos = 0
+        while pos < len(text):
+            m = TOKEN_RE.match(text, pos)
+            if not m or m.end() == pos:
+                if text[pos:].strip() == "":
+                    break
+                raise ValueError(f"无法解析的条件: {text}")
+            pos = m.end()
+            num, ident, op = m.groups()
+            if num is not None:
+                self.tokens.append(("num", str(int(num, 0))))
+            elif ident is not None:
+                self.tokens.append(("ident", ident))
+            else:
+                self.tokens.append(("op", op))
+        self.i = 0
+
+    def peek(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        tok = self.peek()
+        if tok[0] is None or (value is not None and tok[1] != value):
+            raise ValueError(f"条件表达式语法错误，期望 {value}")
+        self.i += 1
+        return tok
+
+    def parse(self):
+        code = self.parse_or()
+        if self.i != len(self.tokens):
+            raise ValueError("条件表达式末尾有多余的内容")
+        return code
+
+    def parse_or(self):
+        code = self.parse_and()
+        while self.peek() == ("op", "||"):
+            self.take()
+            code = f"({code} or {self.parse_and()})"
+        return code
+
+    def parse_and(self):
+        code = self.parse_cmp()
+        while self.peek() == ("op", "&&"):
+            self.take()
+            code = f"({code} and {self.parse_cmp()})"
+        return code
+
+    def parse_cmp(self):
+        code = self.parse_unary()
+        kind, value = self.peek()
+        if kind == "op" and value in ("==", "!=", "<", "<=", ">", ">="):
+            self.take()
+            code = f"({code} {value} {self.parse_unary()})"
+        return code
+
+    def parse_unary(self):
+        # 与 C 一样，! 比 == 等比较运算符结合得更紧：!A == B 是 (!A) == B
+        if self.peek() == ("op", "!"):
+            self.take()
+            return f"(not {self.parse_unary()})"
+        return self.parse_primary()
+
+    def parse_primary(self):
+        kind, value = self.take()
+        if kind == "num":
+            return value
+        if kind == "op" and value == "(":
+            code = self.parse_or()
+            self.take(")")
+            return code
+        if kind == "ident":
+            if value == "defined":
+                paren = self.peek() == ("op", "(")
+                if paren:
+                    self.take()
+                name = self.take()[1]
+                if paren:
+                    self.take(")")
+                return f"_defined(c, {name!r})" if name.startswith("CONFIG_") else "False"
+            if value in MACRO_FUNCS:
+                self.take("(")
+                name = self.take()[1]
+                self.take(")")
+                return f"{MACRO_FUNCS[value]}(c, {name!r})"
+            if value.startswith("CONFIG_"):
+                return f"_num(c, {value!r})"
+            # 非 CONFIG_ 宏（__clang__、__riscv_xlen 等）：与预处理器一样视作 0
+            return "0"
+        raise ValueError(f"条件表达式语法错误: {value}")
+
+def condition_code(cond, module_as_built=False):
+    """单个条件 -> Python 表达式（变量 c 为 {CONFIG: 值}）"""
+    if isinstance(cond, tuple):
+        cond = f"{cond[0]}={cond[1]}"
+    cond = cond.strip()
+    m = LITERAL_RE.match(cond)
+    if m:
+        return _literal_code(m.group(1), m.group(2), m.group(3), module_as_built)
+    m = NEG_LITERAL_RE.match(cond)
+    if m:
+        k, op, v = m.group(1, 2, 3) if m.group(1) else m.group(4, 5, 6)
+        return f"(not {_literal_code(k, op, v, module_as_built)})"
+    return f"bool({_ExprParser(cond).parse()})"
+
+@lru_cache(maxsize=None)
+def _helpers(module_as_built):
+    return _Helpers(module_as_built).ns
+
+@lru_cache(maxsize=None)
+def compile_condition(cond, module_as_built=False):
+    """单个条件 -> 函数 f(config_map) -> bool；解析不了的条件与原来一样视为满足，并提示一次"""
+    try:
+        code = condition_code(cond, module_as_built)
+    except ValueError as e:
+        print(f"[WARN] {e}，按满足处理")
+        code = "True"
+    return eval(f"lambda c: {code}", dict(_helpers(module_as_built)))
+
+@lru_cache(maxsize=None)
+def compile_condition_set(conds, module_as_built=False):
+    """条件集合（tuple）-> 函数 f(config_map) -> bool，所有条件都满足才为真"""
+    if not conds:
+        return lambda c: True
+    ns = dict(_helpers(module_as_built))
+    parts = []
+    for i, cond in enumerate(conds):
+        try:
+            parts.append(condition_code(cond, module_as_built))
+        except ValueError:
+            ns[f"_cond{i}"] = compile_condition(cond, module_as_built)
+            parts.append(f"_cond{i}(c)")
+    return eval(f"lambda c: {' and '.join(parts)}", ns)
+
+def describe_unmet(cond, config_map):
+    """未满足条件的说明：CONFIG=值 形式沿用 "CONFIG_X=n (need y)"，其余写出相关 CONFIG 的实际值"""
+    if isinstance(cond, tuple):
+        cond = f"{cond[0]}={cond[1]}"
+    m = LITERAL_RE.match(cond.strip())
+    if m:
+        k, op, v = m.group(1), m.group(2), m.group(3).strip()
+        need = v if op == "=" else f"!{v}"
+        return f"{k}={config_map.get(k, 'n')} (need {need})"
+    m = NEG_LITERAL_RE.match(cond.strip())
+    if m:
+        k, op, v = m.group(1, 2, 3) if m.group(1) else m.group(4, 5, 6)
+        need = f"!{v.strip()}" if op == "=" else v.strip()
+        return f"{k}={config_map.get(k, 'n')} (need {need})"
+    m = NAME_RE.fullmatch(cond.strip())
+    if m:
+        k = m.group(2)
+        return f"{k}={config_map.get(k, 'n')} (need {'n' if m.group(1) else 'y'})"
+    names = sorted(set(re.findall(r"CONFIG_[A-Za-z0-9_]+", cond)))
+    actual = " ".join(f"{k}={config_map.get(k, 'n')}" for k in names)
+    return f"[{cond}] ({actual})" if actual else f"[{cond}]"
+
+class ConditionEvaluator:
+    """
+    某个 .config 下的条件求值器：
+        check(conds)   -> bool
+        explain(conds) -> (bool, [未满足条件的说明, ...])
+    conds 是条件 tuple（字符串，或 (CONFIG, 值) 对）；结果按集合记忆。
+    """
+
+    def __init__(self, config_map, module_as_built=False):
+        self.config_map = config_map
+        self.module_as_built = module_as_built
+        self._results = {}
+        self._explained = {}
+
+    def check(self, conds):
+        conds = tuple(conds)
+        ok = self._results.get(conds)
+        if ok is None:
+            ok = self._results[conds] = compile_condition_set(conds, self.module_as_built)(self.config_map)
+        return ok
+
+    def explain(self, conds):
+        conds = tuple(conds)
+        result = self._explained.get(conds)
+        if result is None:
+            if self.check(conds):
+                result = (True, [])
+            else:
+                unmet = []
+                for cond in conds:
+                    if not compile_condition(cond, self.module_as_built)(self.config_map):
+                        unmet.append(describe_unmet(cond, self.config_map))
+                result = (False, unmet)
+            self._explained[conds] = result
+        return result
@@ -0,0 +1,401 @@
+"""
+最小配置覆盖：找尽量少的几组互相不冲突的 CONFIG 取值，使 fileline_output 里每个能被编译的条件集合
+至少在其中一组下被编译（config2files.py 合并 undertaker -C min 结果的升级版，直接减少要编译、fuzz 的内核数）。
+
+做法：
+    1. 每个条件集合求一个"需求"：{CONFIG: 值}，覆盖集合里出现的所有 CONFIG（字面量直接取值，
+       !CONFIG_X / 表达式在 y/n 上穷举），再按 configtree.json 补上祖先 =y；自相矛盾、与冻结符号冲突的
+       集合记为不可达；
+    2. 需求去重，被别的需求包含的去掉（能覆盖大的就能覆盖小的）；
+    3. 两个需求冲突 <=> 某个 CONFIG 取值不同，问题变成冲突图着色：先 DSATUR 贪心得到上界，
+       冲突图里贪心找一个团作为下界；
+    4. 有 scipy（scipy.optimize.milp，HiGHS）时从上界减一开始逐个求 K 组是否可行，直到不可行、
+       达到下界或超时，每一步都打印进度。
+
+用法：
+    python config_cover.py fileline_merged.csv --configtree configtree.json --base-config .config
+输出：
+    cover_configs/cover_N.config   每组一个 "CONFIG_X=值" 片段（与 undertaker -C min 的格式相同）
+    config_cover.json              [{"config": [...], "files": [...], "lines": N}]，与 config_map_merged.json 同形
+    config_cover_unreachable.csv   不可达的条件集合及原因
+"""
+import csv
+import itertools
+import json
+import os
+import re
+import time
+
+from cond_eval import LITERAL_RE, NEG_LITERAL_RE, compile_condition_set
+from config_optimizer import DEFAULT_FREEZE, DependencyTree, load_config_tree
+from line_mapping import LineMapping
+
+try:
+    import numpy as np
+    from scipy import sparse
+    from scipy.optimize import Bounds, LinearConstraint, milp
+except ImportError:
+    milp = None
+
+CONFIG_NAME_RE = re.compile(r"CONFIG_[A-Za-z0-9_]+")
+MAX_FREE_SYMBOLS = 12
+
+class Unreachable(Exception):
+    pass
+
+def condition_requirement(conds, module_as_built=False, deps=None, frozen=None):
+    """
+    条件集合 -> 让它被编译的一组取值 {CONFIG: 值}（集合里出现的每个 CONFIG 都有取值）。
+    frozen: {CONFIG: 值}，不能改的符号（工具链等），需求与之冲突时不可达。
+    不可达时抛出 Unreachable。
+    """
+    fixed = {}
+    free = set()
+
+    def need(k, v):
+        if fixed.get(k, v) != v:
+            raise Unreachable(f"{k} 需要同时为 {fixed[k]} 和 {v}")
+        fixed[k] = v
+
+    for cond in conds:
+        cond = cond.strip()
+        m = LITERAL_RE.match(cond)
+        neg = False
+        if m:
+            k, op, v = m.group(1), m.group(2), m.group(3).strip()
+        else:
+            m = NEG_LITERAL_RE.match(cond)
+            if m:
+                k, op, v = m.group(1, 2, 3) if m.group(1) else m.group(4, 5, 6)
+                v = v.strip()
+                neg = True
+        if m:
+            if (op == "=") != neg:
+                need(k, v)
+            elif v in ("y", "m"):
+                need(k, "n")
+            elif v == "n":
+                need(k, "y")
+            else:
+                free.add(k)
+        else:
+            free.update(CONFIG_NAME_RE.findall(cond))
+
+    free -= set(fixed)
+    if len(free) > MAX_FREE_SYMBOLS:
+        raise Unreachable(f"表达式涉及 {len(free)} 个 CONFIG，超过穷举上限 {MAX_FREE_SYMBOLS}")
+    predicate = compile_condition_set(tuple(conds), module_as_built)
+    free = sorted(free)
+    error = Unreachable("条件在任何取值下都不满足")
+    for values in itertools.product(("n", "y"), repeat=len(free)):
+        req = dict(fixed)
+        req.update(zip(free, values))
+        if not predicate(req):
+            continue
+        try:
+            return close_requirement(req, deps, frozen)
+        except Unreachable as e:
+            error = e
+    raise error
+
+def close_requirement(req, deps=None, frozen=None):
+    """补上 Kconfig 祖先（打开的 CONFIG 的祖先都要 =y），并检查冻结符号"""
+    req = dict(req)
+    if deps is not None:
+        for k, v in list(req.items()):
+            if v == "n":
+                continue
+            for a in deps.ancestors(k):
+                if req.get(a, "y") == "n":
+                    raise Unreachable(f"{k}={v} 依赖 {a}，但需要 {a}=n")
+                req[a] = "y"
+    for k, v in req.items():
+        if frozen and k in frozen and frozen[k] != v:
+            raise Unreachable(f"{k} 固定为 {frozen[k]}，需要 {v}")
+    return req
+
+def drop_dominated(reqs):
+    """去掉被别的需求包含的需求：返回 (保留的需求列表, 原需求下标 -> 保留需求下标)"""
+    order = sorted(range(len(reqs)), key=lambda i: -len(reqs[i]))
+    kept = []
+    by_item = {}   # (CONFIG, 值) -> 包含它的保留需求
+    owner = {}
+    for i in order:
+        items = reqs[i].items()
+        if items:
+            rarest = min(items, key=lambda it: len(by_item.get(it, ())))
+            pool = by_item.get(rarest, ())
+        else:
+            pool = range(len(kept))
+        for j in pool:
+            if all(kept[j].get(k) == v for k, v in items):
+                owner[i] = j
+                break
+        else:
+            owner[i] = len(kept)
+            for it in items:
+                by_item.setdefault(it, []).append(len(kept))
+            kept.append(reqs[i])
+    return kept, owner
+
+def conflict_graph(reqs):
+    """冲突邻接表：两个需求在某个 CONFIG 上取值不同就冲突"""
+    by_sym = {}
+    for i, req in enumerate(reqs):
+        for k, v in req.items():
+            by_sym.setdefault(k, {}).setdefault(v, []).append(i)
+    adj = [set() for _ in reqs]
+    for groups in by_sym.values():
+        if len(groups) < 2:
+            continue
+        for (v1, a), (v2, b) in itertools.combinations(groups.items(), 2):
+            for i in a:
+                adj[i].update(b)
+            for j in b:
+                adj[j].update(a)
+    return adj, by_sym
+
+def dsatur(adj):
+    """DSATUR 贪心着色，返回 colors[i]"""
+    n = len(adj)
+    colors = [-1] * n
+    neighbor_colors = [set() for _ in range(n)]
+    uncolored = set(range(n))
+    while uncolored:
+        i = max(uncolored, key=lambda u: (len(neighbor_colors[u]), len(adj[u]), -u))
+        c = 0
+        while c in neighbor_colors[i]:
+            c += 1
+        colors[i] = c
+        uncolored.discard(i)
+        for j in adj[i]:
+            neighbor_colors[j].add(c)
+    return colors
+
+def greedy_clique(adj):
+    """贪心找冲突图里的一个团（团里的需求两两冲突，必须各占一组），给出组数下界"""
+    best = []
+    for start in sorted(range(len(adj)), key=lambda u: -len(adj[u]))[:50]:
+        clique = [start]
+        cand = set(adj[start])
+        while cand:
+            u = max(cand, key=lambda x: (len(adj[x] & cand), -x))
+            clique.append(u)
+            cand &= adj[u]
+        if len(clique) > len(best):
+            best = clique
+    return best
+
+def solve_k_groups(reqs, by_sym, k, clique, time_limit):
+    """
+    用 MILP 判断 k 组是否可行。x[e,g]：需求 e 放进第 g 组；z[s,v,g]：第 g 组里 CONFIG s 取 v。
+    每个需求恰好一组；x[e,g] <= z[s,v,g]；同一组里每个 CONFIG 至多一个取值；团成员固定在前几组。
+    返回 (状态, colors)：状态为 "feasible" / "infeasible" / "timeout"
+    """
+    n = len(reqs)
+    lits = [(s, v) for s, groups in by_sym.items() if len(groups) > 1 for v in groups]
+    lit_ids = {lit: i for i, lit in enumerate(lits)}
+    n_x = n * k
+    n_vars = n_x + len(lits) * k
+
+    def x(e, g):
+        return e * k + g
+
+    def z(lit, g):
+        return n_x + lit * k + g
+
+    rows, cols, vals, lo, hi = [], [], [], [], []
+    r = 0
+    for e in range(n):
+        for g in range(k):
+            rows.append(r)
+            cols.append(x(e, g))
+            vals.append(1)
+        lo.append(1)
+        hi.append(1)
+        r += 1
+    for e, req in enumerate(reqs):
+        for s, v in req.items():
+            lit = lit_ids.get((s, v))
+            if lit is None:
+                continue
+            for g in range(k):
+                rows += [r, r]
+                cols += [x(e, g), z(lit, g)]
+                vals += [1, -1]
+                lo.append(-np.inf)
+                hi.append(0)
+                r += 1
+    for s, groups in by_sym.items():
+        if len(groups) < 2:
+            continue
+        for g in range(k):
+            for v in groups:
+                rows.append(r)
+                cols.append(z(lit_ids[(s, v)], g))
+                vals.append(1)
+            lo.append(-np.inf)
+            hi.append(1)
+            r += 1
+
+    lb = np.zeros(n_vars)
+    ub = np.ones(n_vars)
+    for g, e in enumerate(clique[:k]):
+        lb[x(e, g)] = 1
+    A = sparse.csr_matrix((vals, (rows, cols)), shape=(r, n_vars))
+    res = milp(np.zeros(n_vars), integrality=np.ones(n_vars), bounds=Bounds(lb, ub),
+               constraints=LinearConstraint(A, lo, hi), options={"time_limit": time_limit})
+    if res.status == 0 and res.x is not None:
+        sol = res.x[:n_x].reshape(n, k)
+        return "feasible", [int(row.argmax()) for row in sol]
+    if res.status == 2:
+        return "infeasible", None
+    return "timeout", None
+
+class ConfigCover:
+    """mapping 上的最小配置覆盖，solve() 之后 groups 是每组的取值 {CONFIG: 值}"""
+
+    def __init__(self, mapping, tree=None, base_config=None, freeze=DEFAULT_FREEZE, module_as_built=False):
+        if not isinstance(mapping, LineMapping):
+            mapping = LineMapping.from_fileline_dict(mapping)
+        self.mapping = mapping
+        self.module_as_built = module_as_built
+        self.deps = DependencyTree(tree) if tree else None
+        self.frozen = {}
+        if base_config and freeze:
+            freeze_re = re.compile(freeze)
+            self.frozen = {k: v for k, v in base_config.items() if freeze_re.search(k)}
+        self.weights = mapping.set_line_counts()
+        self.set_req = {}        # set_id -> 需求下标
+        self.unreachable = {}    # set_id -> 原因
+        self.reqs = []
+        self.groups = []
+        self.req_group = {}      # 需求下标 -> 组下标
+
+    def build_requirements(self):
+        req_ids = {}
+        for set_id, conds in enumerate(self.mapping.cond_sets):
+            if not self.weights[set_id] or not conds:
+                continue
+            try:
+                req = condition_requirement(conds, self.module_as_built, self.deps, self.frozen)
+            except Unreachable as e:
+                self.unreachable[set_id] = str(e)
+                continue
+            key = frozenset(req.items())
+            if key not in req_ids:
+                req_ids[key] = len(self.reqs)
+                self.reqs.append(req)
+            self.set_req[set_id] = req_ids[key]
+
+    def solve(self, time_limit=300, step_limit=60):
+        started = time.time()
+        self.build_requirements()
+        n_lines = sum(self.weights[s] for s in self.set_req)
+        print(f"[INFO] 条件集合 {len(self.mapping.cond_sets)} 个，可达 {len(self.set_req)} 个（{n_lines} 行），"
+              f"不可达 {len(self.unreachable)} 个，不同需求 {len(self.reqs)} 个")
+        kept, owner = drop_dominated(self.reqs)
+        adj, by_sym = conflict_graph(kept)
+        print(f"[INFO] 去掉被包含的需求后剩 {len(kept)} 个，冲突边 {sum(map(len, adj)) // 2} 条")
+        if not kept:
+            self.groups = []
+            self.req_group = {}
+            return self.groups
+
+        colors = dsatur(adj)
+        best = len(set(colors))
+        clique = greedy_clique(adj)
+        print(f"[INFO] 贪心着色: {best} 组；下界（冲突团大小）: {len(clique)}；"
+              f"用时 {time.time() - started:.1f}s")
+
+        if milp is None:
+            print("[WARN] 没有 scipy.optimize.milp，只用贪心结果")
+        deadline = started + time_limit
+        k = best - 1
+        while milp is not None and k >= len(clique):
+            remaining = deadline - time.time()
+            if remaining <= 1:
+                print("[INFO] 达到时间上限，停止细化")
+                break
+            status, sol = solve_k_groups(kept, by_sym, k, clique, min(step_limit, remaining))
+            print(f"[INFO] 尝试 {k} 组: {status}，用时 {time.time() - started:.1f}s")
+            if status != "feasible":
+                break
+            colors, best = sol, k
+            k -= 1
+        if best == len(clique):
+            print(f"[INFO] {best} 组已达到下界，是最优解")
+
+        # MILP 的解不一定用满 k 种颜色，按用到的颜色重新编号，组下标与 self.groups 对应
+        remap = {c: g for g, c in enumerate(sorted(set(colors)))}
+        groups = [{} for _ in remap]
+        for i, c in enumerate(colors):
+            groups[remap[c]].update(kept[i])
+        self.groups = groups
+        self.req_group = {i: remap[colors[owner[i]]] for i in owner}
+        self.verify()
+        return self.groups
+
+    def verify(self):
+        """逐个可达集合检查它在分到的组里确实被编译"""
+        bad = 0
+        for set_id, r in self.set_req.items():
+            conds = tuple(self.mapping.cond_sets[set_id])
+            if not compile_condition_set(conds, self.module_as_built)(self.groups[self.req_group[r]]):
+                bad += 1
+        if bad:
+            print(f"[WARN] {bad} 个条件集合在分到的组里没有被编译")
+        return bad == 0
+
+    def group_files(self):
+        """每组覆盖的文件和行数（每个集合只算在分到的那一组）"""
+        files = [set() for _ in self.groups]
+        lines = [0] * len(self.groups)
+        for path, start, end, set_id in self.mapping.iter_blocks():
+            r = self.set_req.get(set_id)
+            if r is None:
+                continue
+            g = self.req_group[r]
+            files[g].add(path)
+            lines[g] += end - start + 1
+        return files, lines
+
+    def write(self, out_dir="cover_configs", out_json="config_cover.json",
+              out_unreachable="config_cover_unreachable.csv"):
+        os.makedirs(out_dir, exist_ok=True)
+        files, lines = self.group_files()
+        output = []
+        for i, group in enumerate(self.groups, 1):
+            config = [f"{k}={v}" for k, v in sorted(group.items())]
+            with open(os.path.join(out_dir, f"cover_{i}.config"), "w", encoding="utf-8") as f:
+                f.write("\n".join(config) + "\n")
+            output.append({"config": config, "files": sorted(files[i - 1]), "lines": lines[i - 1]})
+        with open(out_json, "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=2)
+        with open(out_unreachable, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["conditions", "lines", "reason"])
+            for set_id, reason in sorted(self.unreachable.items(), key=lambda x: -self.weights[x[0]]):
+                w.writerow([";".join(self.mapping.cond_sets[set_id]), self.weights[set_id], reason])
+        print(f"[INFO] 总配置组合数量: {len(self.groups)}，输出: {out_dir}/, {out_json}, {out_unreachable}")
+
+if __name__ == "__main__":
+    import argparse
+    from config_loader import parse_config_file
+
+    ap = argparse.ArgumentParser(description="找尽量少的一组配置，使所有能编译的条件集合都至少被编译一次")
+    ap.add_argument("fileline_output", help="score_config_v3.py 生成的 fileline_merged.csv（或 .cols），即合并 kbuildparser 结果后、打分用的映射")
+    ap.add_argument("--configtree", help="Kconfig 依赖树 configtree.json（与 gen_kconfig_graph.py 相同）")
+    ap.add_argument("--base-config", help="提供冻结符号（工具链等）取值的 .config")
+    ap.add_argument("--freeze", default=DEFAULT_FREEZE, help="取 --base-config 中的值、不能改的符号（正则）")
+    ap.add_argument("--module-as-built", action="store_true", help="=y 的条件也被 =m 满足")
+    ap.add_argument("--time-limit", type=float, default=300, help="MILP 细化的总时间上限（秒）")
+    ap.add_argument("--out-dir", default="cover_configs", help="每组配置片段的输出目录")
+    args = ap.parse_args()
+
+    cover = ConfigCover(LineMapping.load(args.fileline_output),
+                        tree=load_config_tree(args.configtree) if args.configtree else None,
+                        base_config=parse_config_file(args.base_config) if args.base_config else None,
+                        freeze=args.freeze, module_as_built=args.module_as_built)
+    cover.solve(time_limit=args.time_limit)
+    cover.write(out_dir=args.out_dir)
@@ -0,0 +1,213 @@
+"""
+条件集合的倒排索引：(CONFIG, 值) -> 提到它的条件集合。
+
+改一个 CONFIG 只可能影响提到它的集合，what-if 查询、贪心优化都只重新判断这些集合，不用重算全表。
+索引里的集合只包括有条件、覆盖了行的集合，编号是索引内部的 sid（set_ids[sid] 是 LineMapping 的 set_id）。
+
+持久化的索引（SQLite，score_config_v3.py 与 fileline_output 一起写出 fileline_index.sqlite）：
+CONFIG -> {文件 -> 行区间, 条件集合 ID}，查"CONFIG_RISCV_ISA_V 管着哪些行"、某个 CONFIG 各取值覆盖多少行
+只读提到它的 k 个集合，不用重新扫一遍 fileline_output。
+
+用法：
+    python config_index.py fileline_index.sqlite CONFIG_RISCV_ISA_V [--config .config]
+    python config_index.py fileline_index.sqlite --build fileline_output.csv
+"""
+import os
+import re
+import sqlite3
+
+from cond_eval import ConditionEvaluator, compile_condition_set, split_condition
+
+CONFIG_NAME_RE = re.compile(r"CONFIG_[A-Za-z0-9_]+")
+
+class ConfigIndex:
+    """
+    index[CONFIG][值] = [sid, ...]；值为 None 表示在表达式或否定形式里提到（!CONFIG_X、defined() 等）
+    """
+
+    def __init__(self, mapping, module_as_built=False):
+        self.mapping = mapping
+        self.module_as_built = module_as_built
+        weights = mapping.set_line_counts()
+        self.set_ids = []      # sid -> LineMapping 的 set_id
+        self.predicates = []   # sid -> 判断函数
+        self.weights = []      # sid -> 行数
+        self.set_syms = []     # sid -> 引用的 CONFIG
+        self.index = {}
+        self.always = 0        # 无条件的行
+        for set_id, conds in enumerate(mapping.cond_sets):
+            if not weights[set_id]:
+                continue
+            if not conds:
+                self.always += weights[set_id]
+                continue
+            sid = len(self.predicates)
+            self.set_ids.append(set_id)
+            self.predicates.append(compile_condition_set(tuple(conds), module_as_built))
+            self.weights.append(weights[set_id])
+            syms = set()
+            for cond in conds:
+                lit = split_condition(cond)
+                mentions = [lit] if lit else [(k, None) for k in CONFIG_NAME_RE.findall(cond)]
+                for k, v in mentions:
+                    syms.add(k)
+                    sids = self.index.setdefault(k, {}).setdefault(v, [])
+                    if not sids or sids[-1] != sid:
+                        sids.append(sid)
+            self.set_syms.append(frozenset(syms))
+        self.by_config = {k: sorted({sid for sids in by_value.values() for sid in sids})
+                          for k, by_value in self.index.items()}
+        self.total_lines = self.always + sum(self.weights)
+        self._set_files = None
+
+    def sets_for(self, cfg):
+        """改 cfg 可能影响到的集合"""
+        return self.by_config.get(cfg, ())
+
+    def candidate_values(self, cfg):
+        """cfg 值得尝试的取值：条件里出现过的值，表达式里提到的再加上 y/n"""
+        by_value = self.index.get(cfg, {})
+        values = {v for v in by_value if v is not None}
+        if None in by_value:
+            values.update(("y", "n"))
+        return values
+
+    def compiled_flags(self, config_map):
+        return [bool(p(config_map)) for p in self.predicates]
+
+    def set_files(self, sid):
+        """集合覆盖的 {文件: 行数}"""
+        if self._set_files is None:
+            sids = {set_id: sid for sid, set_id in enumerate(self.set_ids)}
+            self._set_files = [{} for _ in self.set_ids]
+            for path, start, end, set_id in self.mapping.iter_blocks():
+                s = sids.get(set_id)
+                if s is not None:
+                    files = self._set_files[s]
+                    files[path] = files.get(path, 0) + end - start + 1
+        return self._set_files[sid]
+
+def write_index(mapping, db_path):
+    """
+    把 LineMapping 的倒排索引写成 SQLite（先写临时文件再替换）：
+        sets(set_id, conditions, lines)            条件集合，conditions 用 ";" 连接
+        mentions(config, value, set_id)            value 为 NULL 表示在表达式/否定形式里提到
+        blocks(set_id, file, start_line, end_line) 集合覆盖的行区间
+    """
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    idx = ConfigIndex(mapping)
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript(
+        "CREATE TABLE sets (set_id INTEGER PRIMARY KEY, conditions TEXT NOT NULL, lines INTEGER NOT NULL);"
+        "CREATE TABLE mentions (config TEXT NOT NULL, value TEXT, set_id INTEGER NOT NULL);"
+        "CREATE TABLE blocks (set_id INTEGER NOT NULL, file TEXT NOT NULL,"
+        " start_line INTEGER NOT NULL, end_line INTEGER NOT NULL);"
+    )
+    conn.executemany("INSERT INTO sets VALUES (?, ?, ?)",
+                     ((set_id, ";".join(mapping.cond_sets[set_id]), w)
+                      for set_id, w in zip(idx.set_ids, idx.weights)))
+    conn.executemany("INSERT INTO mentions VALUES (?, ?, ?)",
+                     ((k, v, idx.set_ids[sid]) for k, by_value in idx.index.items()
+                      for v, sids in by_value.items() for sid in sids))
+    indexed = set(idx.set_ids)
+    conn.executemany("INSERT INTO blocks VALUES (?, ?, ?, ?)",
+                     ((set_id, path, start, end) for path, start, end, set_id in mapping.iter_blocks()
+                      if set_id in indexed))
+    conn.executescript(
+        "CREATE INDEX mentions_config ON mentions (config);"
+        "CREATE INDEX blocks_set ON blocks (set_id);"
+    )
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, db_path)
+    print(f"[INFO] 倒排索引写入 {db_path}: {len(idx.index)} 个 CONFIG，{len(idx.set_ids)} 个条件集合")
+
+class IndexStore:
+    """读 write_index 写出的 SQLite 索引，每次查询只读提到该 CONFIG 的集合"""
+
+    def __init__(self, db_path):
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(db_path)
+        self.conn = sqlite3.connect(db_path)
+
+    def configs(self):
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT config FROM mentions ORDER BY config")]
+
+    def sets_for(self, cfg, value=None):
+        """提到 cfg（或 cfg=value）的集合：[(set_id, 取值, (条件, ...), 行数), ...]"""
+        sql = ("SELECT m.set_id, m.value, s.conditions, s.lines FROM mentions m"
+               " JOIN sets s ON s.set_id = m.set_id WHERE m.config = ?")
+        params = [cfg]
+        if value is not None:
+            sql += " AND m.value = ?"
+            params.append(value)
+        return [(set_id, v, tuple(c for c in conds.split(";") if c), n)
+                for set_id, v, conds, n in self.conn.execute(sql + " ORDER BY m.set_id", params)]
+
+    def gated(self, cfg, value=None):
+        """cfg 管着的行：{文件: [(start, end, set_id), ...]}"""
+        sql = ("SELECT DISTINCT b.file, b.start_line, b.end_line, b.set_id FROM mentions m"
+               " JOIN blocks b ON b.set_id = m.set_id WHERE m.config = ?")
+        params = [cfg]
+        if value is not None:
+            sql += " AND m.value = ?"
+            params.append(value)
+        files = {}
+        for path, start, end, set_id in self.conn.execute(sql + " ORDER BY b.file, b.start_line", params):
+            files.setdefault(path, []).append((start, end, set_id))
+        return files
+
+    def config_stats(self, cfg, config_map=None, module_as_built=False):
+        """
+        cfg 各取值管着多少行：{取值: [行数, 编译行数, 未编译行数]}（没给 config_map 时后两项为 None）。
+        取值 None 表示表达式/否定形式里提到的；一个集合提到同一个 CONFIG 的多种写法时各算一次。
+        """
+        evaluator = ConditionEvaluator(config_map, module_as_built) if config_map is not None else None
+        stats = {}
+        for _, value, conds, n in self.sets_for(cfg):
+            entry = stats.setdefault(value, [0, None, None] if evaluator is None else [0, 0, 0])
+            entry[0] += n
+            if evaluator is not None:
+                entry[1 if evaluator.check(conds) else 2] += n
+        return stats
+
+    def close(self):
+        self.conn.close()
+
+if __name__ == "__main__":
+    import argparse
+    from config_loader import parse_config_file
+    from line_mapping import LineMapping
+
+    ap = argparse.ArgumentParser(description="查询 CONFIG 管着哪些文件、哪些行")
+    ap.add_argument("index", help="fileline_index.sqlite")
+    ap.add_argument("configs", nargs="*", help="要查询的 CONFIG，可写成 CONFIG_X=值 只看某个取值")
+    ap.add_argument("--build", metavar="FILELINE_OUTPUT", help="先从 fileline_output.csv（或 .cols）建索引")
+    ap.add_argument("--config", help="同时按这个 .config 统计编译/未编译的行数")
+    ap.add_argument("--module-as-built", action="store_true", help="=y 的条件也被 =m 满足")
+    args = ap.parse_args()
+
+    if args.build:
+        write_index(LineMapping.load(args.build), args.index)
+    store = IndexStore(args.index)
+    config_map = parse_config_file(args.config) if args.config else None
+    for query in args.configs:
+        cfg, _, value = query.partition("=")
+        value = value or None
+        for v, (n, n_compiled, n_skipped) in sorted(store.config_stats(cfg, config_map, args.module_as_built).items(),
+                                                    key=lambda x: (x[0] is None, x[0] or "")):
+            if value is not None and v != value:
+                continue
+            extra = f"，编译 {n_compiled}，未编译 {n_skipped}" if n_compiled is not None else ""
+            print(f"[INFO] {cfg}={v if v is not None else '(表达式)'}: {n} 行{extra}")
+        for path, ranges in store.gated(cfg, value).items():
+            merged = []
+            for start, end, _ in ranges:
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            print(f"{path}: " + ", ".join(f"{s}-{e}" if s != e else f"{s}" for s, e in merged))
+    store.close()
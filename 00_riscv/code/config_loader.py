@@ -0,0 +1,168 @@
+"""
+.config 读取（score_config.py / score_config_v3.py / analyze_skipped.py 等共用）。
+
+    parse_config_file(path)     -> {CONFIG_KEY: value}，"# CONFIG_X is not set" 记为 "n"
+    ConfigMatrix.load(paths)    -> 多个 .config 一次读进 [符号, 配置] 的取值编码矩阵（需要 numpy），
+                                   扫参数时按列比较取值，不用逐个 dict 判断
+
+缓存默认关闭，传 cache="mtime"（按 路径+mtime+大小 失效）或 cache="hash"（按内容 sha256）打开
+（命令行上是 --config-cache），之后同一个 .config 在不同工具、不同次运行之间只解析一次。
+mtime 精度粗的文件系统上同一秒内改过的 .config 可能读到旧结果，这时用 hash。
+缓存是 JSON（只有 {CONFIG: 值}，不用 pickle，读到别人放的文件也不会执行代码），
+目录默认 ~/.cache/score_config，可以用环境变量 SCORE_CONFIG_CACHE 改，设为空字符串关闭。
+"""
+import hashlib
+import json
+import os
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NOT_SET_RE = re.compile(r"#\s*(CONFIG_[A-Za-z0-9_]+)\s+is\s+not\s+set")
+NOT_SET_SUFFIX = " is not set"
+CACHE_VERSION = 2
+CACHE_MODES = ("mtime", "hash")
+
+def parse_config_text(text):
+    """解析 .config 的内容（与原来逐行 re.match 的结果相同，常见的 "# CONFIG_X is not set" 不走正则）"""
+    config_map = {}
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] == "#":
+            if "CONFIG_" not in line:
+                continue
+            # 常见写法直接切片，名字只含 [A-Za-z0-9_] 时与正则的结果相同
+            if line.startswith("# CONFIG_") and line.endswith(NOT_SET_SUFFIX):
+                name = line[2:-len(NOT_SET_SUFFIX)]
+                if name.isascii() and name.replace("_", "").isalnum():
+                    config_map[name] = "n"
+                    continue
+            m = NOT_SET_RE.match(line)
+            if m:
+                config_map[m.group(1)] = "n"
+            continue
+        if "=" in line:
+            k, v = line.split("=", 1)
+            config_map[k.strip()] = v.strip()
+    return config_map
+
+def cache_dir():
+    path = os.environ.get("SCORE_CONFIG_CACHE")
+    if path is None:
+        path = os.path.join(os.path.expanduser("~"), ".cache", "score_config")
+    return path or None
+
+def _read_cache(path, stamp):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or entry.get("version") != CACHE_VERSION or entry.get("stamp") != stamp:
+        return None
+    config_map = entry.get("config")
+    if not isinstance(config_map, dict) or not all(isinstance(v, str) for v in config_map.values()):
+        return None
+    return config_map
+
+def _write_cache(path, stamp, config_map):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": CACHE_VERSION, "stamp": stamp, "config": config_map}, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _read_text(data):
+    # 与文本模式读取相同：\r\n、\r 统一成 \n，非法 UTF-8 忽略
+    return data.decode("utf-8", errors="ignore").replace("\r\n", "\n").replace("\r", "\n")
+
+def parse_config_file(config_path, cache=None):
+    """
+    解析 .config 文件，返回 {CONFIG_KEY: value}。
+    cache: None（默认，不缓存）、"mtime"（路径 + mtime + 大小）或 "hash"（内容 sha256，复制到别处的同一份 .config 也能命中）
+    """
+    if cache is not None and cache not in CACHE_MODES:
+        raise ValueError(f"未知的缓存方式: {cache}")
+    directory = cache_dir() if cache else None
+    if directory is None:
+        with open(config_path, "rb") as f:
+            return parse_config_text(_read_text(f.read()))
+
+    if cache == "hash":
+        with open(config_path, "rb") as f:
+            data = f.read()
+        stamp = hashlib.sha256(data).hexdigest()
+        entry = os.path.join(directory, f"sha256-{stamp}.json")
+    else:
+        data = None
+        real = os.path.realpath(config_path)
+        st = os.stat(real)
+        stamp = [real, st.st_mtime_ns, st.st_size]
+        entry = os.path.join(directory, f"path-{hashlib.sha1(real.encode()).hexdigest()}.json")
+
+    config_map = _read_cache(entry, stamp)
+    if config_map is not None:
+        return config_map
+    if data is None:
+        with open(config_path, "rb") as f:
+            data = f.read()
+    config_map = parse_config_text(_read_text(data))
+    _write_cache(entry, stamp, config_map)
+    return config_map
+
+class ConfigMatrix:
+    """
+    多个 .config 的取值矩阵：codes[symbol_id, config] 是 values 里的下标，-1 表示该 .config 没有这个符号。
+    """
+
+    def __init__(self, paths, symbols, values, codes):
+        self.paths = list(paths)
+        self.symbols = symbols
+        self.values = values
+        self.codes = codes
+        self.symbol_ids = {s: i for i, s in enumerate(symbols)}
+        self.value_ids = {v: i for i, v in enumerate(values)}
+
+    @classmethod
+    def load(cls, paths, cache=None):
+        if np is None:
+            raise ImportError("ConfigMatrix 需要 numpy")
+        maps = [parse_config_file(p, cache=cache) for p in paths]
+        symbol_ids, value_ids = {}, {}
+        entries = []
+        for c, config_map in enumerate(maps):
+            for k, v in config_map.items():
+                entries.append((symbol_ids.setdefault(k, len(symbol_ids)), c, value_ids.setdefault(v, len(value_ids))))
+        codes = np.full((len(symbol_ids), len(maps)), -1, dtype=np.int32)
+        if entries:
+            rows, cols, vals = np.asarray(entries, dtype=np.int64).T
+            codes[rows, cols] = vals
+        return cls(paths, list(symbol_ids), list(value_ids), codes)
+
+    def config_map(self, c):
+        """第 c 个 .config 的 {CONFIG: 值}"""
+        col = self.codes[:, c]
+        present = np.nonzero(col >= 0)[0]
+        return {self.symbols[i]: self.values[col[i]] for i in present.tolist()}
+
+    def matches(self, symbol, values):
+        """每个 .config 中 symbol 的取值是否在 values 里（没有这个符号按 "n" 算）：bool 数组 [config]"""
+        n_configs = len(self.paths)
+        sid = self.symbol_ids.get(symbol)
+        missing_ok = "n" in values
+        if sid is None:
+            return np.full(n_configs, missing_ok, dtype=bool)
+        row = self.codes[sid]
+        hit = np.isin(row, [self.value_ids[v] for v in values if v in self.value_ids])
+        if missing_ok:
+            hit |= row < 0
+        return hit
@@ -0,0 +1,312 @@
+"""
+贪心配置优化：在 fileline_output（行 -> 条件集合）上，找能让更多代码行被编译进内核的 CONFIG 翻转。
+
+做法：
+    1. 每个条件集合编译成判断函数（cond_eval），按当前 .config 记下它是否被编译、覆盖多少行；
+    2. 建倒排索引 CONFIG -> 引用它的条件集合，评估一次翻转只重新判断这些集合（增量，不重算全表）；
+    3. 翻转要过 Kconfig 依赖检查：configtree.json（与 gen_kconfig_graph.py 相同，{CONFIG: [它依赖的 CONFIG, ...]}）
+       打开一个 CONFIG 时把关闭着的祖先一起打开，关闭一个 CONFIG 时把打开着的后代一起关闭，整组一起评估；
+    4. 每轮取净增行数最多的一组翻转应用，只重算受影响的候选，直到没有正收益或达到上限。
+
+结果只是建议：写出的 .config 还需要 make olddefconfig 过一遍 Kconfig（select、范围等这里不检查），再重新打分。
+
+用法：
+    python config_optimizer.py fileline_merged.csv .config --configtree configtree.json --max-flips 50
+"""
+import csv
+import json
+import re
+import time
+
+from config_index import ConfigIndex
+from line_mapping import LineMapping
+
+# 由工具链/体系结构决定、不能在 .config 里直接改的符号
+DEFAULT_FREEZE = r"^CONFIG_(CC_|AS_|LD_|RUSTC_|TOOLS_|PAHOLE_|GCC_|CLANG_|HAVE_|ARCH_HAS_)|_VERSION$"
+
+def is_enabled(value):
+    return value not in (None, "", "n")
+
+def load_config_tree(path):
+    """读 configtree.json，返回 {CONFIG_X: [CONFIG_依赖, ...]}（名字统一补上 CONFIG_ 前缀）"""
+    def norm(name):
+        name = name.strip()
+        return name if name.startswith("CONFIG_") else "CONFIG_" + name
+
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    tree = {}
+    for cfg, parents in raw.items():
+        tree[norm(cfg)] = [norm(p) for p in parents or [] if re.fullmatch(r"(CONFIG_)?[A-Za-z0-9_]+", p.strip())]
+    return tree
+
+class DependencyTree:
+    """Kconfig 依赖闭包：ancestors 是打开时需要一起打开的，descendants 是关闭时需要一起关闭的"""
+
+    def __init__(self, tree=None):
+        self.parents = tree or {}
+        self.children = {}
+        for cfg, parents in self.parents.items():
+            for p in parents:
+                self.children.setdefault(p, []).append(cfg)
+        self._ancestors = {}
+        self._descendants = {}
+
+    @staticmethod
+    def _closure(start, edges):
+        seen = set()
+        stack = list(edges.get(start, ()))
+        while stack:
+            cfg = stack.pop()
+            if cfg in seen or cfg == start:
+                continue
+            seen.add(cfg)
+            stack.extend(edges.get(cfg, ()))
+        return frozenset(seen)
+
+    def ancestors(self, cfg):
+        if cfg not in self._ancestors:
+            self._ancestors[cfg] = self._closure(cfg, self.parents)
+        return self._ancestors[cfg]
+
+    def descendants(self, cfg):
+        if cfg not in self._descendants:
+            self._descendants[cfg] = self._closure(cfg, self.children)
+        return self._descendants[cfg]
+
+class ConfigOptimizer:
+    """
+    mapping: LineMapping（或 {file:line -> [条件, ...]}）
+    config_map: 起始 .config 的 {CONFIG: 值}，优化过程中原地修改为当前配置
+    """
+
+    def __init__(self, mapping, config_map, tree=None, module_as_built=False, freeze=DEFAULT_FREEZE):
+        if not isinstance(mapping, LineMapping):
+            mapping = LineMapping.from_fileline_dict(mapping)
+        self.config = dict(config_map)
+        self.deps = DependencyTree(tree)
+        self.freeze_re = re.compile(freeze) if freeze else None
+        self.n_evals = 0
+
+        idx = ConfigIndex(mapping, module_as_built)
+        self.predicates = idx.predicates   # sid -> 判断函数
+        self.weights = idx.weights         # sid -> 行数
+        self.set_syms = idx.set_syms       # sid -> 引用的 CONFIG
+        self.index = idx.by_config         # CONFIG -> [sid, ...]
+        self.values = {k: idx.candidate_values(k) for k in idx.index}  # CONFIG -> 可以尝试的取值
+        self.always = idx.always           # 无条件的行
+        self.total_lines = idx.total_lines
+        self.compiled = idx.compiled_flags(self.config)
+
+    def frozen(self, cfg):
+        return bool(self.freeze_re and self.freeze_re.search(cfg))
+
+    def compiled_lines(self):
+        return self.always + sum(w for w, ok in zip(self.weights, self.compiled) if ok)
+
+    def bundle(self, cfg, value):
+        """把 cfg 设为 value 需要一起做的翻转 {CONFIG: 值}；依赖里有冻结的符号挡着时返回 None"""
+        flips = {cfg: value}
+        if is_enabled(value):
+            for a in self.deps.ancestors(cfg):
+                cur = self.config.get(a, "n")
+                if not is_enabled(cur) or (value == "y" and cur == "m"):
+                    if self.frozen(a):
+                        return None
+                    flips[a] = "y"
+        else:
+            for d in self.deps.descendants(cfg):
+                if is_enabled(self.config.get(d, "n")):
+                    if self.frozen(d):
+                        return None
+                    flips[d] = "n"
+        return flips
+
+    def affected_sets(self, flips):
+        sets = set()
+        for k in flips:
+            sets.update(self.index.get(k, ()))
+        return sets
+
+    def gain(self, flips):
+        """一组翻转的 (新编译行数, 丢失行数, 受影响的集合)，只重新判断引用了这些 CONFIG 的集合"""
+        sets = self.affected_sets(flips)
+        saved = {k: self.config.get(k) for k in flips}
+        self.config.update(flips)
+        won = lost = 0
+        try:
+            for sid in sets:
+                ok = bool(self.predicates[sid](self.config))
+                if ok != self.compiled[sid]:
+                    if ok:
+                        won += self.weights[sid]
+                    else:
+                        lost += self.weights[sid]
+        finally:
+            for k, v in saved.items():
+                if v is None:
+                    del self.config[k]
+                else:
+                    self.config[k] = v
+        self.n_evals += 1
+        return won, lost, sets
+
+    def apply(self, flips):
+        self.config.update(flips)
+        for sid in self.affected_sets(flips):
+            self.compiled[sid] = bool(self.predicates[sid](self.config))
+
+    def candidates(self):
+        """所有可尝试的 (CONFIG, 值)：条件里出现过、不是当前值、没有被冻结"""
+        for cfg in sorted(self.values):
+            if self.frozen(cfg):
+                continue
+            for value in sorted(self.values[cfg]):
+                if value != self.config.get(cfg, "n"):
+                    yield cfg, value
+
+    def evaluate(self, cfg, value):
+        """
+        评估一个候选，返回 (净增行数, 新编译, 丢失, 翻转组, 依赖的 CONFIG) 或 None（不可行）。
+        依赖的 CONFIG 变了值，这个结果就要重算：依赖闭包 + 受影响集合引用的所有 CONFIG。
+        """
+        flips = self.bundle(cfg, value)
+        closure = self.deps.ancestors(cfg) if is_enabled(value) else self.deps.descendants(cfg)
+        if flips is None:
+            return None, closure | {cfg}
+        won, lost, sets = self.gain(flips)
+        depends = set(closure)
+        depends.add(cfg)
+        for sid in sets:
+            depends.update(self.set_syms[sid])
+        return (won - lost, won, lost, flips), depends
+
+    def rank(self):
+        """当前配置下所有候选的边际收益，按净增行数从大到小：[(CONFIG, 值, 净增, 新编译, 丢失, 翻转组), ...]"""
+        ranked = []
+        for cfg, value in self.candidates():
+            result, _ = self.evaluate(cfg, value)
+            if result is not None:
+                ranked.append((cfg, value) + result)
+        ranked.sort(key=lambda r: (-r[2], r[0], r[1]))
+        return ranked
+
+    def optimize(self, max_flips=50, min_gain=1):
+        """
+        贪心：每轮应用净增行数最多的一组翻转。某组翻转改了哪些 CONFIG，就只重算依赖这些 CONFIG 的候选。
+        返回 [(步骤, CONFIG, 值, 翻转组, 净增, 累计编译行数), ...]
+        """
+        cache = {}      # (CONFIG, 值) -> 评估结果（None 表示不可行）
+        watchers = {}   # CONFIG -> 依赖它的候选
+        stale = set(self.candidates())
+        steps = []
+        compiled = self.compiled_lines()
+        started = time.time()
+        while len(steps) < max_flips:
+            for cand in stale:
+                if self.frozen(cand[0]) or cand[1] == self.config.get(cand[0], "n"):
+                    cache.pop(cand, None)
+                    continue
+                result, depends = self.evaluate(*cand)
+                cache[cand] = result
+                for k in depends:
+                    watchers.setdefault(k, set()).add(cand)
+            stale = set()
+            viable = [(-r[0], cand) for cand, r in cache.items() if r is not None and r[0] >= min_gain]
+            if not viable:
+                break
+            _, (cfg, value) = min(viable)
+            net, won, lost, flips = cache[(cfg, value)]
+            self.apply(flips)
+            compiled += net
+            steps.append((len(steps) + 1, cfg, value, flips, net, compiled))
+            print(f"[INFO] 第 {len(steps)} 步: {cfg}={value} +{won}/-{lost} 行，"
+                  f"累计 {compiled}/{self.total_lines}")
+            for k in flips:
+                stale.update(watchers.pop(k, ()))
+                for v in self.values.get(k, ()):
+                    stale.add((k, v))
+        elapsed = time.time() - started
+        rate = self.n_evals / elapsed if elapsed > 0 else 0
+        print(f"[INFO] 共评估 {self.n_evals} 次翻转（{rate:.0f} 次/秒），应用 {len(steps)} 组")
+        return steps
+
+def format_flips(flips, cfg):
+    """翻转组里除 cfg 本身以外的连带翻转，写成 "CONFIG_A=y;CONFIG_B=n" """
+    return ";".join(f"{k}={v}" for k, v in sorted(flips.items()) if k != cfg)
+
+def write_config(base_path, out_path, config_map):
+    """按 base_path 的顺序写出 .config：改过的行替换，新增的追加在末尾"""
+    seen = set()
+    out = []
+    with open(base_path, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            m = re.match(r"^(CONFIG_[A-Za-z0-9_]+)=|^#\s*(CONFIG_[A-Za-z0-9_]+)\s+is\s+not\s+set", line)
+            k = m and (m.group(1) or m.group(2))
+            if k and k in config_map:
+                seen.add(k)
+                v = config_map[k]
+                line = f"# {k} is not set\n" if v == "n" else f"{k}={v}\n"
+            out.append(line)
+    for k in sorted(set(config_map) - seen):
+        v = config_map[k]
+        out.append(f"# {k} is not set\n" if v == "n" else f"{k}={v}\n")
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.writelines(out)
+
+def run_optimizer(mapping, config_path, config_map, tree_path=None, max_flips=50, module_as_built=False,
+                  freeze=DEFAULT_FREEZE, out_candidates="optimize_candidates.csv",
+                  out_steps="optimize_steps.csv", out_config="optimized.config"):
+    """
+    输出:
+        out_candidates: 起始配置下每个候选翻转的边际收益（按净增行数排序）
+        out_steps: 贪心每一步应用的翻转
+        out_config: 应用全部翻转后的 .config（需要再 make olddefconfig）
+    """
+    tree = None
+    if tree_path:
+        tree = load_config_tree(tree_path)
+        print(f"[INFO] 读取 Kconfig 依赖: {len(tree)} 个符号")
+    else:
+        print("[WARN] 没有 configtree.json，不检查 Kconfig 依赖")
+    opt = ConfigOptimizer(mapping, config_map, tree=tree, module_as_built=module_as_built, freeze=freeze)
+    before = opt.compiled_lines()
+    print(f"[INFO] 起始配置编译行数: {before}/{opt.total_lines}，条件集合 {len(opt.predicates)} 个")
+
+    ranked = opt.rank()
+    with open(out_candidates, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["config", "value", "current", "gain_lines", "compiled_lines", "lost_lines", "requires"])
+        for cfg, value, net, won, lost, flips in ranked:
+            if won or lost:
+                w.writerow([cfg, value, opt.config.get(cfg, "n"), net, won, lost, format_flips(flips, cfg)])
+
+    steps = opt.optimize(max_flips=max_flips)
+    with open(out_steps, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["step", "config", "value", "requires", "gain_lines", "total_compiled"])
+        for step, cfg, value, flips, net, compiled in steps:
+            w.writerow([step, cfg, value, format_flips(flips, cfg), net, compiled])
+
+    write_config(config_path, out_config, opt.config)
+    after = opt.compiled_lines()
+    print(f"[INFO] 优化后编译行数: {after}/{opt.total_lines}（+{after - before}），"
+          f"输出: {out_candidates}, {out_steps}, {out_config}")
+    return steps
+
+if __name__ == "__main__":
+    import argparse
+    from config_loader import parse_config_file
+
+    ap = argparse.ArgumentParser(description="贪心地找能让更多行被编译进内核的 CONFIG 翻转")
+    ap.add_argument("fileline_output", help="score_config_v3.py 生成的 fileline_merged.csv（或 .cols），即合并 kbuildparser 结果后、打分用的映射")
+    ap.add_argument("config", help="起始 .config")
+    ap.add_argument("--configtree", help="Kconfig 依赖树 configtree.json（与 gen_kconfig_graph.py 相同）")
+    ap.add_argument("--max-flips", type=int, default=50, help="最多应用多少组翻转")
+    ap.add_argument("--freeze", default=DEFAULT_FREEZE, help="不参与翻转的符号（正则），传空字符串不冻结")
+    ap.add_argument("--module-as-built", action="store_true", help="=y 的条件也被 =m 满足")
+    args = ap.parse_args()
+
+    run_optimizer(LineMapping.load(args.fileline_output), args.config, parse_config_file(args.config),
+                  tree_path=args.configtree, max_flips=args.max_flips,
+                  module_as_built=args.module_as_built, freeze=args.freeze)
@@ -0,0 +1,114 @@
+"""
+what-if 查询：把某个 CONFIG 改成别的值，会多编译/少编译多少行，落在哪些文件。
+
+不用复制 .config 再跑一遍 evaluate_compilation：用 config_index 的倒排索引找出提到这些 CONFIG 的条件集合，
+只重新判断它们，按集合覆盖的 {文件: 行数} 累加差值。
+
+用法：
+    python config_whatif.py fileline_merged.csv .config CONFIG_KVM=y CONFIG_SMP CONFIG_A=y,CONFIG_B=m
+    每个参数是一次独立的查询：CONFIG_X=值，只写 CONFIG_X 表示在 y/n 之间翻转，逗号连接的几项一起改。
+    映射用 fileline_merged.csv（合并 kbuildparser 结果后的映射），这样差值与 score_config_v3.py 的编译/未编译行数一致；
+    fileline_output.csv 是合并前的映射。
+输出 whatif.csv：toggle, file, compiled_delta, skipped_delta（正数表示增加）
+"""
+import csv
+
+from config_index import ConfigIndex
+from line_mapping import LineMapping
+
+class WhatIf:
+    """在某个 .config 上做 what-if 查询，config_map 不会被修改"""
+
+    def __init__(self, mapping, config_map, module_as_built=False, index=None):
+        if not isinstance(mapping, LineMapping):
+            mapping = LineMapping.from_fileline_dict(mapping)
+        self.index = index or ConfigIndex(mapping, module_as_built)
+        self.config = dict(config_map)
+        self.compiled = self.index.compiled_flags(self.config)
+
+    def compiled_lines(self):
+        idx = self.index
+        return idx.always + sum(w for w, ok in zip(idx.weights, self.compiled) if ok)
+
+    def parse_toggle(self, text):
+        """"CONFIG_A=y,CONFIG_B" -> {CONFIG_A: y, CONFIG_B: 与当前相反的 y/n}"""
+        flips = {}
+        for item in text.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            if "=" in item:
+                k, v = item.split("=", 1)
+                flips[k.strip()] = v.strip()
+            else:
+                flips[item] = "n" if self.config.get(item, "n") not in ("", "n") else "y"
+        return flips
+
+    def delta(self, flips):
+        """
+        flips: {CONFIG: 新值}
+        返回 (编译行数差, 未编译行数差, {文件: (编译行数差, 未编译行数差)})
+        """
+        idx = self.index
+        sets = set()
+        for k in flips:
+            sets.update(idx.sets_for(k))
+        config = dict(self.config)
+        config.update(flips)
+        total = 0
+        files = {}
+        for sid in sets:
+            ok = bool(idx.predicates[sid](config))
+            if ok == self.compiled[sid]:
+                continue
+            sign = 1 if ok else -1
+            total += sign * idx.weights[sid]
+            for path, n in idx.set_files(sid).items():
+                files[path] = files.get(path, 0) + sign * n
+        return total, -total, {path: (d, -d) for path, d in files.items() if d}
+
+    def query(self, toggles):
+        """toggles: ["CONFIG_X=y", "CONFIG_Y", ...]，每项独立查询，返回 [(toggle, flips, delta), ...]"""
+        results = []
+        for toggle in toggles:
+            flips = self.parse_toggle(toggle)
+            results.append((toggle, flips, self.delta(flips)))
+        return results
+
+def write_whatif_csv(path, results):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["toggle", "file", "compiled_delta", "skipped_delta"])
+        for toggle, _, (d_compiled, d_skipped, files) in results:
+            w.writerow([toggle, "*", d_compiled, d_skipped])
+            for path, (fc, fs) in sorted(files.items(), key=lambda x: (-abs(x[1][0]), x[0])):
+                w.writerow([toggle, path, fc, fs])
+
+if __name__ == "__main__":
+    import argparse
+    from config_loader import parse_config_file
+
+    ap = argparse.ArgumentParser(description="查询改动若干 CONFIG 后编译/未编译行数的变化（按文件）")
+    ap.add_argument("fileline_output", help="score_config_v3.py 生成的 fileline_merged.csv（或 .cols），即合并 kbuildparser 结果后、打分用的映射")
+    ap.add_argument("config", help="当前的 .config")
+    ap.add_argument("toggles", nargs="*", help="CONFIG_X=值 / CONFIG_X（y/n 翻转）/ 逗号连接的一组")
+    ap.add_argument("--toggles-file", help="每行一个查询，与命令行上的写法相同")
+    ap.add_argument("--module-as-built", action="store_true", help="=y 的条件也被 =m 满足")
+    ap.add_argument("-o", "--output", default="whatif.csv", help="按文件的差值输出")
+    args = ap.parse_args()
+
+    toggles = list(args.toggles)
+    if args.toggles_file:
+        with open(args.toggles_file, "r", encoding="utf-8") as f:
+            toggles += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    if not toggles:
+        ap.error("至少需要一个查询")
+
+    whatif = WhatIf(LineMapping.load(args.fileline_output), parse_config_file(args.config),
+                    module_as_built=args.module_as_built)
+    print(f"[INFO] 当前编译行数: {whatif.compiled_lines()}/{whatif.index.total_lines}")
+    results = whatif.query(toggles)
+    for toggle, _, (d_compiled, _, files) in results:
+        print(f"[INFO] {toggle}: 编译行数 {d_compiled:+d}，涉及 {len(files)} 个文件")
+    write_whatif_csv(args.output, results)
+    print(f"[INFO] 输出: {args.output}")
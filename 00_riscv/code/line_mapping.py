@@ -0,0 +1,320 @@
+import os
+import bisect
+import csv
+from collections.abc import MutableMapping
+from columnar import np, encode_strings, is_columnar, read_columns, require_numpy, write_columns
+
+def split_fileline(fileline):
+    """"path:line" -> (path, int(line))"""
+    path, line = fileline.rsplit(":", 1)
+    return path, int(line)
+
+def lines_to_blocks(line_to_conds):
+    """{line: conds} -> [(start, end, conds), ...]，相邻且条件相同的行合并成一个区间"""
+    blocks = []
+    for line in sorted(line_to_conds):
+        conds = line_to_conds[line]
+        if blocks and blocks[-1][1] == line - 1 and blocks[-1][2] == conds:
+            blocks[-1] = (blocks[-1][0], line, conds)
+        else:
+            blocks.append((line, line, conds))
+    return blocks
+
+def iter_fileline_csv_rows(csv_path):
+    """
+    逐行读取 fileline_output.csv，兼容两种格式，统一产出 (file_line, output_lines)：
+        行格式:   file_line,output_lines
+        区间格式: file,start_line,end_line,output_lines
+    """
+    with open(csv_path, "r", encoding="utf-8") as f:
+        r = csv.DictReader(f)
+        if r.fieldnames and "start_line" in r.fieldnames:
+            for row in r:
+                for i in range(int(row["start_line"]), int(row["end_line"]) + 1):
+                    yield f"{row['file']}:{i}", row["output_lines"]
+        else:
+            for row in r:
+                yield row["file_line"], row["output_lines"]
+
+class LineMapping(MutableMapping):
+    """
+    FILE:LINE -> 条件 tuple 的紧凑表示。
+    - 条件集合 intern 成整数 ID：cond_sets[set_id] = ("CONFIG_X=y", ...)
+    - 每个文件一份按起始行排序、互不重叠的区间表：files[path] = [(start, end, set_id), ...]
+    一个 block 只占一个区间；对外仍可以像 {"path:line": conds} 一样按行读写。
+    """
+
+    def __init__(self):
+        self.cond_sets = []
+        self._set_ids = {}
+        self.files = {}
+        self._starts = {}
+        self._n_lines = 0
+        self._sorted_paths = None
+
+    @classmethod
+    def from_fileline_dict(cls, fileline_to_output):
+        """{"path:line": conds} -> LineMapping"""
+        per_file = {}
+        for fileline, conds in fileline_to_output.items():
+            path, line = split_fileline(fileline)
+            per_file.setdefault(path, {})[line] = tuple(conds)
+        mapping = cls()
+        for path, line_to_conds in per_file.items():
+            mapping.set_file_blocks(path, lines_to_blocks(line_to_conds))
+        return mapping
+
+    @classmethod
+    def load_csv(cls, csv_path):
+        """读取 fileline_output.csv（行格式或区间格式）"""
+        per_file = {}
+        for fileline, output_lines in iter_fileline_csv_rows(csv_path):
+            path, line = split_fileline(fileline)
+            conds = tuple(c for c in output_lines.split(";") if c) if output_lines else ()
+            per_file.setdefault(path, {})[line] = conds
+        mapping = cls()
+        for path, line_to_conds in per_file.items():
+            mapping.set_file_blocks(path, lines_to_blocks(line_to_conds))
+        return mapping
+
+    @classmethod
+    def load(cls, path):
+        """按路径类型读取：列式目录或 CSV"""
+        if is_columnar(path):
+            return cls.load_columnar(path)
+        return cls.load_csv(path)
+
+    @classmethod
+    def load_columnar(cls, path):
+        """读取 write_columnar 写出的列式目录"""
+        meta, arrays = read_columns(path)
+        configs = meta["categories"]["lit_cfg"]
+        values = meta["categories"]["lit_val"]
+        lit_strings = []
+        for c, v in zip(arrays["lit_cfg"].tolist(), arrays["lit_val"].tolist()):
+            lit_strings.append(configs[c] if v < 0 else f"{configs[c]}={values[v]}")
+        indptr = arrays["set_indptr"].tolist()
+        set_lits = arrays["set_lits"].tolist()
+
+        mapping = cls()
+        for set_id in range(len(indptr) - 1):
+            mapping.intern(lit_strings[i] for i in set_lits[indptr[set_id]:indptr[set_id + 1]])
+        paths = meta["categories"]["file"]
+        per_file = {}
+        for f, start, end, set_id in zip(arrays["file"].tolist(), arrays["start_line"].tolist(),
+                                         arrays["end_line"].tolist(), arrays["set_id"].tolist()):
+            per_file.setdefault(paths[f], []).append((start, end, set_id))
+        for path_, intervals in per_file.items():
+            mapping.set_file_intervals(path_, intervals)
+        return mapping
+
+    def copy(self):
+        other = LineMapping()
+        other.cond_sets = list(self.cond_sets)
+        other._set_ids = dict(self._set_ids)
+        other.files = {p: list(iv) for p, iv in self.files.items()}
+        other._starts = {p: list(s) for p, s in self._starts.items()}
+        other._n_lines = self._n_lines
+        return other
+
+    def intern(self, conds):
+        """条件 tuple -> set_id（相同的条件集合共用一个 ID）"""
+        conds = tuple(conds)
+        set_id = self._set_ids.get(conds)
+        if set_id is None:
+            set_id = len(self.cond_sets)
+            self.cond_sets.append(conds)
+            self._set_ids[conds] = set_id
+        return set_id
+
+    # --- 区间操作 ---
+
+    def set_file_blocks(self, path, blocks):
+        """用 [(start, end, conds), ...] 替换 path 的全部区间"""
+        self.set_file_intervals(path, [(s, e, self.intern(c)) for s, e, c in blocks])
+
+    def set_file_intervals(self, path, intervals):
+        """用 [(start, end, set_id), ...] 替换 path 的全部区间，相邻且条件相同的区间会被合并"""
+        merged = []
+        for start, end, set_id in sorted(intervals):
+            if merged and merged[-1][1] + 1 == start and merged[-1][2] == set_id:
+                merged[-1] = (merged[-1][0], end, set_id)
+            else:
+                merged.append((start, end, set_id))
+        if bool(merged) != (path in self.files):
+            self._sorted_paths = None
+        for start, end, _ in self.files.pop(path, ()):
+            self._n_lines -= end - start + 1
+        self._starts.pop(path, None)
+        if merged:
+            self.files[path] = merged
+            self._starts[path] = [s for s, _, _ in merged]
+            for start, end, _ in merged:
+                self._n_lines += end - start + 1
+
+    def file_intervals(self, path):
+        return self.files.get(path, [])
+
+    def files_under(self, prefix):
+        """映射中路径以 prefix 开头的所有文件（按路径排序，二分定位）"""
+        if self._sorted_paths is None:
+            self._sorted_paths = sorted(self.files)
+        i = bisect.bisect_left(self._sorted_paths, prefix)
+        result = []
+        while i < len(self._sorted_paths) and self._sorted_paths[i].startswith(prefix):
+            result.append(self._sorted_paths[i])
+            i += 1
+        return result
+
+    def lookup(self, path, line):
+        """点查询：返回 path:line 的 set_id，不在映射中时返回 None"""
+        starts = self._starts.get(path)
+        if not starts:
+            return None
+        i = bisect.bisect_right(starts, line) - 1
+        if i < 0:
+            return None
+        _, end, set_id = self.files[path][i]
+        return set_id if line <= end else None
+
+    def iter_blocks(self):
+        """逐区间遍历：(path, start, end, set_id)"""
+        for path, intervals in self.files.items():
+            for start, end, set_id in intervals:
+                yield path, start, end, set_id
+
+    def iter_lines(self):
+        """逐行遍历：("path:line", conds)，比按键逐个查询快"""
+        for path, start, end, set_id in self.iter_blocks():
+            conds = self.cond_sets[set_id]
+            for i in range(start, end + 1):
+                yield f"{path}:{i}", conds
+
+    def set_line_counts(self):
+        """每个条件集合覆盖的行数：counts[set_id]，统计时按集合计算一次再乘以行数"""
+        counts = [0] * len(self.cond_sets)
+        for _, start, end, set_id in self.iter_blocks():
+            counts[set_id] += end - start + 1
+        return counts
+
+    def block_count(self):
+        return sum(len(iv) for iv in self.files.values())
+
+    def _set_line(self, path, line, set_id):
+        intervals = []
+        for start, end, sid in self.files.get(path, ()):
+            if start <= line <= end:
+                if start < line:
+                    intervals.append((start, line - 1, sid))
+                if line < end:
+                    intervals.append((line + 1, end, sid))
+            else:
+                intervals.append((start, end, sid))
+        if set_id is not None:
+            intervals.append((line, line, set_id))
+        self.set_file_intervals(path, intervals)
+
+    # --- 兼容 {"path:line": conds} 的按行接口 ---
+
+    def __getitem__(self, fileline):
+        path, line = split_fileline(fileline)
+        set_id = self.lookup(path, line)
+        if set_id is None:
+            raise KeyError(fileline)
+        return self.cond_sets[set_id]
+
+    def __setitem__(self, fileline, conds):
+        path, line = split_fileline(fileline)
+        self._set_line(path, line, self.intern(conds))
+
+    def __delitem__(self, fileline):
+        path, line = split_fileline(fileline)
+        if self.lookup(path, line) is None:
+            raise KeyError(fileline)
+        self._set_line(path, line, None)
+
+    def __contains__(self, fileline):
+        try:
+            path, line = split_fileline(fileline)
+        except (AttributeError, ValueError):
+            return False
+        return self.lookup(path, line) is not None
+
+    def __iter__(self):
+        for path, start, end, _ in self.iter_blocks():
+            for i in range(start, end + 1):
+                yield f"{path}:{i}"
+
+    def __len__(self):
+        return self._n_lines
+
+    # --- CSV ---
+
+    def write_csv(self, csv_path, fmt="lines"):
+        """
+        fmt="lines":  旧格式，每行一条 file_line,output_lines
+        fmt="blocks": 区间格式，每个区间一条 file,start_line,end_line,output_lines
+        先写临时文件再改名，中途被打断时不会留下半个 CSV。
+        """
+        tmp_path = csv_path + ".tmp"
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if fmt == "lines":
+                writer.writerow(["file_line", "output_lines"])
+                for fl, conds in self.iter_lines():
+                    writer.writerow([fl, ";".join(conds)])
+            elif fmt == "blocks":
+                writer.writerow(["file", "start_line", "end_line", "output_lines"])
+                for path, start, end, set_id in self.iter_blocks():
+                    writer.writerow([path, start, end, ";".join(self.cond_sets[set_id])])
+            else:
+                raise ValueError(f"未知的 CSV 格式: {fmt}")
+        os.replace(tmp_path, csv_path)
+
+    def write(self, path, fmt="lines"):
+        """fmt 为 "lines"/"blocks" 时写 CSV，为 "columnar" 时写列式目录"""
+        if fmt == "columnar":
+            self.write_columnar(path)
+        else:
+            self.write_csv(path, fmt=fmt)
+
+    def write_columnar(self, path):
+        """
+        写列式目录（需要 numpy）：
+            区间表: file(字典编码) / start_line / end_line / set_id
+            条件集合: CSR 形式 set_indptr / set_lits，指向字面量表
+            字面量表: lit_cfg / lit_val，配置名和取值分别字典编码（没有 "=" 的条件 lit_val 为 -1）
+        """
+        require_numpy()
+        literal_ids, lit_cfg, lit_val = {}, [], []
+        cfg_ids, val_ids = {}, {}
+        indptr, set_lits = [0], []
+        for conds in self.cond_sets:
+            for cond in conds:
+                lit = literal_ids.get(cond)
+                if lit is None:
+                    lit = literal_ids[cond] = len(lit_cfg)
+                    if "=" in cond:
+                        k, v = cond.split("=", 1)
+                        lit_cfg.append(cfg_ids.setdefault(k, len(cfg_ids)))
+                        lit_val.append(val_ids.setdefault(v, len(val_ids)))
+                    else:
+                        lit_cfg.append(cfg_ids.setdefault(cond, len(cfg_ids)))
+                        lit_val.append(-1)
+                set_lits.append(lit)
+            indptr.append(len(set_lits))
+
+        blocks = list(self.iter_blocks())
+        file_codes, paths = encode_strings([b[0] for b in blocks])
+        arrays = {
+            "file": file_codes,
+            "start_line": np.asarray([b[1] for b in blocks], dtype=np.int32),
+            "end_line": np.asarray([b[2] for b in blocks], dtype=np.int32),
+            "set_id": np.asarray([b[3] for b in blocks], dtype=np.int32),
+            "set_indptr": np.asarray(indptr, dtype=np.int64),
+            "set_lits": np.asarray(set_lits, dtype=np.int32),
+            "lit_cfg": np.asarray(lit_cfg, dtype=np.int32),
+            "lit_val": np.asarray(lit_val, dtype=np.int32),
+        }
+        categories = {"file": paths, "lit_cfg": list(cfg_ids), "lit_val": list(val_ids)}
+        write_columns(path, "fileline_mapping", arrays, categories)
@@ -1,32 +1,129 @@
 import os
+import re
 import csv
+import bisect
+import hashlib
 import subprocess
 
-def count_source_lines(root="arch/riscv"):
-    exts = {".c", ".S", ".h"}
-    total_lines = 0
-    total_nonempty_lines = 0
-    file_line_counts = {}
+SOURCE_EXTS = {".c", ".S", ".h"}
+NEEDS_DECODE_RE = re.compile(rb"[\x1c-\x1f\x80-\xff]")
 
-    for dirpath, _, filenames in os.walk(root):
-        for f in filenames:
-            _, ext = os.path.splitext(f)
-            if ext not in exts:
-                continue
+def count_bytes_lines(data):
+    """
+    在原始字节上数 (行数, 非空行数)，结果与文本模式 readlines() + l.strip() 相同，
+    但不需要解码、也不生成字符串列表。
+    """
+    if not data.isascii():
+        try:
+            data.decode("utf-8")
+        except UnicodeDecodeError:
+            # 非法字节在文本模式下会被丢掉，可能影响换行的判断，先按同样方式丢掉
+            data = data.decode("utf-8", errors="ignore").encode("utf-8")
+    if b"\r" in data:
+        # 与文本模式的通用换行一致：\r\n 和单独的 \r 都算换行
+        data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+    n_lines = data.count(b"\n")
+    if data and not data.endswith(b"\n"):
+        n_lines += 1
+    n_blank = 0
+    if n_lines:
+        body = data[:-1] if data.endswith(b"\n") else data
+        for l in body.split(b"\n"):
+            l = l.strip()
+            # 含非 ASCII / \x1c-\x1f 的行，str.strip() 的空白定义更宽，解码后再判断
+            if not l or (NEEDS_DECODE_RE.search(l) and not l.decode("utf-8", errors="ignore").strip()):
+                n_blank += 1
+    return n_lines, n_lines - n_blank
+
+class SourceInventory:
+    """
+    对 root 做一次 os.scandir 遍历得到的源文件清单，count_source_lines / analyze_riscv_arch /
+    update_mapping_from_kbuildparser_live 共用，避免同一棵树被反复遍历、反复读取。
+    entries[path] = (行数, 非空行数, 字节数)，path 是内核树相对路径（prefix + root 下的相对路径，
+    与 LineMapping 的键一致）。
+    prefix: root 在内核树中的位置，如 "arch/riscv"；root 是内核顶层目录时为 ""。
+    subdirs: 只扫描 root 下的这些子目录（如 ["drivers", "mm", "kernel", "arch/riscv"]），默认整个 root。
+    with_hash=True 时顺带计算内容 sha256（blockconf 缓存的键），不必再读一遍文件。
+    """
 
-            path = os.path.join(dirpath, f)
+    def __init__(self, root, prefix="arch/riscv"):
+        self.root = root
+        self.prefix = prefix.strip("/")
+        self.entries = {}
+        self.hashes = {}
+        self._sorted_paths = None
+
+    @classmethod
+    def scan(cls, root, exts=SOURCE_EXTS, with_hash=False, prefix="arch/riscv", subdirs=None):
+        inv = cls(root, prefix)
+        stack = [d.strip("/") + "/" for d in subdirs] if subdirs else [""]
+        while stack:
+            rel_dir = stack.pop()
             try:
-                with open(path, "r", encoding="utf-8", errors="ignore") as fp:
-                    lines = fp.readlines()
-            except Exception as e:
-                print(f"[WARN] 无法读取文件 {path}: {e}")
+                it = os.scandir(os.path.join(root, rel_dir) if rel_dir else root)
+            except OSError as e:
+                print(f"[WARN] 无法读取目录 {os.path.join(root, rel_dir)}: {e}")
                 continue
+            with it:
+                for entry in it:
+                    rel = rel_dir + entry.name
+                    if entry.is_dir():
+                        # 与 os.walk 一致：不进入指向目录的符号链接
+                        if not entry.is_symlink():
+                            stack.append(rel + "/")
+                        continue
+                    if os.path.splitext(entry.name)[1] not in exts:
+                        continue
+                    try:
+                        with open(entry.path, "rb") as fp:
+                            data = fp.read()
+                    except OSError as e:
+                        print(f"[WARN] 无法读取文件 {entry.path}: {e}")
+                        continue
+                    n_lines, n_nonempty = count_bytes_lines(data)
+                    path = join_tree_path(inv.prefix, rel)
+                    inv.entries[path] = (n_lines, n_nonempty, len(data))
+                    if with_hash:
+                        inv.hashes[path] = hashlib.sha256(data).hexdigest()
+        return inv
+
+    def disk_path(self, path):
+        return source_path_on_disk(path, self.root, self.prefix)
+
+    def n_lines(self, path):
+        """path 的行数，不在清单中时返回 None"""
+        entry = self.entries.get(path)
+        return entry[0] if entry else None
+
+    def files_under(self, prefix):
+        """清单中路径以 prefix 开头的文件（内核树相对路径，已排序）"""
+        if self._sorted_paths is None:
+            self._sorted_paths = sorted(self.entries)
+        i = bisect.bisect_left(self._sorted_paths, prefix)
+        result = []
+        while i < len(self._sorted_paths) and self._sorted_paths[i].startswith(prefix):
+            result.append(self._sorted_paths[i])
+            i += 1
+        return result
 
-            n_lines = len(lines)
-            n_nonempty = sum(1 for l in lines if l.strip())
-            file_line_counts[path] = (n_lines, n_nonempty)
-            total_lines += n_lines
-            total_nonempty_lines += n_nonempty
+    def line_counts(self):
+        """{磁盘路径: 行数}，即 analyze_source_files 的输入"""
+        return {self.disk_path(path): e[0] for path, e in self.entries.items()}
+
+    def disk_hashes(self):
+        """{磁盘路径: sha256}（只有 with_hash=True 扫描时才有）"""
+        return {self.disk_path(path): h for path, h in self.hashes.items()}
+
+def count_source_lines(root="arch/riscv", inventory=None):
+    if inventory is None:
+        inventory = SourceInventory.scan(root)
+    total_lines = 0
+    total_nonempty_lines = 0
+    file_line_counts = {}
+    for path, (n_lines, n_nonempty, _) in inventory.entries.items():
+        file_line_counts[inventory.disk_path(path)] = (n_lines, n_nonempty)
+        total_lines += n_lines
+        total_nonempty_lines += n_nonempty
 
     return total_lines, total_nonempty_lines, file_line_counts
 
@@ -38,90 +135,935 @@ def count_source_lines(root="arch/riscv"):
 
 
 import os
+import re
+import json
+import math
+import time
+import heapq
+import shutil
+import tempfile
+import sqlite3
+import hashlib
 import subprocess
 import multiprocessing
 import csv
+from collections import Counter
+from line_mapping import LineMapping, lines_to_blocks
+from columnar import write_interval_table
+from cond_eval import ConditionEvaluator, compile_condition, split_condition
+from config_loader import ConfigMatrix
+from config_index import write_index
+from config_optimizer import DEFAULT_FREEZE, run_optimizer
+from skipped_stats import compute_compiled_due_to_value, compute_unmet_stats, load_condition_set_counts, \
+    load_unmet_counts, write_csv
+
+# 预处理条件指令：块的边界只会出现在这些行上
+PP_COND_RE = re.compile(r"^\s*#\s*(if|ifdef|ifndef|elif|elifdef|elifndef|else|endif)\b")
+# 会影响之后条件求值的普通行：#define / #undef CONFIG_*
+PP_CONFIG_DEFINE_RE = re.compile(r"^\s*#\s*(define|undef)\s+CONFIG_\w+")
+
+def iter_preprocessor_blocks(lines):
+    """
+    按 #if/#ifdef/#ifndef/#elif/#else/#endif 把若干行切成区间，产出 (start, end, is_directive)（闭区间，行号从 1 开始）。
+    - 每条条件指令行（含其 \\ 续行）各自单独成一个区间，is_directive=True；
+    - 两条指令之间的普通行合成一个区间，区间内的行属于同一个 block，blockconf 结果相同。
+    多切不影响结果（只是多调用几次 undertaker），所以这里宁可多切。
+    """
+    start = None
+    continuation = False
+    n = 0
+    for n, line in enumerate(lines, 1):
+        is_directive = continuation or PP_COND_RE.match(line) is not None
+        if is_directive:
+            continuation = line.rstrip("\r\n").endswith("\\")
+            if start is not None:
+                yield start, n - 1, False
+                start = None
+            yield n, n, True
+        elif start is None:
+            start = n
+    if start is not None:
+        yield start, n, False
+
+def split_preprocessor_blocks(filepath):
+    """把文件切成行区间 [(start, end), ...]，规则见 iter_preprocessor_blocks"""
+    with open(filepath, "r", encoding="utf-8", errors="ignore") as fp:
+        return [(start, end) for start, end, _ in iter_preprocessor_blocks(fp)]
+
+# 单次 undertaker 调用的超时（秒），超时后重试一次；worker 里由 init_undertaker_worker 设置
+UNDERTAKER_TIMEOUT = 120
+# 当前 worker 中超时两次、被放弃的调用（FILE:LINE）
+TIMED_OUT = []
+
+def init_undertaker_worker(timeout):
+    """进程池 initializer：设置 worker 里的 undertaker 超时"""
+    global UNDERTAKER_TIMEOUT
+    UNDERTAKER_TIMEOUT = timeout
+
+def available_cpus():
+    """可用 CPU 数：考虑 CPU 亲和性和 cgroup 配额（容器里 os.cpu_count() 往往偏大）"""
+    try:
+        n = len(os.sched_getaffinity(0))
+    except AttributeError:
+        n = os.cpu_count() or 1
+    quota = None
+    try:
+        # cgroup v2: "<quota> <period>" 或 "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            q, period = f.read().split()[:2]
+        if q != "max":
+            quota = int(q) / int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                q = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if q > 0:
+                quota = q / period
+        except (OSError, ValueError):
+            pass
+    if quota:
+        n = min(n, math.ceil(quota))
+    return max(1, n)
 
 def run_undertaker_for_line(args):
-    """调用 undertaker -j blockconf 并返回非#行输出"""
+    """调用 undertaker -j blockconf 并返回非#行输出；超时重试一次，仍超时则记入 TIMED_OUT 并跳过"""
     filepath, line = args
     cmd = ["undertaker", "-j", "blockconf", f"{filepath}:{line}"]
-    try:
-        output = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+    for _ in range(2):
+        try:
+            output = subprocess.check_output(cmd, stderr=subprocess.DEVNULL, timeout=UNDERTAKER_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            continue
+        except subprocess.CalledProcessError:
+            return None
         out_lines = output.decode("utf-8").splitlines()
         # 过滤掉全部以 # 开头的行
         meaningful_lines = [l for l in out_lines if l.strip() and not l.strip().startswith("#")]
         if meaningful_lines:
             return f"{filepath}:{line}", meaningful_lines
-    except subprocess.CalledProcessError:
-        pass
+        return None
+    TIMED_OUT.append(f"{filepath}:{line}")
+    print(f"[WARN] undertaker 超时（{UNDERTAKER_TIMEOUT}s，已重试一次），跳过 {filepath}:{line}")
     return None
 
-def analyze_riscv_arch(root="arch/riscv", nprocs=8, csv_file="fileline_output.csv"):
+def run_undertaker_for_blocks(args):
+    """
+    对 filepath 中给定的每个 block 调用一次 undertaker（取区间首行），
+    返回 (filepath, [(start, end, meaningful_lines), ...], (耗时秒数, 超时次数))。
+    超时次数不为 0 时结果不完整，调用方不能把它写入缓存或检查点日志。
+    """
+    filepath, blocks = args
+    t0 = time.monotonic()
+    del TIMED_OUT[:]
+    results = []
+    for start, end in blocks:
+        res = run_undertaker_for_line((filepath, start))
+        if res:
+            results.append((start, end, res[1]))
+    return filepath, results, (time.monotonic() - t0, len(TIMED_OUT))
+
+def run_undertaker_for_file(filepath):
+    """block 引擎：先切 block，再交给 run_undertaker_for_blocks，返回值相同"""
+    try:
+        blocks = split_preprocessor_blocks(filepath)
+    except Exception:
+        return filepath, [], (0.0, 0)
+    return run_undertaker_for_blocks((filepath, blocks))
+
+# line 引擎每个任务最多处理的行数：大文件被切成多个任务，不会让一个大头文件独占一个 worker 形成拖尾
+LINE_CHUNK = 256
+
+def run_undertaker_for_file_lines(args):
+    """
+    line 引擎：一个任务处理一个文件的一段行（[start, end]，最多 LINE_CHUNK 行），在 worker 里逐行调用 undertaker，
+    返回 (filepath, {line: meaningful_lines}, (耗时秒数, 超时次数))
+    """
+    filepath, start, end = args
+    t0 = time.monotonic()
+    del TIMED_OUT[:]
+    results = {}
+    for line in range(start, end + 1):
+        res = run_undertaker_for_line((filepath, line))
+        if res:
+            results[line] = res[1]
+    return filepath, results, (time.monotonic() - t0, len(TIMED_OUT))
+
+class SlowFileReport:
+    """
+    收集每个文件的分析耗时和超时次数，结束时列出最慢的文件，方便找出拖尾的病态头文件。
+    有超时的文件结果不完整，不写入缓存和检查点日志，下次运行会重新分析。
+    """
+
+    def __init__(self, threshold=60.0, top=10):
+        self.threshold = threshold
+        self.top = top
+        self.slow = []
+        self.timeouts = 0
+
+    def add(self, filepath, stats):
+        elapsed, timeouts = stats
+        self.timeouts += timeouts
+        if elapsed >= self.threshold or timeouts:
+            self.slow.append((elapsed, timeouts, filepath))
+
+    def print_summary(self):
+        if self.timeouts:
+            n_files = sum(1 for _, timeouts, _ in self.slow if timeouts)
+            print(f"[WARN] undertaker 共超时跳过 {self.timeouts} 次，"
+                  f"{n_files} 个文件的结果不完整（未写入缓存和检查点日志，下次运行会重新分析）")
+        if not self.slow:
+            return
+        print(f"[WARN] {len(self.slow)} 个文件分析耗时超过 {self.threshold:.0f}s 或有超时，最慢的:")
+        for elapsed, timeouts, filepath in sorted(self.slow, reverse=True)[:self.top]:
+            print(f"    {elapsed:8.1f}s  超时 {timeouts} 次  {filepath}")
+
+def process_blockconf_output(meaningful_lines):
+    """对 undertaker 输出进行过滤与修正，返回条件 tuple；没有剩余条件时返回 None"""
+    processed_lines = []
+    for line in meaningful_lines:
+        line = line.strip()
+        if line.endswith("_MODULE=n"):
+            continue  # 跳过 _MODULE=n
+        if line.endswith("=m"):
+            line = line[:-2] + "=y"  # 替换 =m → =y
+        processed_lines.append(line)
+    if not processed_lines:
+        return None
+    return tuple(processed_lines)
+
+def join_tree_path(prefix, rel_path):
+    """prefix（root 在内核树中的位置，如 arch/riscv；整棵树为 ""）+ root 下的相对路径 -> 内核树相对路径"""
+    prefix = prefix.strip("/")
+    return f"{prefix}/{rel_path}" if prefix else rel_path
+
+def in_tree_prefix(path, prefix):
+    """内核树相对路径 path 是否在 prefix 之下"""
+    prefix = prefix.strip("/")
+    return path is not None and (not prefix or path.startswith(prefix + "/"))
+
+def normalize_source_path(filepath, root, prefix="arch/riscv"):
+    """路径归一化：去掉绝对路径前缀，统一成内核树相对路径（默认 arch/riscv/...）"""
+    if root.endswith("/"):
+        rel_root = root
+    else:
+        rel_root = root + "/"
+    if filepath.startswith(rel_root):
+        filepath = join_tree_path(prefix, filepath[len(rel_root):])
+    return filepath
+
+def get_undertaker_version():
+    """undertaker 的版本标识：优先用 undertaker -V 的输出，拿不到时退回可执行文件路径 + mtime"""
+    try:
+        output = subprocess.check_output(["undertaker", "-V"], stderr=subprocess.STDOUT)
+        version = output.decode("utf-8", errors="ignore").strip()
+        if version:
+            return version
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    exe = shutil.which("undertaker")
+    if exe:
+        exe = os.path.realpath(exe)
+        return f"{exe}@{int(os.path.getmtime(exe))}"
+    return "unknown"
+
+def hash_file(path):
+    """文件内容的 sha256"""
+    h = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class BlockconfCache:
     """
-    对 arch/riscv 下的每一行调用 undertaker -j blockconf，生成映射。
+    持久化的 blockconf 结果缓存（SQLite）。
+    键: (文件内容 sha256, undertaker 版本)；值: 该文件处理后的条件 [(start, end, conds), ...]。
+    内容没变的文件在不同的内核版本（rc3/rc6/rc7...）之间直接复用，不再调用 undertaker。
+    写入每隔 commit_interval 秒提交一次，运行中途被打断时已提交的结果不会丢。
+    """
+
+    def __init__(self, db_path, tool_version, commit_interval=30.0):
+        self.tool_version = tool_version
+        self.commit_interval = commit_interval
+        self.hits = 0
+        self.misses = 0
+        self._last_commit = time.monotonic()
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS blockconf ("
+            " content_hash TEXT NOT NULL,"
+            " tool_version TEXT NOT NULL,"
+            " blocks TEXT NOT NULL,"
+            " PRIMARY KEY (content_hash, tool_version))"
+        )
+
+    def get(self, content_hash):
+        row = self.conn.execute(
+            "SELECT blocks FROM blockconf WHERE content_hash = ? AND tool_version = ?",
+            (content_hash, self.tool_version),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [(start, end, tuple(conds)) for start, end, conds in json.loads(row[0])]
+
+    def put(self, content_hash, blocks):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO blockconf (content_hash, tool_version, blocks) VALUES (?, ?, ?)",
+            (content_hash, self.tool_version, json.dumps([[s, e, list(c)] for s, e, c in blocks])),
+        )
+        if time.monotonic() - self._last_commit >= self.commit_interval:
+            self.conn.commit()
+            self._last_commit = time.monotonic()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+class BlockconfJournal:
+    """
+    分析过程的检查点日志（JSON Lines），让中途被打断（OOM、Ctrl-C、重启）的运行可以续跑。
+    第一行记录 undertaker 版本，之后每分析完一个文件追加一行：
+        {"file": 内核树相对路径, "hash": 内容 sha256, "blocks": [[start, end, [conds...]], ...]}
+    每条记录写完即 flush，每隔 fsync_interval 秒 fsync 一次。
+    resume=True 时读入已有记录（丢弃最后一条写了一半的记录），内容 hash 没变的文件直接复用；
+    否则清空重新开始。
+    """
+
+    def __init__(self, path, tool_version, resume=False, fsync_interval=30.0):
+        self.path = path
+        self.tool_version = tool_version
+        self.fsync_interval = fsync_interval
+        self.done = {}
+        self.resumed = 0
+        self._last_sync = time.monotonic()
+        good_end = self._load() if resume else None
+        if good_end is None:
+            self.done = {}
+            self.fp = open(path, "wb")
+            self._write({"tool_version": tool_version})
+        else:
+            os.truncate(path, good_end)
+            self.fp = open(path, "ab")
+
+    def _load(self):
+        """读已有日志，返回最后一条完整记录的结束位置；日志不存在或不可用时返回 None"""
+        if not os.path.exists(self.path):
+            return None
+        good_end = 0
+        header = None
+        with open(self.path, "rb") as fp:
+            for raw in fp:
+                if not raw.endswith(b"\n"):
+                    break
+                try:
+                    rec = json.loads(raw)
+                except ValueError:
+                    break
+                if header is None:
+                    header = rec
+                    if rec.get("tool_version") != self.tool_version:
+                        print(f"[WARN] 检查点日志 {self.path} 的 undertaker 版本不同，忽略")
+                        return None
+                else:
+                    self.done[rec["file"]] = (rec["hash"], [(st, en, tuple(c)) for st, en, c in rec["blocks"]])
+                good_end += len(raw)
+        if header is None:
+            return None
+        print(f"[INFO] 检查点日志 {self.path}: 已完成 {len(self.done)} 个文件")
+        return good_end
+
+    def _write(self, rec):
+        self.fp.write(json.dumps(rec, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.fp.flush()
+        if time.monotonic() - self._last_sync >= self.fsync_interval:
+            os.fsync(self.fp.fileno())
+            self._last_sync = time.monotonic()
+
+    def get(self, rel_path, content_hash):
+        """已完成且内容没变的文件返回 blocks，否则返回 None"""
+        entry = self.done.pop(rel_path, None)
+        if entry is None or entry[0] != content_hash:
+            return None
+        # 这条记录仍在日志里（续跑时只截掉了末尾不完整的部分），不用重写
+        self.resumed += 1
+        return entry[1]
+
+    def append(self, rel_path, content_hash, blocks):
+        self._write({"file": rel_path, "hash": content_hash, "blocks": [[st, en, list(c)] for st, en, c in blocks]})
+
+    def close(self):
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.fp.close()
+
+def take_finished_files(paths, root, prefix, fileline_to_output, file_hashes, cache=None, journal=None):
+    """
+    检查点日志（续跑）或 blockconf 缓存里已有结果的文件直接写入 fileline_to_output，
+    返回仍需调用 undertaker 的文件；需要时补算 file_hashes。
+    """
+    if cache is None and journal is None:
+        return list(paths)
+    pending = []
+    for path in paths:
+        if path not in file_hashes:
+            file_hashes[path] = hash_file(path)
+        rel_path = normalize_source_path(path, root, prefix)
+        blocks = journal.get(rel_path, file_hashes[path]) if journal is not None else None
+        if blocks is None and cache is not None:
+            blocks = cache.get(file_hashes[path])
+        if blocks is None:
+            pending.append(path)
+        else:
+            fileline_to_output.set_file_blocks(rel_path, blocks)
+    return pending
+
+def analyze_source_files(file_line_counts, root, fileline_to_output, nprocs=8, engine="block", cache_path=None,
+                         file_hashes=None, prefix="arch/riscv", journal=None, timeout=UNDERTAKER_TIMEOUT,
+                         slow_threshold=60.0):
+    """
+    对 file_line_counts 中的文件求 blockconf 结果，按文件写入 fileline_to_output（LineMapping）。
+    engine / cache_path / prefix 的含义见 analyze_riscv_arch。
+    file_hashes: 已经算好的 {path: sha256}（来自 SourceInventory），缺的再读文件计算。
+    journal: BlockconfJournal，每完成一个文件追加一条记录；续跑时日志里已有的文件不再分析。
+    调度：block 引擎一个文件一个任务，line 引擎把文件切成最多 LINE_CHUNK 行的段、一段一个任务，
+    都按大小从大到小派发，减少最后只剩一个大文件在跑的拖尾；
+    每次 undertaker 调用超过 timeout 秒会被杀掉并重试一次，耗时超过 slow_threshold 秒的文件最后列出。
+    """
+    if engine not in ("block", "line"):
+        raise ValueError(f"未知的 engine: {engine}")
+
+    # --- 查检查点日志和缓存：已完成、内容没变的文件直接复用 ---
+    cache = BlockconfCache(cache_path, get_undertaker_version()) if cache_path else None
+    file_hashes = dict(file_hashes or {})
+    pending = take_finished_files(file_line_counts, root, prefix, fileline_to_output, file_hashes,
+                                  cache=cache, journal=journal)
+
+    def finish_file(filepath, blocks, complete):
+        rel_path = normalize_source_path(filepath, root, prefix)
+        fileline_to_output.set_file_blocks(rel_path, blocks)
+        if not complete:
+            return
+        if cache is not None:
+            cache.put(file_hashes[filepath], blocks)
+        if journal is not None:
+            journal.append(rel_path, file_hashes[filepath], blocks)
+
+    # --- 多进程调用 undertaker：大文件先派发 ---
+    pending.sort(key=lambda fp: (-file_line_counts[fp], fp))
+    report = SlowFileReport(threshold=slow_threshold)
+    try:
+        with multiprocessing.Pool(processes=nprocs, initializer=init_undertaker_worker, initargs=(timeout,)) as pool:
+            if engine == "block":
+                # 一个文件一个任务，block 内的行共享同一组条件
+                for filepath, raw_blocks, stats in pool.imap_unordered(run_undertaker_for_file, pending):
+                    report.add(filepath, stats)
+                    blocks = []
+                    for start, end, meaningful_lines in raw_blocks:
+                        processed = process_blockconf_output(meaningful_lines)
+                        if processed is not None:
+                            blocks.append((start, end, processed))
+                    finish_file(filepath, blocks, complete=not stats[1])
+            else:
+                # 文件切成行段（worker 内逐行调用），大段先派发；一个文件的所有段完成后立即落盘
+                tasks = []
+                for fp in pending:
+                    n_lines = file_line_counts[fp]
+                    if not n_lines:
+                        finish_file(fp, [], complete=True)
+                    tasks.extend((fp, start, min(start + LINE_CHUNK - 1, n_lines))
+                                 for start in range(1, n_lines + 1, LINE_CHUNK))
+                tasks.sort(key=lambda t: (t[1] - t[2], -file_line_counts[t[0]], t[0], t[1]))
+                remaining = Counter(fp for fp, _, _ in tasks)
+                partial = {}  # filepath -> [{line: conds}, 耗时秒数, 超时次数]
+                for filepath, line_results, stats in pool.imap_unordered(run_undertaker_for_file_lines, tasks):
+                    acc = partial.setdefault(filepath, [{}, 0.0, 0])
+                    for line, meaningful_lines in line_results.items():
+                        processed = process_blockconf_output(meaningful_lines)
+                        if processed is not None:
+                            acc[0][line] = processed
+                    acc[1] += stats[0]
+                    acc[2] += stats[1]
+                    remaining[filepath] -= 1
+                    if remaining[filepath]:
+                        continue
+                    line_to_conds, elapsed, timeouts = partial.pop(filepath)
+                    report.add(filepath, (elapsed, timeouts))
+                    finish_file(filepath, lines_to_blocks(line_to_conds), complete=not timeouts)
+        report.print_summary()
+    finally:
+        if cache is not None:
+            cache.close()
+            print(f"[INFO] blockconf 缓存: 命中 {cache.hits} 个文件，未命中 {cache.misses} 个文件")
+
+SHARD_HEADER = ["file", "start_line", "end_line", "output_lines"]
+
+def assign_shards(file_sizes, n_shards):
+    """
+    按字节数把文件均衡地分到最多 n_shards 个分片：从大到小，每次放进当前最轻的分片。
+    返回的分片按总字节数从大到小排列，分片内的文件也从大到小排列（先派发大的，减少拖尾）。
+    """
+    heap = [(0, i) for i in range(max(1, n_shards))]
+    shards = [[] for _ in heap]
+    loads = [0] * len(heap)
+    for path, size in sorted(file_sizes.items(), key=lambda kv: (-kv[1], kv[0])):
+        load, i = heapq.heappop(heap)
+        shards[i].append(path)
+        loads[i] = load + size
+        heapq.heappush(heap, (loads[i], i))
+    order = sorted(range(len(shards)), key=lambda i: -loads[i])
+    return [shards[i] for i in order if shards[i]]
+
+def run_shard(args):
+    """
+    分片 worker：依次分析分片内的文件（block 引擎），每个文件处理完就把它的区间
+    追加写入自己的分片文件（file,start_line,end_line,output_lines），结果不经过主进程。
+    返回 (shard_path, 文件数, 区间数, [(filepath, (耗时秒数, 超时次数)), ...])
+    """
+    shard_path, files, root, prefix = args
+    n_blocks = 0
+    file_stats = []
+    with open(shard_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(SHARD_HEADER)
+        for filepath in files:
+            _, raw_blocks, stats = run_undertaker_for_file(filepath)
+            file_stats.append((filepath, stats))
+            rel_path = normalize_source_path(filepath, root, prefix)
+            for start, end, meaningful_lines in raw_blocks:
+                processed = process_blockconf_output(meaningful_lines)
+                if processed is not None:
+                    writer.writerow([rel_path, start, end, ";".join(processed)])
+                    n_blocks += 1
+            f.flush()
+    return shard_path, len(files), n_blocks, file_stats
+
+def read_shard_blocks(shard_path):
+    """读一个分片文件：{内核树相对路径: [(start, end, conds), ...]}"""
+    per_file = {}
+    with open(shard_path, "r", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            conds = tuple(c for c in row["output_lines"].split(";") if c)
+            per_file.setdefault(row["file"], []).append((int(row["start_line"]), int(row["end_line"]), conds))
+    return per_file
+
+def analyze_source_files_sharded(file_sizes, root, fileline_to_output, nprocs=8, n_shards=None, cache_path=None,
+                                 file_hashes=None, prefix="arch/riscv", shard_dir=None, journal=None,
+                                 timeout=UNDERTAKER_TIMEOUT, slow_threshold=60.0):
+    """
+    分片执行：把文件按字节数均衡地分成 n_shards 个分片（默认 nprocs*4），每个 worker 负责一个分片，
+    边分析边把结果流式写入自己的分片文件；主进程只持有文件列表，等分片完成后逐个读回，
+    合并进 fileline_to_output（只保存区间，内存与区间数成正比，而不是与行数成正比）。
+    适合 drivers/、整棵内核树这种规模；只支持 block 引擎。
+    shard_dir: 分片文件目录，默认用临时目录并在合并后删除。
+    journal: BlockconfJournal，分片合并时逐文件记录；续跑的粒度是分片（未合并的分片整片重做）。
+    timeout / slow_threshold 见 analyze_source_files；分片按总字节数从大到小派发。
+    """
+    file_hashes = dict(file_hashes or {})
+    cache = BlockconfCache(cache_path, get_undertaker_version()) if cache_path else None
+    pending = take_finished_files(file_sizes, root, prefix, fileline_to_output, file_hashes,
+                                  cache=cache, journal=journal)
+    pending = {path: file_sizes[path] for path in pending}
+
+    shards = assign_shards(pending, n_shards or nprocs * 4)
+    own_dir = shard_dir is None
+    if own_dir:
+        shard_dir = tempfile.mkdtemp(prefix="blockconf_shards_")
+    else:
+        os.makedirs(shard_dir, exist_ok=True)
+    tasks = [(os.path.join(shard_dir, f"shard-{i:05d}.csv"), files, root, prefix)
+             for i, files in enumerate(shards)]
+    files_of = {task[0]: task[1] for task in tasks}
+    print(f"[INFO] 分片执行: {len(pending)} 个文件分成 {len(tasks)} 个分片，{nprocs} 个进程")
+
+    report = SlowFileReport(threshold=slow_threshold)
+    try:
+        with multiprocessing.Pool(processes=nprocs, initializer=init_undertaker_worker, initargs=(timeout,)) as pool:
+            for done, (shard_path, n_files, n_blocks, file_stats) in enumerate(pool.imap_unordered(run_shard, tasks), 1):
+                incomplete = set()
+                for filepath, stats in file_stats:
+                    report.add(filepath, stats)
+                    if stats[1]:
+                        incomplete.add(filepath)
+                # 分片完成即合并，同一时刻主进程只读一个分片
+                per_file = read_shard_blocks(shard_path)
+                for filepath in files_of[shard_path]:
+                    rel_path = normalize_source_path(filepath, root, prefix)
+                    blocks = per_file.get(rel_path, [])
+                    fileline_to_output.set_file_blocks(rel_path, blocks)
+                    if filepath in incomplete:
+                        continue
+                    if cache is not None:
+                        cache.put(file_hashes[filepath], blocks)
+                    if journal is not None:
+                        journal.append(rel_path, file_hashes[filepath], blocks)
+                print(f"[INFO] 分片 {done}/{len(tasks)} 完成: {n_files} 个文件，{n_blocks} 个区间")
+        report.print_summary()
+    finally:
+        if own_dir:
+            shutil.rmtree(shard_dir, ignore_errors=True)
+        if cache is not None:
+            cache.close()
+            print(f"[INFO] blockconf 缓存: 命中 {cache.hits} 个文件，未命中 {cache.misses} 个文件")
+
+def analyze_riscv_arch(root="arch/riscv", nprocs=8, csv_file="fileline_output.csv", engine="block",
+                       cache_path=None, csv_format="lines", inventory=None, prefix="arch/riscv",
+                       subdirs=None, shards=0, shard_dir=None, journal_path=None, resume=False,
+                       timeout=UNDERTAKER_TIMEOUT):
+    """
+    对 arch/riscv 下的每一行求 undertaker -j blockconf 结果，生成映射。
+    engine:
+        "block": 先在 Python 里按预处理条件指令切 block，每个 block 只调用一次 undertaker，
+                 再把结果展开到 block 的所有行（默认，结果与 "line" 相同）
+        "line":  每一行调用一次 undertaker（旧行为）
+    cache_path:
+        blockconf 缓存（SQLite）路径；为 None 时不使用缓存。
+        命中缓存的文件（内容 hash 与 undertaker 版本都相同）不再调用 undertaker。
+    csv_format:
+        "lines" 写旧的 file_line,output_lines 格式；"blocks" 每个区间写一条，体积小得多；
+        "columnar" 把 csv_file 写成列式目录（需要 numpy，见 columnar.py）。
+    inventory:
+        SourceInventory.scan(root) 的结果，传入时不再重新遍历目录、读取文件。
+    prefix / subdirs:
+        root 在内核树中的位置（映射里的路径都以它开头）和只分析的子目录。
+        默认分析 arch/riscv；分析整棵树时 root 为内核顶层目录、prefix 为 ""，
+        可用 subdirs=["drivers", "mm", "kernel", "arch/riscv"] 之类限定范围。
+    shards / shard_dir:
+        shards > 0 时使用分片执行（见 analyze_source_files_sharded），大规模目录用它。
+    journal_path / resume:
+        检查点日志路径（见 BlockconfJournal），每完成一个文件追加一条，为 None 时不记录；
+        resume=True 时从日志续跑，已完成且内容没变的文件不再调用 undertaker。
+    timeout:
+        单次 undertaker 调用的超时秒数，超时重试一次仍失败则跳过该 block 并在最后报告。
     返回:
-        fileline_to_output: {FILE:LINE : tuple(output_lines)}
+        fileline_to_output: LineMapping，可以像 {FILE:LINE : tuple(output_lines)} 一样使用
     """
     # --- 收集文件行数 ---
-    exts = {".c", ".S", ".h"}
-    file_line_counts = {}
-    for dirpath, _, filenames in os.walk(root):
-        for f in filenames:
-            _, ext = os.path.splitext(f)
-            if ext not in exts:
-                continue
-            path = os.path.join(dirpath, f)
-            try:
-                with open(path, "r", encoding="utf-8", errors="ignore") as fp:
-                    n_lines = sum(1 for _ in fp)
-            except Exception as e:
-                print(f"[WARN] 无法读取文件 {path}: {e}")
-                continue
-            file_line_counts[path] = n_lines
-
-    # --- 构建任务列表 ---
-    tasks = [(fp, i) for fp, n in file_line_counts.items() for i in range(1, n+1)]
-
-    # --- 多进程调用 undertaker ---
-    fileline_to_output = {}  # FILE:LINE -> [output_line1, ...]
-    with multiprocessing.Pool(processes=nprocs) as pool:
-        for res in pool.imap_unordered(run_undertaker_for_line, tasks):
-            if res:
-                file_line, meaningful_lines = res
-                # === 对 output_lines 进行过滤与修正 ===
-                processed_lines = []
-                for line in meaningful_lines:
-                    line = line.strip()
-                    if line.endswith("_MODULE=n"):
-                        continue  # 跳过 _MODULE=n
-                    if line.endswith("=m"):
-                        line = line[:-2] + "=y"  # 替换 =m → =y
-                    processed_lines.append(line)
-
-                if not processed_lines:
-                    continue
-                # === 路径归一化：去掉绝对路径前缀 ===
-                if root.endswith("/"):
-                    rel_root = root
-                else:
-                    rel_root = root + "/"
-                if file_line.startswith(rel_root):
-                    file_line = file_line.replace(rel_root, "arch/riscv/", 1) 
+    if inventory is None:
+        inventory = SourceInventory.scan(root, with_hash=bool(cache_path or journal_path),
+                                         prefix=prefix, subdirs=subdirs)
 
-                fileline_to_output[file_line] = tuple(processed_lines)
+    fileline_to_output = LineMapping()  # FILE -> [(start, end, set_id), ...]
+    journal = BlockconfJournal(journal_path, get_undertaker_version(), resume=resume) if journal_path else None
+    try:
+        if shards:
+            if engine != "block":
+                raise ValueError("分片执行只支持 block 引擎")
+            file_sizes = {inventory.disk_path(path): e[2] for path, e in inventory.entries.items()}
+            analyze_source_files_sharded(file_sizes, root, fileline_to_output, nprocs=nprocs, n_shards=shards,
+                                         cache_path=cache_path, file_hashes=inventory.disk_hashes(),
+                                         prefix=prefix, shard_dir=shard_dir, journal=journal, timeout=timeout)
+        else:
+            analyze_source_files(inventory.line_counts(), root, fileline_to_output,
+                                 nprocs=nprocs, engine=engine, cache_path=cache_path,
+                                 file_hashes=inventory.disk_hashes(), prefix=prefix, journal=journal,
+                                 timeout=timeout)
+    finally:
+        if journal is not None:
+            journal.close()
+            if resume:
+                print(f"[INFO] 从检查点日志续跑: 复用 {journal.resumed} 个文件")
 
     # --- 写 FILE:LINE -> output_lines CSV ---
-    with open(csv_file, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(["file_line", "output_lines"])
-        for fl, lines in fileline_to_output.items():
-            writer.writerow([fl, ";".join(lines)])
+    fileline_to_output.write(csv_file, fmt=csv_format)
 
     # print(f"[INFO] FILE:LINE -> output_lines CSV 写入 {csv_file}")
 
     return fileline_to_output
 
+def source_path_on_disk(rel_path, root, prefix="arch/riscv"):
+    """normalize_source_path 的逆操作：arch/riscv/... -> root 下的实际路径"""
+    prefix = prefix.strip("/")
+    if prefix and rel_path.startswith(prefix + "/"):
+        return os.path.join(root, rel_path[len(prefix) + 1:])
+    return os.path.join(root, rel_path)
+
+HUNK_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+def parse_unified_diff(diff_path, strip=1):
+    """
+    解析 git diff（或 diff -u）输出。
+    strip: 同 patch -p，去掉路径开头的几级目录（git diff 的 a/ b/ 即 strip=1）。
+    返回 [{"old": 旧路径或 None, "new": 新路径或 None, "hunks": [...]}, ...]，
+    hunk 为 (old_start, old_len, new_start, new_len, [(tag, text), ...])，tag 为 " " / "-" / "+"。
+    """
+    def parse_path(token):
+        token = token.split("\t", 1)[0].strip()
+        if token == "/dev/null":
+            return None
+        parts = token.split("/")
+        return "/".join(parts[strip:]) if len(parts) > strip else token
+
+    files = []
+    cur = None
+    old_left = new_left = 0
+    with open(diff_path, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if old_left > 0 or new_left > 0:
+                if line.startswith("\\"):
+                    continue  # "\ No newline at end of file"
+                tag, text = (line[:1] or " "), line[1:]
+                cur["hunks"][-1][4].append((tag, text))
+                if tag in " -":
+                    old_left -= 1
+                if tag in " +":
+                    new_left -= 1
+                continue
+            if line.startswith("diff --git "):
+                parts = line.split()
+                cur = {"old": None, "new": None, "hunks": [], "header": True}
+                if len(parts) >= 4:
+                    cur["old"], cur["new"] = parse_path(parts[2]), parse_path(parts[3])
+                files.append(cur)
+            elif line.startswith("--- "):
+                if cur is None or not cur.pop("header", False):
+                    cur = {"old": None, "new": None, "hunks": []}
+                    files.append(cur)
+                cur["old"] = parse_path(line[4:])
+            elif line.startswith("+++ ") and cur is not None:
+                cur["new"] = parse_path(line[4:])
+            elif line.startswith("new file mode") and cur is not None:
+                cur["old"] = None
+            elif line.startswith("deleted file mode") and cur is not None:
+                cur["new"] = None
+            elif line.startswith("rename from ") and cur is not None:
+                cur["old"] = line[len("rename from "):]
+            elif line.startswith("rename to ") and cur is not None:
+                cur["new"] = line[len("rename to "):]
+            elif line.startswith("@@") and cur is not None:
+                m = HUNK_RE.match(line)
+                if not m:
+                    continue
+                old_start, old_len, new_start, new_len = m.groups()
+                old_len = 1 if old_len is None else int(old_len)
+                new_len = 1 if new_len is None else int(new_len)
+                cur["hunks"].append((int(old_start), old_len, int(new_start), new_len, []))
+                old_left, new_left = old_len, new_len
+    for entry in files:
+        entry.pop("header", None)
+    return files
+
+def reconstruct_old_lines(new_lines, hunks):
+    """
+    用新文件内容和 hunk 反推出旧文件内容（行列表，不含换行符）。
+    上下文行或新增行与新文件对不上时（diff 与源码树不匹配）返回 None。
+    """
+    old_lines = []
+    n = 1  # 下一个要复制的新文件行号
+    for old_start, old_len, new_start, new_len, lines in hunks:
+        first_new = new_start if new_len else new_start + 1
+        while n < first_new:
+            if n > len(new_lines):
+                return None
+            old_lines.append(new_lines[n - 1])
+            n += 1
+        for tag, text in lines:
+            if tag in " +":
+                if n > len(new_lines) or new_lines[n - 1] != text:
+                    return None
+                n += 1
+            if tag in " -":
+                old_lines.append(text)
+    old_lines.extend(new_lines[n - 1:])
+    return old_lines
+
+def config_define_lines(lines, blocks):
+    """#define/#undef CONFIG_* 行：[(它前面的条件指令数, 行文本), ...]，blocks 是 iter_preprocessor_blocks 的结果"""
+    result = []
+    k = 0
+    for s, e, d in blocks:
+        if d:
+            k += 1
+            continue
+        result.extend((k, lines[i - 1].strip()) for i in range(s, e + 1) if PP_CONFIG_DEFINE_RE.match(lines[i - 1]))
+    return result
+
+def shift_file_blocks(old_lines, new_lines, old_intervals_lookup):
+    """
+    条件指令没有变化时，把旧文件的 block 条件平移到新文件上。
+    old_intervals_lookup(old_line) -> 旧映射中该行的条件 tuple 或 None。
+    返回 (blocks, pending)：
+        blocks:  [(start, end, conds), ...] 可以直接复用的区间
+        pending: [(start, end), ...] 旧文件里没有对应 block、需要重新调用 undertaker 的区间
+    指令行（含续行）文本有任何变化，或 #define/#undef CONFIG_* 行有增删、改动、跨指令移动时返回 None，
+    调用方应整文件重新分析。
+    """
+    old_blocks = list(iter_preprocessor_blocks(old_lines))
+    new_blocks = list(iter_preprocessor_blocks(new_lines))
+    old_directives = [old_lines[s - 1] for s, _, d in old_blocks if d]
+    new_directives = [new_lines[s - 1] for s, _, d in new_blocks if d]
+    if old_directives != new_directives:
+        return None
+    if config_define_lines(old_lines, old_blocks) != config_define_lines(new_lines, new_blocks):
+        return None
+
+    def by_position(blocks):
+        # 指令第 k 行 -> 行号；第 k 条指令之前的普通行区间 -> 起始行号
+        directive_lines, gap_starts = [], {}
+        for s, _, d in blocks:
+            if d:
+                directive_lines.append(s)
+            else:
+                gap_starts[len(directive_lines)] = s
+        return directive_lines, gap_starts
+
+    old_directive_lines, old_gap_starts = by_position(old_blocks)
+    blocks, pending = [], []
+    k = 0
+    for s, e, d in new_blocks:
+        if d:
+            old_line = old_directive_lines[k]
+            k += 1
+        elif k in old_gap_starts:
+            old_line = old_gap_starts[k]
+        else:
+            pending.append((s, e))
+            continue
+        conds = old_intervals_lookup(old_line)
+        if conds:
+            blocks.append((s, e, conds))
+    return blocks, pending
+
+def analyze_incremental(since_csv, diff_path, root="arch/riscv", nprocs=8, csv_file="fileline_output.csv",
+                        engine="block", cache_path=None, csv_format="lines", diff_strip=1, prefix="arch/riscv",
+                        timeout=UNDERTAKER_TIMEOUT, subdirs=None, journal_path=None, resume=False):
+    """
+    基于上一次的 fileline_output.csv 和两个 tag 之间的 diff 增量更新映射，结果与全量重扫一致：
+      - diff 没碰到的文件：原样保留；
+      - 只改了普通行的文件：按 hunk 反推旧文件，把旧 block 的条件平移到新行号上，
+        只有全新的 block 才调用 undertaker；
+      - 改了条件指令的文件、新增文件：整文件重新分析（可命中 blockconf 缓存）；
+      - 删除的文件：从映射中去掉。
+    Kbuild/Makefile 的变化由随后的 update_mapping_from_kbuildparser_live 处理（它每次都会完整重跑）。
+    root 是新 tag 的 arch/riscv 目录（prefix、subdirs 的含义见 analyze_riscv_arch）；
+    给了 subdirs 时只处理这些子目录下的变更，其余文件保留 since_csv 里的结果。
+    journal_path / resume：检查点日志（见 BlockconfJournal），平移完的文件和整文件重新分析的文件各记一条；
+    续跑时内容没变的文件直接复用，不再平移、不再调用 undertaker。
+    """
+    mapping = LineMapping.load(since_csv)
+    previous = mapping.copy()
+    exts = {".c", ".S", ".h"}
+    stats = Counter()
+    scopes = [join_tree_path(prefix, d.strip("/")) for d in subdirs] if subdirs else [prefix]
+
+    def in_scope(path):
+        return any(in_tree_prefix(path, scope) for scope in scopes)
+
+    journal = BlockconfJournal(journal_path, get_undertaker_version(), resume=resume) if journal_path else None
+    try:
+        _apply_diff(mapping, previous, diff_path, diff_strip, in_scope, exts, stats, root, prefix, nprocs,
+                    engine, cache_path, journal, timeout)
+    finally:
+        if journal is not None:
+            journal.close()
+            if resume:
+                print(f"[INFO] 从检查点日志续跑: 复用 {journal.resumed} 个文件")
+
+    print(f"[INFO] 增量分析: 平移 {stats['shifted']} 个文件（新 block {stats['new_blocks']} 个），"
+          f"整文件重新分析 {stats['reanalyzed']} 个，删除 {stats['deleted']} 个，"
+          f"Kbuild/Makefile 变更 {stats['kbuild_changed']} 个")
+
+    mapping.write(csv_file, fmt=csv_format)
+    return mapping
+
+def _apply_diff(mapping, previous, diff_path, diff_strip, in_scope, exts, stats, root, prefix, nprocs,
+                engine, cache_path, journal, timeout):
+    """analyze_incremental 的主体：按 diff 更新 mapping，stats 里累加各类文件数"""
+
+    full_files = {}     # 磁盘路径 -> 行数，整文件重新分析
+    pending_blocks = {}  # 磁盘路径 -> [(start, end), ...]，平移后仍缺结果的 block
+    shifted_files = {}   # 磁盘路径 -> (归一化路径, 内容 sha256)，写检查点日志用
+    for entry in parse_unified_diff(diff_path, strip=diff_strip):
+        old_path, new_path = entry["old"], entry["new"]
+        if not in_scope(old_path) and not in_scope(new_path):
+            continue
+        name = os.path.basename(new_path or old_path)
+        if os.path.splitext(name)[1] not in exts:
+            if name.startswith("Makefile") or name.startswith("Kbuild"):
+                stats["kbuild_changed"] += 1
+            continue
+
+        if in_scope(old_path):
+            mapping.set_file_intervals(old_path, [])
+        if not in_scope(new_path):
+            stats["deleted"] += 1
+            continue
+
+        disk_path = source_path_on_disk(new_path, root, prefix)
+        content_hash = None
+        if journal is not None:
+            try:
+                content_hash = hash_file(disk_path)
+            except OSError:
+                content_hash = None
+            blocks = journal.get(new_path, content_hash) if content_hash else None
+            if blocks is not None:
+                mapping.set_file_blocks(new_path, blocks)
+                stats["resumed"] += 1
+                continue
+        try:
+            with open(disk_path, "r", encoding="utf-8", errors="ignore") as fp:
+                new_lines = [l.rstrip("\r\n") for l in fp]
+        except OSError as e:
+            print(f"[WARN] 无法读取文件 {disk_path}: {e}")
+            continue
+
+        shifted = None
+        if in_scope(old_path):
+            old_lines = reconstruct_old_lines(new_lines, entry["hunks"])
+            if old_lines is not None:
+                shifted = shift_file_blocks(
+                    old_lines, new_lines,
+                    lambda line, p=old_path: previous.get(f"{p}:{line}"))
+        if shifted is None:
+            full_files[disk_path] = len(new_lines)
+            stats["reanalyzed"] += 1
+            continue
+
+        blocks, pending = shifted
+        mapping.set_file_blocks(new_path, blocks)
+        if pending:
+            pending_blocks[disk_path] = pending
+        shifted_files[disk_path] = (new_path, content_hash)
+        stats["shifted"] += 1
+
+    # --- 平移后仍缺结果的 block：每个 block 调用一次 undertaker，一个文件一个任务，大文件先派发 ---
+    incomplete = set()
+    if pending_blocks:
+        tasks = sorted(pending_blocks.items(), key=lambda kv: (-len(kv[1]), kv[0]))
+        report = SlowFileReport()
+        with multiprocessing.Pool(processes=nprocs, initializer=init_undertaker_worker, initargs=(timeout,)) as pool:
+            for disk_path, raw_blocks, file_stats in pool.imap_unordered(run_undertaker_for_blocks, tasks):
+                report.add(disk_path, file_stats)
+                if file_stats[1]:
+                    incomplete.add(disk_path)
+                rel_path = shifted_files[disk_path][0]
+                intervals = list(mapping.file_intervals(rel_path))
+                for s, e, meaningful_lines in raw_blocks:
+                    processed = process_blockconf_output(meaningful_lines)
+                    if processed is not None:
+                        intervals.append((s, e, mapping.intern(processed)))
+                mapping.set_file_intervals(rel_path, intervals)
+        report.print_summary()
+
+    stats["new_blocks"] += sum(len(blocks) for blocks in pending_blocks.values())
+    if journal is not None:
+        # 有超时的文件结果不完整，不记入检查点日志
+        for disk_path, (rel_path, content_hash) in shifted_files.items():
+            if content_hash and disk_path not in incomplete:
+                blocks = [(st, en, mapping.cond_sets[set_id]) for st, en, set_id in mapping.file_intervals(rel_path)]
+                journal.append(rel_path, content_hash, blocks)
+
+    # --- 条件指令有变化的文件、新文件：整文件重新分析 ---
+    if full_files:
+        analyze_source_files(full_files, root, mapping, nprocs=nprocs, engine=engine, cache_path=cache_path,
+                             prefix=prefix, journal=journal, timeout=timeout)
+
 # if __name__ == "__main__":
 #     mapping = analyze_riscv_arch(
 #         root="/home/rv/mrvga/riscv-for-linus-6.18-rc3/arch/riscv",
@@ -132,99 +1074,255 @@ def analyze_riscv_arch(root="arch/riscv", nprocs=8, csv_file="fileline_output.cs
 
 import csv
 import re
-
-def parse_config_file(config_path):
-    """解析 .config 文件，返回 {CONFIG_KEY: value}"""
-    config_map = {}
-    with open(config_path, "r", encoding="utf-8", errors="ignore") as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith("#"):
-                # 处理 "# CONFIG_X is not set"
-                m = re.match(r"#\s*(CONFIG_[A-Za-z0-9_]+)\s+is\s+not\s+set", line)
-                if m:
-                    config_map[m.group(1)] = "n"
-                continue
-            if "=" in line:
-                k, v = line.split("=", 1)
-                config_map[k.strip()] = v.strip()
-    return config_map
+from config_loader import parse_config_file
 
 
-def evaluate_compilation(fileline_to_output, config_path, csv_compiled, csv_skipped):
+def evaluate_compilation(fileline_to_output, config_path, csv_compiled, csv_skipped, fmt="csv",
+                         module_as_built=False, config_cache=None):
     """
     判断哪些行被编译进内核。
     输入:
         fileline_to_output: {file:line -> [CONFIG_*=y/n/...]}
         config_path: .config 文件路径
+        fmt: "csv" 或 "columnar"（输出路径写成列式目录）
+        module_as_built: =y 的条件是否也被 =m 满足（条件的写法和语义见 cond_eval.py）
+        config_cache: .config 解析结果的缓存方式（None / "mtime" / "hash"，见 config_loader.py）
     输出:
         csv_compiled: 被编译进内核的行
         csv_skipped: 未被编译进内核的行
+    返回:
+        (被编译进内核的行数, 未编译进内核的行数)
     """
-    config_map = parse_config_file(config_path)
-    compiled = []
-    skipped = []
+    config_map = parse_config_file(config_path, cache=config_cache)
+    if not isinstance(fileline_to_output, LineMapping):
+        fileline_to_output = LineMapping.from_fileline_dict(fileline_to_output)
 
-    for fileline, configs in fileline_to_output.items():
-        conditions = []
-        for cfg in configs:
-            if "=" in cfg:
-                k, v = cfg.split("=", 1)
-                conditions.append((k.strip(), v.strip()))
-
-        all_ok = True
-        unmet = []
-        for k, expected in conditions:
-            actual = config_map.get(k, "n")  # 未定义的 CONFIG 视作 n
-            if actual != expected:
-                all_ok = False
-                unmet.append(f"{k}={actual} (need {expected})")
-
-        if all_ok:
-            compiled.append((fileline, ";".join(configs)))
-        else:
-            skipped.append((fileline, ";".join(configs), ";".join(unmet)))
+    # 按区间遍历，每个条件集合编译成一个判断函数、只判断一次；
+    # 结果按区间流式写出（CSV 在写入时按行展开），不在内存里攒逐行的列表
+    evaluator = ConditionEvaluator(config_map, module_as_built=module_as_built)
+    set_results = {}  # set_id -> (all_ok, 条件串, 未满足条件串)
+    counts = Counter()
 
-    # --- 写 CSV ---
-    with open(csv_compiled, "w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(["file_line", "output_lines"])
-        for row in compiled:
-            w.writerow(row)
+    def intervals(want_compiled):
+        for path, start, end, set_id in fileline_to_output.iter_blocks():
+            if set_id not in set_results:
+                configs = fileline_to_output.cond_sets[set_id]
+                all_ok, unmet = evaluator.explain(configs)
+                set_results[set_id] = (all_ok, ";".join(configs), ";".join(unmet))
+            all_ok, joined, unmet = set_results[set_id]
+            if all_ok != want_compiled:
+                continue
+            counts[all_ok] += end - start + 1
+            yield (path, start, end, joined) if all_ok else (path, start, end, joined, unmet)
 
-    with open(csv_skipped, "w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(["file_line", "output_lines", "unmet_conditions"])
-        for row in skipped:
-            w.writerow(row)
+    # --- 写 CSV ---
+    write_interval_rows(csv_compiled, ["file_line", "output_lines"], intervals(True), fmt=fmt)
+    write_interval_rows(csv_skipped, ["file_line", "output_lines", "unmet_conditions"], intervals(False), fmt=fmt)
 
-    print(f"[INFO] 被编译进内核的行: {len(compiled)}")
-    print(f"[INFO] 未编译进内核的行: {len(skipped)}")
-    total = len(compiled) + len(skipped)
+    n_compiled, n_skipped = counts[True], counts[False]
+    print(f"[INFO] 被编译进内核的行: {n_compiled}")
+    print(f"[INFO] 未编译进内核的行: {n_skipped}")
+    total = n_compiled + n_skipped
     if total:
-        ratio = len(compiled) / total * 100
+        ratio = n_compiled / total * 100
         print(f"[INFO] 编译进内核比例: {ratio:.2f}%")
 
-    return compiled, skipped
+    return n_compiled, n_skipped
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+def evaluate_configs_batch(fileline_to_output, config_paths, csv_ratio=None, module_as_built=False, config_cache=None):
+    """
+    一次性给多个 .config 打分（需要 numpy，有 scipy 时用稀疏矩阵）。
+    把每个条件集合编码成条件字面量上的 0/1 行向量 A[set, literal]，
+    每个 .config 编码成字面量是否满足的列向量 X[literal, config]，
+    条件集合满足 <=> (A @ X)[set, config] == 该集合的字面量个数。
+    判断规则与 evaluate_compilation 相同（每个字面量用 cond_eval 编译出的函数判断）。
+    返回:
+        ratios: [(config_path, compiled_lines, skipped_lines, ratio), ...]
+        set_flags: bool 矩阵 [set_id, config]，某条件集合在某个 .config 下是否被编译；
+                   行级结果按 fileline_to_output.iter_blocks() 的 set_id 展开即可
+    """
+    if np is None:
+        raise ImportError("evaluate_configs_batch 需要 numpy")
+    if not isinstance(fileline_to_output, LineMapping):
+        fileline_to_output = LineMapping.from_fileline_dict(fileline_to_output)
+    cond_sets = fileline_to_output.cond_sets
+
+    # --- 字面量编号，构造 A[set, literal] ---
+    literal_ids = {}
+    rows, cols = [], []
+    need = np.zeros(len(cond_sets), dtype=np.int32)
+    for set_id, configs in enumerate(cond_sets):
+        seen = set()
+        for cfg in configs:
+            cfg = cfg.strip()
+            if not cfg:
+                continue
+            lit = literal_ids.setdefault(cfg, len(literal_ids))
+            if lit in seen:
+                continue
+            seen.add(lit)
+            rows.append(set_id)
+            cols.append(lit)
+        need[set_id] = len(seen)
+
+    # --- 每个条件集合覆盖的行数 ---
+    weights = np.asarray(fileline_to_output.set_line_counts(), dtype=np.int64)
+
+    # --- X[literal, config] ---
+    # tristate 字面量直接在取值矩阵上按列比较，其余（字符串、整数、表达式）逐个 .config 用判断函数
+    configs = ConfigMatrix.load(config_paths, cache=config_cache)
+    X = np.zeros((len(literal_ids), len(config_paths)), dtype=np.int32)
+    predicates = []
+    for cond, lit in literal_ids.items():
+        literal = split_condition(cond)
+        if literal and literal[1] in ("y", "m", "n"):
+            k, v = literal
+            X[lit] = configs.matches(k, ("y", "m") if v == "y" and module_as_built else (v,))
+        else:
+            predicates.append((compile_condition(cond, module_as_built), lit))
+    if predicates:
+        for c in range(len(config_paths)):
+            config_map = configs.config_map(c)
+            for predicate, lit in predicates:
+                if predicate(config_map):
+                    X[lit, c] = 1
+
+    data = np.ones(len(rows), dtype=np.int32)
+    if sparse is not None:
+        A = sparse.csr_matrix((data, (rows, cols)), shape=(len(cond_sets), len(literal_ids)))
+        hits = np.asarray(A @ X)
+    else:
+        A = np.zeros((len(cond_sets), len(literal_ids)), dtype=np.int32)
+        A[rows, cols] = data
+        hits = A @ X
+    set_flags = hits == need[:, None]
+
+    compiled = weights @ set_flags
+    total = int(weights.sum())
+    ratios = []
+    for c, config_path in enumerate(config_paths):
+        n_compiled = int(compiled[c])
+        ratio = n_compiled / total * 100 if total else 0.0
+        ratios.append((config_path, n_compiled, total - n_compiled, ratio))
+
+    if csv_ratio:
+        with open(csv_ratio, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["config", "compiled_lines", "skipped_lines", "ratio"])
+            for config_path, n_compiled, n_skipped, ratio in ratios:
+                w.writerow([config_path, n_compiled, n_skipped, f"{ratio:.2f}"])
+
+    return ratios, set_flags
 
 import subprocess
 import os
 import re
+import queue
+import logging
+import logging.handlers
+from collections import Counter
+
+class KbuildMergeLog:
+    """
+    kbuildparser 合并过程的分级日志，真正写盘在后台线程里完成，主线程只负责入队。
+    level:
+        "off":     不写日志
+        "summary": 只写汇总计数（默认）
+        "file":    另外写 kbuildparser 原始输出、每个条目的解析结果和每个文件的区间更新
+        "line":    另外按 line_sample_rate 抽样写逐行更新（1.0 即全部行）
+    """
+    LEVELS = ("off", "summary", "file", "line")
+
+    def __init__(self, debug_file, level="summary", line_sample_rate=0.01):
+        if level not in self.LEVELS:
+            raise ValueError(f"未知的日志级别: {level}")
+        self.enabled = level != "off"
+        self.file_enabled = level in ("file", "line")
+        self.line_enabled = level == "line" and line_sample_rate > 0
+        self.line_stride = max(1, round(1 / line_sample_rate)) if self.line_enabled else 0
+        self._lines_seen = 0
+        self.counters = Counter()
+        self.listener = None
+        if not self.enabled:
+            return
 
-def update_mapping_from_kbuildparser_live(fileline_to_output, root="arch/riscv", debug_file="kbuildparser_debug.log"):
+        # 不经过 logging 的 logger 树：记录直接交给本实例的 QueueHandler，不会留下按实例命名的 logger
+        q = queue.SimpleQueue()
+        self.queue_handler = logging.handlers.QueueHandler(q)
+        self.file_handler = logging.FileHandler(debug_file, mode="w", encoding="utf-8")
+        self.file_handler.setFormatter(logging.Formatter("%(message)s"))
+        # 后台线程攒一批再写，避免每条记录都 flush
+        self.buffer_handler = logging.handlers.MemoryHandler(
+            capacity=4096, flushLevel=logging.CRITICAL, target=self.file_handler)
+        self.listener = logging.handlers.QueueListener(q, self.buffer_handler)
+        self.listener.start()
+
+    def _log(self, msg, args):
+        self.queue_handler.handle(logging.LogRecord("kbuildparser_merge", logging.INFO, __file__, 0, msg, args, None))
+
+    # msg 是 % 格式串，args 由 logging 在级别打开时才格式化，关闭的级别不花格式化的开销
+    def summary(self, msg, *args):
+        if self.enabled:
+            self._log(msg, args)
+
+    def file(self, msg, *args):
+        if self.file_enabled:
+            self._log(msg, args)
+
+    def lines(self, path, start, end, added):
+        """逐行更新，按固定步长抽样（在所有区间上连续计数）"""
+        if not self.line_enabled:
+            return
+        first = start + (-self._lines_seen) % self.line_stride
+        for i in range(first, end + 1, self.line_stride):
+            self._log("[INFO] 更新 %s:%d -> 新增配置: %s", (path, i, added))
+        self._lines_seen += end - start + 1
+
+    def close(self):
+        if self.listener is None:
+            return
+        self.listener.stop()
+        self.queue_handler.close()
+        self.buffer_handler.close()
+        self.file_handler.close()
+        self.listener = None
+        self.enabled = self.file_enabled = self.line_enabled = False
+
+def update_mapping_from_kbuildparser_live(fileline_to_output, root="arch/riscv", debug_file="kbuildparser_debug.log",
+                                          log_level="summary", line_sample_rate=0.01, inventory=None,
+                                          arch="riscv", prefix="arch/riscv"):
     """
-    调用 kbuildparser -a riscv，解析输出并更新 fileline_to_output。
-    增加调试信息，写入 debug_file。
+    调用 kbuildparser -a <arch>，解析输出并更新 fileline_to_output。
+    kbuildparser 输出的是内核树相对路径；prefix 是 root 在内核树中的位置（见 analyze_riscv_arch），
+    不在 prefix 之下的条目不属于本次分析的范围，跳过。
+    调试信息写入 debug_file，详细程度由 log_level 控制（见 KbuildMergeLog）。
+    合并按文件进行：每个文件只改写它的区间表（O(1) 定位），
+    目录级条件（obj-$(CONFIG_X) += dir/）一次性作用到整棵子树。
+    inventory: 同一个 root 的 SourceInventory，传入时文件行数和目录下的文件列表都从清单里取，不再访问磁盘。
     """
-    updated_mapping = fileline_to_output.copy()
+    if isinstance(fileline_to_output, LineMapping):
+        updated_mapping = fileline_to_output.copy()
+    else:
+        updated_mapping = LineMapping.from_fileline_dict(fileline_to_output)
 
-    with open(debug_file, "w", encoding="utf-8") as debug:
-        debug.write(f"[INFO] 调用 kbuildparser 在 {root}\n")
+    log = KbuildMergeLog(debug_file, level=log_level, line_sample_rate=line_sample_rate)
+    counters = log.counters
+    try:
+        log.summary("[INFO] 调用 kbuildparser -a %s 在 %s", arch, root)
 
         # 执行 kbuildparser
         try:
             result = subprocess.run(
-                ["kbuildparser", "-a", "riscv"],
+                ["kbuildparser", "-a", arch],
                 cwd=root,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.DEVNULL,
@@ -232,13 +1330,11 @@ def update_mapping_from_kbuildparser_live(fileline_to_output, root="arch/riscv",
                 check=True
             )
             kbuild_lines = result.stdout.splitlines()
-            debug.write(f"[INFO] kbuildparser 输出共 {len(kbuild_lines)} 行\n")
-            debug.write("[INFO] 原始输出开始:\n")
-            for l in kbuild_lines:
-                debug.write(l + "\n")
-            debug.write("[INFO] 原始输出结束\n\n")
+            log.summary("[INFO] kbuildparser 输出共 %d 行", len(kbuild_lines))
+            if log.file_enabled:
+                log.file("[INFO] 原始输出开始:\n%s\n[INFO] 原始输出结束\n", "\n".join(kbuild_lines))
         except subprocess.CalledProcessError as e:
-            debug.write(f"[WARN] kbuildparser 执行失败: {e}\n")
+            log.summary("[WARN] kbuildparser 执行失败: %s", e)
             return updated_mapping
 
         def parse_kbuild_line(line):
@@ -257,165 +1353,141 @@ def update_mapping_from_kbuildparser_live(fileline_to_output, root="arch/riscv",
                     configs.append((token, "y"))
             return path, configs
 
-        # 遍历 kbuildparser 输出
-        for line in kbuild_lines:
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
-            filepath, configs = parse_kbuild_line(line)
-            debug.write(f"[DEBUG] 解析行: '{line}' -> 文件: {filepath}, 配置: {configs}\n")
-            if not configs:
-                continue
-
-            # 获取文件所有行
-            file_lines = [k for k in updated_mapping if k.startswith(filepath + ":")]
-            if not file_lines:
-                # mapping 中没有文件，尝试读取文件生成每行 key
-                try:
-                    with open(os.path.join(root, filepath), "r", encoding="utf-8", errors="ignore") as f:
-                        n_lines = sum(1 for _ in f)
-                    file_lines = [f"{filepath}:{i}" for i in range(1, n_lines + 1)]
-                    debug.write(f"[DEBUG] 文件 {filepath} 不在 mapping 中，读取文件行数 {n_lines}\n")
-                except Exception:
-                    debug.write(f"[WARN] 无法读取文件 {filepath}，跳过\n")
-                    continue
+        # (set_id, 新增条件) -> 新 set_id，同一组条件作用到大量区间时只算一次
+        merged_sets = {}
 
-            # 更新 mapping
-            for fl in file_lines:
-                existing = list(updated_mapping.get(fl, ()))
+        def merge_conditions(set_id, configs):
+            key = (set_id, configs)
+            if key not in merged_sets:
+                existing = list(updated_mapping.cond_sets[set_id])
                 added = []
                 for cfg, val in configs:
                     entry = f"{cfg}={val}"
                     if entry not in existing:
                         existing.append(entry)
                         added.append(entry)
-                updated_mapping[fl] = tuple(existing)
-                if added:
-                    debug.write(f"[INFO] 更新 {fl} -> 新增配置: {added}\n")
+                merged_sets[key] = (updated_mapping.intern(existing), added)
+            return merged_sets[key]
 
-        debug.write(f"\n[INFO] 总共更新了 {len(updated_mapping)} 个行条目\n")
+        def apply_file_conditions(filepath, configs):
+            """把文件级条件合并进 filepath 的所有区间"""
+            intervals = updated_mapping.file_intervals(filepath)
+            if not intervals and inventory is not None and inventory.n_lines(filepath) is not None:
+                # mapping 中没有文件，行数取自文件清单，整个文件作为一个区间
+                n_lines = inventory.n_lines(filepath)
+                log.file("[DEBUG] 文件 %s 不在 mapping 中，清单中行数 %s", filepath, n_lines)
+                counters["files_from_disk"] += 1
+                if n_lines == 0:
+                    return
+                intervals = [(1, n_lines, updated_mapping.intern(()))]
+            elif not intervals:
+                # mapping 中没有文件，读取文件行数，整个文件作为一个区间
+                try:
+                    with open(source_path_on_disk(filepath, root, prefix), "r", encoding="utf-8", errors="ignore") as f:
+                        n_lines = sum(1 for _ in f)
+                    log.file("[DEBUG] 文件 %s 不在 mapping 中，读取文件行数 %s", filepath, n_lines)
+                    counters["files_from_disk"] += 1
+                except Exception:
+                    log.file("[WARN] 无法读取文件 %s，跳过", filepath)
+                    counters["unreadable_files"] += 1
+                    return
+                if n_lines == 0:
+                    return
+                intervals = [(1, n_lines, updated_mapping.intern(()))]
 
-    return updated_mapping
+            new_intervals = []
+            file_updated = False
+            for start, end, set_id in intervals:
+                new_id, added = merge_conditions(set_id, configs)
+                new_intervals.append((start, end, new_id))
+                if added:
+                    file_updated = True
+                    counters["intervals_updated"] += 1
+                    counters["lines_updated"] += end - start + 1
+                    log.file("[INFO] 更新 %s:%d-%d -> 新增配置: %s", filepath, start, end, added)
+                    log.lines(filepath, start, end, added)
+            if file_updated:
+                counters["files_updated"] += 1
+            updated_mapping.set_file_intervals(filepath, new_intervals)
 
-def load_skipped_rows(skipped_csv_path):
-    rows = []
-    with open(skipped_csv_path, "r", encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            rows.append({
-                "file_line": row["file_line"],
-                "output_lines": row.get("output_lines", ""),
-                "unmet_conditions": row.get("unmet_conditions", "")
-            })
-    return rows
-
-def load_fileline_output(fileline_output_csv_path):
-    mapping = {}
-    with open(fileline_output_csv_path, "r", encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            fl = row["file_line"]
-            conds = row["output_lines"].split(";") if row["output_lines"] else []
-            # 去重并清理
-            cleaned = []
-            seen = set()
-            for c in conds:
-                c = c.strip()
-                if not c or "=" not in c:
-                    continue
-                k, v = c.split("=", 1)
-                k = k.strip()
-                v = v.strip()
-                if (k, v) in seen:
-                    continue
-                seen.add((k, v))
-                cleaned.append((k, v))
-            mapping[fl] = cleaned
-    return mapping
+        def apply_dir_conditions(dirpath, configs):
+            """目录级条件：作用到 mapping 中该目录下的文件，以及磁盘上该目录下的源文件"""
+            dir_prefix = dirpath if dirpath.endswith("/") else dirpath + "/"
+            targets = set(updated_mapping.files_under(dir_prefix))
+            if inventory is not None:
+                targets.update(inventory.files_under(dir_prefix))
+            else:
+                disk_dir = source_path_on_disk(dir_prefix, root, prefix)
+                for cur, _, filenames in os.walk(disk_dir):
+                    for f in filenames:
+                        if os.path.splitext(f)[1] in SOURCE_EXTS:
+                            targets.add(dir_prefix + os.path.relpath(os.path.join(cur, f), disk_dir).replace(os.sep, "/"))
+            log.file("[DEBUG] 目录 %s 下共有 %d 个文件", dir_prefix, len(targets))
+            for filepath in sorted(targets):
+                apply_file_conditions(filepath, configs)
 
-def compute_unmet_stats(skipped_rows):
-    # 解析 "CONFIG_X=n (need y)" 形式
-    unmet_re = re.compile(r"^\s*(CONFIG_[A-Za-z0-9_]+)\s*=\s*([^\s]+)\s*\(need\s*([^\s]+)\)\s*$")
-
-    # 细粒度统计：按 (CONFIG, expected, actual)
-    counts_by_cfg_expected_actual = {}
-    # 聚合统计：按 (CONFIG, expected)
-    counts_by_cfg_expected = {}
-    # 还可以统计：按 (CONFIG, actual) 被阻止的行数
-    blocked_by_actual = {}
-
-    for row in skipped_rows:
-        unmet_list = [x.strip() for x in row["unmet_conditions"].split(";") if x.strip()]
-        for item in unmet_list:
-            m = unmet_re.match(item)
-            if not m:
-                # 未能解析的格式，归类到一个保留桶
-                key = ("__UNPARSEABLE__", item)
-                counts_by_cfg_expected_actual[key] = counts_by_cfg_expected_actual.get(key, 0) + 1
+        # 遍历 kbuildparser 输出
+        for line in kbuild_lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            filepath, configs = parse_kbuild_line(line)
+            log.file("[DEBUG] 解析行: '%s' -> 文件: %s, 配置: %s", line, filepath, configs)
+            if not configs:
+                continue
+            if not in_tree_prefix(filepath.rstrip("/") + "/", prefix):
+                counters["out_of_scope"] += 1
                 continue
-            cfg, actual, expected = m.group(1), m.group(2), m.group(3)
-            k1 = (cfg, expected, actual)
-            counts_by_cfg_expected_actual[k1] = counts_by_cfg_expected_actual.get(k1, 0) + 1
-            k2 = (cfg, expected)
-            counts_by_cfg_expected[k2] = counts_by_cfg_expected.get(k2, 0) + 1
-            k3 = (cfg, actual)
-            blocked_by_actual[k3] = blocked_by_actual.get(k3, 0) + 1
+            configs = tuple(configs)
+
+            if filepath.endswith("/") or os.path.isdir(source_path_on_disk(filepath, root, prefix)):
+                counters["dir_entries"] += 1
+                apply_dir_conditions(filepath, configs)
+            else:
+                counters["file_entries"] += 1
+                apply_file_conditions(filepath, configs)
 
-    return counts_by_cfg_expected_actual, counts_by_cfg_expected, blocked_by_actual
+        log.summary("[INFO] 条目: 文件级 %d 个，目录级 %d 个，不在 %s 下 %d 个",
+                    counters["file_entries"], counters["dir_entries"], prefix or ".", counters["out_of_scope"])
+        log.summary("[INFO] 更新文件 %d 个（其中 %d 个不在 mapping 中，按整个文件处理），区间 %d 个，行 %d 行",
+                    counters["files_updated"], counters["files_from_disk"],
+                    counters["intervals_updated"], counters["lines_updated"])
+        if counters["unreadable_files"]:
+            log.summary("[WARN] 无法读取的文件 %d 个", counters["unreadable_files"])
+        log.summary("[INFO] 总共更新了 %d 个行条目", len(updated_mapping))
+    finally:
+        log.close()
 
-def compute_compiled_due_to_value(fileline_output_map, config_map, strict=True):
+    return updated_mapping
+
+def write_interval_rows(path, header, intervals, fmt="csv"):
     """
-    对于每个满足编译的行，把该行的每个条件 (CONFIG=VALUE) 计入其“编译贡献”。
-    返回 dict[(CONFIG, VALUE)] -> compiled_line_count
+    写第一列是 file_line 的行表，输入是区间 (file, start, end, 其余列...)：
+    CSV 边读区间边按行展开写出，列式直接按区间存（见 columnar.write_interval_table）
     """
-    compiled_due = {}
-    for fl, conds in fileline_output_map.items():
-        if not conds:
-            continue
-        if evaluate_line_conditions(conds, config_map, strict=strict):
-            for k, v in conds:
-                compiled_due[(k, v)] = compiled_due.get((k, v), 0) + 1
-    return compiled_due
-
-def write_csv(path, header, rows):
+    if fmt == "columnar":
+        write_interval_table(path, header, intervals)
+        return
     with open(path, "w", newline="", encoding="utf-8") as f:
         w = csv.writer(f)
         w.writerow(header)
-        for row in rows:
-            w.writerow(row)
-
-def evaluate_line_conditions(conds, config_map, strict=True):
-    """
-    conds: list[(CONFIG, expected_value)]
-    strict=True: 严格相等才算满足（与你原 evaluate_compilation 保持一致）
-    返回 True/False
-    """
-    for k, expected in conds:
-        actual = config_map.get(k, "n")
-        if strict:
-            if actual != expected:
-                return False
-        else:
-            # 可选的宽松模式：把 m 视为“已编译”（满足 expected=y 或 expected=m）
-            if expected == "y":
-                if actual not in ("y", "m"):
-                    return False
-            elif expected == "m":
-                if actual != "m":
-                    return False
-            else:
-                if actual != expected:
-                    return False
-    return True
+        for path_, start, end, *others in intervals:
+            for line in range(start, end + 1):
+                w.writerow([f"{path_}:{line}"] + others)
 
 def run_stats(skipped_csv_path, fileline_output_csv_path, config_path,
               out_blocked_by_actual_csv="stats_blocked_by_actual.csv",
               out_compiled_due_csv="stats_compiled_due_to_value.csv",
-              strict=True):
-    # 加载输入
-    skipped_rows = load_skipped_rows(skipped_csv_path)
-    fileline_output_map = load_fileline_output(fileline_output_csv_path)
-    config_map = parse_config_file(config_path)
+              strict=True, fmt="csv", nprocs=None, config_cache=None):
+    """
+    nprocs: 读大 CSV 时的并行进程数，默认 CPU 数；输入按块流式计数，内存与不同条件的个数相关，与行数无关
+    config_cache: .config 解析结果的缓存方式（None / "mtime" / "hash"，见 config_loader.py）
+    """
+    nprocs = nprocs or os.cpu_count() or 1
+    # 加载输入（只保留 {取值: 行数}）
+    skipped_rows = load_unmet_counts(skipped_csv_path, nprocs=nprocs)
+    fileline_output_map = load_condition_set_counts(fileline_output_csv_path, nprocs=nprocs)
+    config_map = parse_config_file(config_path, cache=config_cache)
 
     # 统计未满足
     counts_detail, counts_agg, blocked_by_actual = compute_unmet_stats(skipped_rows)
@@ -429,13 +1501,13 @@ def run_stats(skipped_csv_path, fileline_output_csv_path, config_path,
     rows_blocked = []
     for (cfg, actual), cnt in sorted(blocked_by_actual.items(), key=lambda x: (-x[1], x[0])):
         rows_blocked.append([cfg, actual, cnt])
-    write_csv(out_blocked_by_actual_csv, ["config", "actual", "skipped_count"], rows_blocked)
+    write_csv(out_blocked_by_actual_csv, ["config", "actual", "skipped_count"], rows_blocked, fmt=fmt)
 
     # 2) “实际值控制编译”：CONFIG, value, compiled_count
     rows_compiled_due = []
     for (cfg, val), cnt in sorted(compiled_due.items(), key=lambda x: (-x[1], x[0])):
         rows_compiled_due.append([cfg, val, cnt])
-    write_csv(out_compiled_due_csv, ["config", "value", "compiled_count"], rows_compiled_due)
+    write_csv(out_compiled_due_csv, ["config", "value", "compiled_count"], rows_compiled_due, fmt=fmt)
 
     # 控制台摘要
     print("[INFO] 统计完成：")
@@ -444,33 +1516,134 @@ def run_stats(skipped_csv_path, fileline_output_csv_path, config_path,
 
 
 if __name__ == "__main__":
-    total, nonempty, detail = count_source_lines("/home/rv/linux-repo/riscv-for-linus-6.18-rc6/arch/riscv")
+    import argparse
+
+    ap = argparse.ArgumentParser(description="给 .config 打分：统计 arch/riscv（或其他目录、整棵树）下"
+                                             "有多少被配置项管理的代码被编译进内核。")
+    ap.add_argument("--root", default="/home/rv/linux-repo/riscv-for-linus-6.18-rc6/arch/riscv",
+                    help="要分析的目录，默认 arch/riscv；分析整棵树时传内核顶层目录并加 --prefix ''")
+    ap.add_argument("--arch", default="riscv", help="体系结构，传给 kbuildparser -a")
+    ap.add_argument("--prefix", help="root 在内核树中的相对路径，默认 arch/<arch>；root 是内核顶层目录时传 ''")
+    ap.add_argument("--subdir", action="append",
+                    help="只分析 root 下的这些子目录，可重复，例如 --subdir drivers --subdir mm")
+    ap.add_argument("--shards", type=int, default=0,
+                    help="分片执行的分片数（0 关闭）；分片结果流式写盘，用于 drivers/ 或整棵树")
+    ap.add_argument("--config", default="/home/rv/linux-repo/riscv-for-linus-6.18-rc6/.config",
+                    help="要打分的 .config")
+    ap.add_argument("-j", "--nprocs", type=int, default=available_cpus(),
+                    help="undertaker 并行进程数，默认为可用 CPU 数（考虑 cgroup 配额）")
+    ap.add_argument("--timeout", type=float, default=UNDERTAKER_TIMEOUT,
+                    help="单次 undertaker 调用的超时秒数，超时重试一次")
+    ap.add_argument("--cache", default="blockconf_cache.sqlite", help="blockconf 缓存路径，传空字符串关闭缓存")
+    ap.add_argument("--journal", default="analyze_journal.jsonl",
+                    help="检查点日志路径，每分析完一个文件追加一条，传空字符串关闭")
+    ap.add_argument("--resume", action="store_true", help="从 --journal 续跑上一次被中断的分析")
+    ap.add_argument("--since", help="上一个 tag 的 fileline_output.csv，与 --diff 一起使用做增量分析")
+    ap.add_argument("--diff", help="两个 tag 之间的 diff，例如 git diff rc6..rc7 -- arch/riscv > rc6-rc7-riscv.diff")
+    ap.add_argument("--module-as-built", action="store_true",
+                    help="=y 的条件也被 =m 满足（把模块算作已编译），默认只认 =y")
+    ap.add_argument("--format", choices=["csv", "columnar"], default="csv",
+                    help="产物格式：csv，或列式目录 *.cols（需要 numpy，可用 columnar.py 导出 CSV）")
+    ap.add_argument("--config-cache", choices=["mtime", "hash"],
+                    help=".config 解析结果缓存到 ~/.cache/score_config（JSON）：mtime 按路径+mtime+大小，hash 按内容；默认不缓存")
+    ap.add_argument("--index", default="fileline_index.sqlite",
+                    help="CONFIG -> 文件/行区间 的倒排索引（见 config_index.py），传空字符串不写")
+    ap.add_argument("--optimize", action="store_true",
+                    help="打分后贪心地寻找能编译更多行的 CONFIG 翻转，输出 optimize_*.csv 和 optimized.config")
+    ap.add_argument("--configtree", help="--optimize 用的 Kconfig 依赖树 configtree.json（与 gen_kconfig_graph.py 相同）")
+    ap.add_argument("--max-flips", type=int, default=50, help="--optimize 最多应用多少组翻转")
+    ap.add_argument("--freeze", default=DEFAULT_FREEZE,
+                    help="--optimize 中不参与翻转的符号（正则），默认冻结工具链、HAVE_*、ARCH_HAS_* 等")
+    args = ap.parse_args()
+    if bool(args.since) != bool(args.diff):
+        ap.error("--since 和 --diff 需要同时使用")
+    if args.resume and not args.journal:
+        ap.error("--resume 需要 --journal")
+    prefix = f"arch/{args.arch}" if args.prefix is None else args.prefix
+    ext = ".csv" if args.format == "csv" else ".cols"
+    csv_format = "lines" if args.format == "csv" else "columnar"
+
+    # 只遍历、读取一次源码树，后面各阶段共用
+    inventory = SourceInventory.scan(args.root, with_hash=bool(args.cache or args.journal),
+                                     prefix=prefix, subdirs=args.subdir)
+    total, nonempty, detail = count_source_lines(args.root, inventory=inventory)
     print(f"[INFO] 总代码行数: {total}")
     print(f"[INFO] 非空行数: {nonempty}")
     print(f"[INFO] 文件数: {len(detail)}")
 
-    mapping = analyze_riscv_arch(
-        root="/home/rv/linux-repo/riscv-for-linus-6.18-rc6/arch/riscv",
-        nprocs=40,
-        csv_file="fileline_output.csv"
-    )
+    if args.since:
+        mapping = analyze_incremental(
+            since_csv=args.since,
+            diff_path=args.diff,
+            root=args.root,
+            nprocs=args.nprocs,
+            csv_file="fileline_output" + ext,
+            cache_path=args.cache or None,
+            csv_format=csv_format,
+            prefix=prefix,
+            timeout=args.timeout,
+            subdirs=args.subdir,
+            journal_path=args.journal or None,
+            resume=args.resume
+        )
+    else:
+        mapping = analyze_riscv_arch(
+            root=args.root,
+            nprocs=args.nprocs,
+            csv_file="fileline_output" + ext,
+            cache_path=args.cache or None,
+            csv_format=csv_format,
+            inventory=inventory,
+            prefix=prefix,
+            shards=args.shards,
+            journal_path=args.journal or None,
+            resume=args.resume,
+            timeout=args.timeout
+        )
 
     mapping = update_mapping_from_kbuildparser_live(
         mapping,
-        root="/home/rv/linux-repo/riscv-for-linus-6.18-rc6/arch/riscv",
-        debug_file="kbuildparser_debug.log"
+        root=args.root,
+        debug_file="kbuildparser_debug.log",
+        inventory=inventory,
+        arch=args.arch,
+        prefix=prefix
     )
+    # 合并 kbuildparser 结果后的映射才是打分用的映射，config_whatif / config_optimizer / config_cover 应读它
+    mapping.write("fileline_merged" + ext, fmt=csv_format)
+    print(f"[INFO] 合并 kbuildparser 后的映射写入 fileline_merged{ext}")
+    if args.index:
+        write_index(mapping, args.index)
 
-    compiled, skipped = evaluate_compilation(
+    evaluate_compilation(
         fileline_to_output=mapping,
-        config_path="/home/rv/linux-repo/riscv-for-linus-6.18-rc6/.config",
-        csv_compiled="compiled_lines.csv",
-        csv_skipped="skipped_lines.csv"
+        config_path=args.config,
+        csv_compiled="compiled_lines" + ext,
+        csv_skipped="skipped_lines" + ext,
+        fmt=args.format,
+        module_as_built=args.module_as_built,
+        config_cache=args.config_cache
     )
 
     run_stats(
-        skipped_csv_path="skipped_lines.csv",
-        fileline_output_csv_path="fileline_output.csv",
-        config_path="/home/rv/linux-repo/riscv-for-linus-6.18-rc6/.config",
-        strict=True
+        skipped_csv_path="skipped_lines" + ext,
+        fileline_output_csv_path="fileline_output" + ext,
+        config_path=args.config,
+        out_blocked_by_actual_csv="stats_blocked_by_actual" + ext,
+        out_compiled_due_csv="stats_compiled_due_to_value" + ext,
+        strict=not args.module_as_built,
+        fmt=args.format,
+        nprocs=args.nprocs,
+        config_cache=args.config_cache
     )
+
+    if args.optimize:
+        run_optimizer(
+            mapping,
+            config_path=args.config,
+            config_map=parse_config_file(args.config, cache=args.config_cache),
+            tree_path=args.configtree,
+            max_flips=args.max_flips,
+            module_as_built=args.module_as_built,
+            freeze=args.freeze
+        )
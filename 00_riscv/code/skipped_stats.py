@@ -0,0 +1,166 @@
+"""
+skipped_lines / fileline_output 的统计工具（score_config_v3.py 的 run_stats 与 analyze_skipped.py 共用）。
+
+    load_unmet_counts / load_condition_set_counts   流式读入 {取值: 行数}（CSV 或列式，见 stats_stream.py）
+    compute_unmet_stats                             按 (CONFIG, 期望值, 实际值) 等维度统计未编译的行
+    compute_compiled_due_to_value                   某个 CONFIG 取值控制了多少行被编译进内核
+    write_csv                                       按 fmt 写 CSV 或列式表
+"""
+import csv
+import re
+from collections import Counter
+from line_mapping import LineMapping
+from columnar import is_columnar, iter_table_rows, table_value_counts, write_table
+from cond_eval import ConditionEvaluator
+from stats_stream import count_csv_column
+
+def load_skipped_rows(skipped_csv_path):
+    if is_columnar(skipped_csv_path):
+        return list(iter_table_rows(skipped_csv_path))
+    rows = []
+    with open(skipped_csv_path, "r", encoding="utf-8") as f:
+        r = csv.DictReader(f)
+        for row in r:
+            rows.append({
+                "file_line": row["file_line"],
+                "output_lines": row.get("output_lines", ""),
+                "unmet_conditions": row.get("unmet_conditions", "")
+            })
+    return rows
+
+def clean_conditions(conds):
+    """["CONFIG_X=y", ...] -> [(CONFIG_X, y), ...]，去重并清理"""
+    cleaned = []
+    seen = set()
+    for c in conds:
+        c = c.strip()
+        if not c or "=" not in c:
+            continue
+        k, v = c.split("=", 1)
+        k = k.strip()
+        v = v.strip()
+        if (k, v) in seen:
+            continue
+        seen.add((k, v))
+        cleaned.append((k, v))
+    return cleaned
+
+def load_unmet_counts(skipped_csv_path, nprocs=1):
+    """skipped_lines 中每种 unmet_conditions 覆盖的行数：{unmet_conditions: 行数}（CSV 分块并行流式计数）"""
+    if is_columnar(skipped_csv_path):
+        return table_value_counts(skipped_csv_path, "unmet_conditions")
+    return count_csv_column(skipped_csv_path, "unmet_conditions", nprocs=nprocs)
+
+def load_fileline_output(fileline_output_csv_path):
+    """
+    读取 fileline_output（CSV 或列式），返回 LineMapping：
+    条件集合 intern 成 ID，统计时每个不同的集合只解析、判断一次，再按行数加权。
+    """
+    return LineMapping.load(fileline_output_csv_path)
+
+def load_condition_set_counts(fileline_output_csv_path, nprocs=1):
+    """
+    fileline_output 中每个条件集合覆盖的行数：Counter{(条件, ...): 行数}。
+    CSV 分块并行流式计数，不在内存里建逐行的映射；列式目录直接用区间表的行数。
+    """
+    if is_columnar(fileline_output_csv_path):
+        mapping = LineMapping.load_columnar(fileline_output_csv_path)
+        return Counter(dict(zip(mapping.cond_sets, mapping.set_line_counts())))
+    counts = Counter()
+    for output_lines, n in count_csv_column(fileline_output_csv_path, "output_lines",
+                                            nprocs=nprocs, weight_range=True).items():
+        counts[tuple(c for c in output_lines.split(";") if c)] += n
+    return counts
+
+def weighted_condition_sets(fileline_output_map):
+    """
+    逐个不同的条件集合产出 (清理后的 [(CONFIG, 值), ...], 行数)。
+    fileline_output_map 可以是 LineMapping、load_condition_set_counts 的 Counter，
+    也可以是旧的 {file_line: [(CONFIG, 值), ...]}。
+    """
+    if isinstance(fileline_output_map, Counter):
+        for conds, n in fileline_output_map.items():
+            if n:
+                yield clean_conditions(conds), n
+    elif isinstance(fileline_output_map, LineMapping):
+        counts = fileline_output_map.set_line_counts()
+        for set_id, conds in enumerate(fileline_output_map.cond_sets):
+            if counts[set_id]:
+                yield clean_conditions(conds), counts[set_id]
+    else:
+        for conds, n in Counter(tuple(c) for c in fileline_output_map.values()).items():
+            yield list(conds), n
+
+def compute_unmet_stats(skipped_rows):
+    """
+    skipped_rows: load_unmet_counts 的结果 {unmet_conditions: 行数}，或旧的逐行 dict 列表。
+    每种不同的 unmet_conditions 只解析一次，按行数计数。
+    """
+    if isinstance(skipped_rows, dict):
+        unmet_counts = skipped_rows
+    else:
+        unmet_counts = Counter(row["unmet_conditions"] for row in skipped_rows)
+
+    # 解析 "CONFIG_X=n (need y)" 形式
+    unmet_re = re.compile(r"^\s*(CONFIG_[A-Za-z0-9_]+)\s*=\s*([^\s]+)\s*\(need\s*([^\s]+)\)\s*$")
+
+    # 细粒度统计：按 (CONFIG, expected, actual)
+    counts_by_cfg_expected_actual = {}
+    # 聚合统计：按 (CONFIG, expected)
+    counts_by_cfg_expected = {}
+    # 还可以统计：按 (CONFIG, actual) 被阻止的行数
+    blocked_by_actual = {}
+
+    for unmet, n in unmet_counts.items():
+        unmet_list = [x.strip() for x in unmet.split(";") if x.strip()]
+        for item in unmet_list:
+            m = unmet_re.match(item)
+            if not m:
+                # 未能解析的格式，归类到一个保留桶
+                key = ("__UNPARSEABLE__", item)
+                counts_by_cfg_expected_actual[key] = counts_by_cfg_expected_actual.get(key, 0) + n
+                continue
+            cfg, actual, expected = m.group(1), m.group(2), m.group(3)
+            k1 = (cfg, expected, actual)
+            counts_by_cfg_expected_actual[k1] = counts_by_cfg_expected_actual.get(k1, 0) + n
+            k2 = (cfg, expected)
+            counts_by_cfg_expected[k2] = counts_by_cfg_expected.get(k2, 0) + n
+            k3 = (cfg, actual)
+            blocked_by_actual[k3] = blocked_by_actual.get(k3, 0) + n
+
+    return counts_by_cfg_expected_actual, counts_by_cfg_expected, blocked_by_actual
+
+def evaluate_line_conditions(conds, config_map, strict=True):
+    """
+    conds: list[(CONFIG, expected_value)]
+    strict=True: =y 只被 y 满足（与 evaluate_compilation 保持一致）
+    strict=False: 宽松模式，把 m 视为"已编译"（满足 expected=y 或 expected=m）
+    返回 True/False；批量判断时直接用 ConditionEvaluator，结果按条件集合记忆
+    """
+    return ConditionEvaluator(config_map, module_as_built=not strict).check(conds)
+
+def compute_compiled_due_to_value(fileline_output_map, config_map, strict=True):
+    """
+    对于每个满足编译的行，把该行的每个条件 (CONFIG=VALUE) 计入其“编译贡献”。
+    按不同的条件集合判断一次，再按集合覆盖的行数累加。
+    返回 dict[(CONFIG, VALUE)] -> compiled_line_count
+    """
+    compiled_due = {}
+    evaluator = ConditionEvaluator(config_map, module_as_built=not strict)
+    for conds, n in weighted_condition_sets(fileline_output_map):
+        if not conds:
+            continue
+        if evaluator.check(conds):
+            for k, v in conds:
+                compiled_due[(k, v)] = compiled_due.get((k, v), 0) + n
+    return compiled_due
+
+def write_csv(path, header, rows, fmt="csv"):
+    if fmt == "columnar":
+        write_table(path, header, rows)
+        return
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(header)
+        for row in rows:
+            w.writerow(row)
@@ -0,0 +1,92 @@
+"""
+run_stats 的流式统计：按块读大 CSV，多进程 map-reduce 计数，内存只跟不同取值的个数有关，与行数无关。
+
+    map:    每个进程读一段字节区间（按行对齐），对某一列做 Counter（相当于 combiner，块内先合并）
+    reduce: 主进程把各块的 Counter 相加
+
+skipped_lines.csv 按 unmet_conditions 计数；fileline_output.csv 按 output_lines 计数
+（区间格式按 end_line - start_line + 1 加权），得到 {取值: 行数}，后面按不同的取值各算一次。
+CSV 由本流水线写出，字段里没有换行，按行切块是安全的。
+"""
+import csv
+import multiprocessing
+import os
+from collections import Counter
+
+CHUNK_BYTES = 64 << 20
+
+def csv_header(path):
+    """返回 (表头, 表头结束处的字节偏移)"""
+    with open(path, "rb") as f:
+        first = f.readline()
+        offset = f.tell()
+    header = next(csv.reader([first.decode("utf-8")]), [])
+    return header, offset
+
+def split_chunks(path, start, chunk_bytes=CHUNK_BYTES):
+    """把 [start, 文件末尾) 切成按行对齐的字节区间 [(begin, end), ...]"""
+    size = os.path.getsize(path)
+    chunks = []
+    with open(path, "rb") as f:
+        begin = start
+        while begin < size:
+            end = min(begin + chunk_bytes, size)
+            if end < size:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            chunks.append((begin, end))
+            begin = end
+    return chunks
+
+def iter_chunk_lines(path, begin, end):
+    with open(path, "rb") as f:
+        f.seek(begin)
+        pos = begin
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield line.decode("utf-8")
+
+def count_chunk(args):
+    """
+    map：统计一个字节区间里 column 列每个取值的行数。
+    weight_cols 为 (start 列, end 列) 时每行按区间长度加权。
+    """
+    path, begin, end, column, weight_cols = args
+    counts = Counter()
+    for row in csv.reader(iter_chunk_lines(path, begin, end)):
+        if not row:
+            continue
+        value = row[column] if column is not None and column < len(row) else ""
+        if weight_cols is None:
+            counts[value] += 1
+        else:
+            counts[value] += int(row[weight_cols[1]]) - int(row[weight_cols[0]]) + 1
+    return counts
+
+def count_csv_column(path, column, nprocs=1, chunk_bytes=None, weight_range=False):
+    """
+    CSV 某一列每个取值覆盖的行数：{取值: 行数}；没有这一列时都计在 "" 下。
+    weight_range=True 且表头有 start_line/end_line 时按区间长度加权（fileline_output 的区间格式）。
+    文件小于一块或 nprocs<=1 时在本进程里算。
+    """
+    header, offset = csv_header(path)
+    idx = header.index(column) if column in header else None
+    weight_cols = None
+    if weight_range and "start_line" in header and "end_line" in header:
+        weight_cols = (header.index("start_line"), header.index("end_line"))
+    chunks = split_chunks(path, offset, chunk_bytes or CHUNK_BYTES)
+    tasks = [(path, begin, end, idx, weight_cols) for begin, end in chunks]
+
+    counts = Counter()
+    if nprocs <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            counts.update(count_chunk(task))
+        return counts
+    with multiprocessing.Pool(processes=min(nprocs, len(tasks))) as pool:
+        for part in pool.imap_unordered(count_chunk, tasks):
+            counts.update(part)
+    return counts
@@ -132,23 +132,11 @@ def analyze_riscv_arch(root="arch/riscv", nprocs=8, csv_file="fileline_output.cs
 
 import csv
 import re
+import sys
 
-def parse_config_file(config_path):
-    """解析 .config 文件，返回 {CONFIG_KEY: value}"""
-    config_map = {}
-    with open(config_path, "r", encoding="utf-8", errors="ignore") as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith("#"):
-                # 处理 "# CONFIG_X is not set"
-                m = re.match(r"#\s*(CONFIG_[A-Za-z0-9_]+)\s+is\s+not\s+set", line)
-                if m:
-                    config_map[m.group(1)] = "n"
-                continue
-            if "=" in line:
-                k, v = line.split("=", 1)
-                config_map[k.strip()] = v.strip()
-    return config_map
+# .config 解析与 code/ 下的脚本共用 config_loader.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "code"))
+from config_loader import parse_config_file
 
 
 def evaluate_compilation(fileline_to_output, config_path, csv_compiled, csv_skipped):
@@ -7,8 +7,16 @@ import sys
 import shutil
 import datetime
 import logging
+import queue
+import select
+import threading
+import time
 from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 import re
+import sqlite3
+
+from cscope_index import default_index_path, load_caller_index
 
 SUSPICIOUS_NAMES = {
     # 基本类型/别名
@@ -59,33 +67,310 @@ def setup_logger(log_path):
 def check_cmd_exists(cmd):
     return shutil.which(cmd) is not None
 
-def ensure_cscope_db(src_dir, logger, force=False):
+# Source files cscope indexes with -R (C, headers, assembly, lex/yacc)
+CSCOPE_SUFFIXES = (".c", ".h", ".S", ".s", ".l", ".y")
+CSCOPE_MANIFEST = "cscope.manifest.json"
+
+def list_source_files(src_dir, scopes):
+    """{path relative to src_dir: mtime_ns} of the files to index under the given subtrees ("." = whole tree)"""
+    files = {}
+    for scope in scopes:
+        top = os.path.normpath(os.path.join(src_dir, scope))
+        for root, dirs, names in os.walk(top):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for name in names:
+                if not name.endswith(CSCOPE_SUFFIXES):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    files[os.path.relpath(path, src_dir)] = os.stat(path).st_mtime_ns
+                except OSError:
+                    continue
+    return files
+
+def read_cscope_manifest(src_dir):
+    try:
+        with open(os.path.join(src_dir, CSCOPE_MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_cscope_manifest(src_dir, scopes, files):
+    path = os.path.join(src_dir, CSCOPE_MANIFEST)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"scopes": scopes, "files": files}, f)
+    os.replace(path + ".tmp", path)
+
+def ensure_cscope_db(src_dir, logger, force=False, scopes=None):
+    """
+    Make sure cscope.out matches the source files under `scopes` (subtrees of src_dir; default: the whole tree).
+    The file list and mtimes of the last build are kept in cscope.manifest.json; when files were added, removed
+    or modified (e.g. after a git pull), cscope is rerun on cscope.files against the existing cscope.out, and it
+    only re-parses the changed files. force=True rebuilds everything (cscope -u).
+    """
     out_path = os.path.join(src_dir, "cscope.out")
-    if os.path.exists(out_path) and not force:
-        logger.info("Found cscope database: %s", out_path)
-        return True
-    logger.info("Building cscope database in %s ...", src_dir)
-    cmd = ["cscope", "-b", "-q", "-k", "-R"]
+    scopes = sorted({os.path.normpath(s) for s in scopes}) if scopes else ["."]
+    for scope in scopes:
+        if not os.path.isdir(os.path.join(src_dir, scope)):
+            logger.warning("Index scope %s does not exist under %s.", scope, src_dir)
+    files = list_source_files(src_dir, scopes)
+    have_db = os.path.exists(out_path)
+    if not files:
+        if have_db and not force:
+            logger.warning("No source files found under %s; using the existing cscope database as is.", src_dir)
+            return True
+        logger.error("No source files found under %s (scopes: %s).", src_dir, ", ".join(scopes))
+        return False
+
+    if have_db and not force:
+        manifest = read_cscope_manifest(src_dir)
+        if manifest is None:
+            # cscope.out built outside this tool: trust it unless a source file is newer
+            out_mtime = os.stat(out_path).st_mtime_ns
+            newer = sum(1 for m in files.values() if m > out_mtime)
+            if scopes == ["."] and not newer:
+                logger.info("Found cscope database: %s", out_path)
+                write_cscope_manifest(src_dir, scopes, files)
+                return True
+            logger.info("cscope database %s has no manifest and %d newer files; updating it.", out_path, newer)
+        else:
+            old = manifest.get("files", {})
+            added = len(files.keys() - old.keys())
+            removed = len(old.keys() - files.keys())
+            modified = sum(1 for p in files.keys() & old.keys() if files[p] != old[p])
+            if manifest.get("scopes") == scopes and not (added or removed or modified):
+                logger.info("Found cscope database: %s (up to date, %d files)", out_path, len(files))
+                return True
+            if manifest.get("scopes") != scopes:
+                logger.info("cscope index scopes changed: %s -> %s", ", ".join(manifest.get("scopes") or []), ", ".join(scopes))
+            logger.info("cscope database is stale (%d added, %d removed, %d modified files); updating it.",
+                        added, removed, modified)
+        if not check_cmd_exists("cscope"):
+            logger.warning("cscope not found; using the existing cscope database as is.")
+            return True
+
+    with open(os.path.join(src_dir, "cscope.files"), "w", encoding="utf-8") as f:
+        for path in sorted(files):
+            f.write((f'"{path}"' if " " in path else path) + "\n")
+    cmd = ["cscope", "-b", "-q", "-k", "-i", "cscope.files"]
+    if force:
+        cmd.append("-u")
+    logger.info("%s cscope database in %s (%d files) ...",
+                "Updating" if have_db and not force else "Building", src_dir, len(files))
     try:
         subprocess.run(cmd, cwd=src_dir, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        logger.info("cscope database built successfully.")
-        return True
     except subprocess.CalledProcessError as e:
         logger.error("Failed to build cscope database. stderr:\n%s", e.stderr)
         return False
+    write_cscope_manifest(src_dir, scopes, files)
+    logger.info("cscope database built successfully.")
+    return True
 
-def run_cscope_L3(src_dir, symbol, logger):
-    # cscope -d -R -L3 <symbol> -> lines: "<file> <function> <line> <text>"
-    cmd = ["cscope", "-d", "-R", "-L3", symbol]
+CSCOPE_COUNT_RE = re.compile(r'^(?:>>\s*)*cscope: (\d+) lines?$')
+# Seconds one cscope query may take (including the first load of cscope.out) before the process is
+# considered wedged and killed
+CSCOPE_QUERY_TIMEOUT = 300
+
+class CscopeServer:
+    """
+    One long-running `cscope -d -l` (line-oriented interface) process.
+    cscope.out and its inverted index are loaded once; each query is a "<field><pattern>" line,
+    answered with "cscope: N lines" followed by N result lines.
+    Output is read with select() against a per-query deadline (timeout seconds); a query that misses it
+    kills the process and raises TimeoutError.
+    """
+
+    def __init__(self, src_dir, logger, timeout=CSCOPE_QUERY_TIMEOUT):
+        self.logger = logger
+        self.timeout = timeout
+        self.proc = subprocess.Popen(
+            ["cscope", "-d", "-l"], cwd=src_dir,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, bufsize=1,
+        )
+        # stdout is read as raw bytes so select() sees everything that has not been consumed yet
+        self.fd = self.proc.stdout.fileno()
+        self.lines = deque()
+        self.partial = b""
+
+    def _readline(self, deadline):
+        while not self.lines:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self.fd], [], [], remaining)[0]:
+                self.proc.kill()
+                self.proc.wait()
+                raise TimeoutError(f"no answer from cscope server within {self.timeout}s")
+            chunk = os.read(self.fd, 1 << 16)
+            if not chunk:
+                return ""
+            *complete, self.partial = (self.partial + chunk).split(b"\n")
+            self.lines.extend(complete)
+        return self.lines.popleft().decode("utf-8", errors="replace") + "\n"
+
+    def query(self, field, pattern):
+        if self.proc.poll() is not None:
+            raise RuntimeError(f"cscope server exited with status {self.proc.returncode}")
+        self.proc.stdin.write(f"{field}{pattern}\n")
+        self.proc.stdin.flush()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            line = self._readline(deadline)
+            if not line:
+                raise RuntimeError("cscope server closed its output")
+            m = CSCOPE_COUNT_RE.match(line.strip())
+            if m:
+                break
+            # Anything else before the count line (e.g. warnings) is not part of the answer
+            if line.strip().lstrip(">").strip():
+                self.logger.debug("cscope server: %s", line.rstrip())
+        results = []
+        for _ in range(int(m.group(1))):
+            line = self._readline(deadline)
+            if not line:
+                raise RuntimeError("cscope server closed its output")
+            results.append(line.rstrip("\n"))
+        return results
+
+    def close(self):
+        if self.proc.poll() is None:
+            try:
+                self.proc.stdin.write("q\n")
+                self.proc.stdin.flush()
+                self.proc.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self.proc.kill()
+                self.proc.wait()
+
+class CscopePool:
+    """
+    A pool of CscopeServer processes shared by the BFS; query() checks out an idle server,
+    so it can be called from several threads. Servers are started lazily.
+    If a server dies, the query falls back to a one-shot `cscope -L` subprocess.
+    """
+
+    def __init__(self, src_dir, logger, size=1):
+        self.src_dir = src_dir
+        self.logger = logger
+        self.size = max(1, size)
+        self.started = 0
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.servers = []
+
+    def _checkout(self):
+        with self.lock:
+            if self.idle.empty() and self.started < self.size:
+                self.started += 1
+                server = CscopeServer(self.src_dir, self.logger)
+                self.servers.append(server)
+                return server
+        return self.idle.get()
+
+    def query(self, field, pattern):
+        server = self._checkout()
+        try:
+            return server.query(field, pattern)
+        except (OSError, RuntimeError) as e:
+            self.logger.warning("cscope server failed (%s); restarting it and running a one-shot query for %s.", e, pattern)
+            server.close()
+            with self.lock:
+                self.servers.remove(server)
+                server = CscopeServer(self.src_dir, self.logger)
+                self.servers.append(server)
+            return run_cscope_oneshot(self.src_dir, field, pattern, self.logger)
+        finally:
+            self.idle.put(server)
+
+    def close(self):
+        for server in self.servers:
+            server.close()
+        self.servers = []
+
+def run_cscope_oneshot(src_dir, field, pattern, logger, timeout=CSCOPE_QUERY_TIMEOUT):
+    cmd = ["cscope", "-d", "-R", f"-L{field}", pattern]
     logger.debug("RUN: %s", " ".join(cmd))
     try:
-        res = subprocess.run(cmd, cwd=src_dir, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        res = subprocess.run(cmd, cwd=src_dir, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                             timeout=timeout)
     except subprocess.CalledProcessError as e:
         logger.error("cscope failed: %s\nstderr:\n%s", " ".join(cmd), e.stderr)
+        return None
+    except subprocess.TimeoutExpired:
+        logger.error("cscope timed out after %ss: %s", timeout, " ".join(cmd))
+        return None
+    return res.stdout.splitlines()
+
+class L3Cache:
+    """
+    Persistent run_cscope_L3 results shared by all runs on the same source tree (<src>/cscope.L3cache.sqlite).
+    Entries are keyed by symbol; the whole cache is tied to the size/mtime of cscope.out and is emptied when
+    cscope.out changes (or on reset=True, e.g. --rebuild-db). Safe to use from the BFS worker threads.
+    """
+
+    def __init__(self, src_dir, logger, reset=False):
+        self.logger = logger
+        self.path = os.path.join(src_dir, "cscope.L3cache.sqlite")
+        st = os.stat(os.path.join(src_dir, "cscope.out"))
+        stamp = f"{st.st_size}:{st.st_mtime_ns}"
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS queries (symbol TEXT PRIMARY KEY, records TEXT NOT NULL);"
+        )
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'cscope.out'").fetchone()
+        if reset or row is None or row[0] != stamp:
+            if row is not None:
+                logger.info("Clearing cscope query cache %s (cscope.out changed or rebuilt).", self.path)
+            self.conn.execute("DELETE FROM queries")
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('cscope.out', ?)", (stamp,))
+        self.conn.commit()
+
+    def get(self, symbol):
+        with self.lock:
+            row = self.conn.execute("SELECT records FROM queries WHERE symbol = ?", (symbol,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, symbol, records):
+        data = json.dumps(records, ensure_ascii=False)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO queries VALUES (?, ?)", (symbol, data))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+        self.logger.info("cscope query cache: %d hits, %d misses (%s)", self.hits, self.misses, self.path)
+
+def run_cscope_L3(src_dir, symbol, logger, pool=None, index=None, cache=None):
+    # cscope -d -R -L3 <symbol> -> lines: "<file> <function> <line> <text>"
+    # With a CscopePool the query goes to an already running `cscope -d -l` process;
+    # with a CallerIndex it is answered from the mmap'd index without cscope.
+    if index is not None:
+        records = index.records(symbol)
+        logger.debug("caller index: %d callsites for %s", len(records), symbol)
+        return records
+    if cache is not None:
+        records = cache.get(symbol)
+        if records is not None:
+            logger.debug("cscope query cache: %d callsites for %s", len(records), symbol)
+            return records
+    if pool is not None:
+        lines = pool.query(3, symbol)
+    else:
+        lines = run_cscope_oneshot(src_dir, 3, symbol, logger)
+    if lines is None:
+        # cscope failed; not cached, so the next run asks again
         return []
-    lines = res.stdout.splitlines()
     if not lines:
         logger.debug("cscope returned 0 lines for symbol: %s", symbol)
+        if cache is not None:
+            cache.put(symbol, [])
         return []
     records = []
     logger.debug("cscope output for %s (%d lines):", symbol, len(lines))
@@ -110,9 +395,12 @@ def run_cscope_L3(src_dir, symbol, logger):
             "line": lineno,
             "code": code,
         })
+    if cache is not None:
+        cache.put(symbol, records)
     return records
 
-def build_callers_graph(src_dir, start_symbol, logger, max_depth=None, include_regex=None, exclude_regex=None):
+def build_callers_graph(src_dir, start_symbol, logger, max_depth=None, include_regex=None, exclude_regex=None,
+                        pool=None, index=None, jobs=1, cache=None):
     import re
     inc_re = re.compile(include_regex) if include_regex else None
     exc_re = re.compile(exclude_regex) if exclude_regex else None
@@ -124,75 +412,97 @@ def build_callers_graph(src_dir, start_symbol, logger, max_depth=None, include_r
     # nodes set
     nodes = set([start_symbol])
 
-    # BFS upward from callee to callers
-    q = deque()
-    q.append((start_symbol, 0))
+    # Level-synchronous BFS upward from callee to callers: the symbols of one depth are independent,
+    # so they are queried together (up to `jobs` at a time) and their results merged in frontier order.
+    # The graph is the same as with a serial BFS.
     visited = set()  # visited functions we have expanded (queried as callee)
+    frontier = [start_symbol]
+    depth = 0
     logger.info("Starting recursive search from: %s", start_symbol)
 
-    while q:
-        sym, depth = q.popleft()
+    def query(sym):
+        return run_cscope_L3(src_dir, sym, logger, pool=pool, index=index, cache=cache)
 
-        # 新增：如果当前符号本身不像函数名，跳过扩展
-        if not is_plausible_funcname(sym):
-            logger.warning("Skip expanding suspicious callee '%s' at depth %d (likely type/keyword from cscope misparse).", sym, depth)
-            visited.add(sym)
-            continue
-
-        if sym in visited:
-            continue
-        visited.add(sym)
-
-        # Depth control: expand only if under limit
-        if max_depth is not None and depth >= max_depth:
-            logger.info("Depth %d reached limit %d for symbol %s; stop expanding this branch.", depth, max_depth, sym)
-            continue
-
-        callers = run_cscope_L3(src_dir, sym, logger)
-        if not callers:
-            logger.info("No callers found for %s at depth %d.", sym, depth)
-            continue
-
-        logger.info("Found %d callers for %s at depth %d.", len(callers), sym, depth)
-
-        accepted_callers = set()
-        for rec in callers:
-            caller = rec["caller"]
-            code_line = rec["code"]
-            file_path = rec["file"]
-            lineno = rec["line"]
-
-            # 过滤不合理的 caller 名称（例如 bool）
-            if not is_plausible_funcname(caller):
-                logger.warning(
-                    "Discarding cscope caller '%s' for %s at %s:%s; "
-                    "reason: implausible function name (likely type/keyword). Line: %s",
-                    caller, sym, file_path, lineno, code_line
-                )
-                continue
-
-            # 二次确认这是一个调用点：必须出现 callee(
-            if not looks_like_call(code_line, sym):
-                logger.warning(
-                    "Discarding cscope caller '%s' for %s at %s:%s; "
-                    "reason: line does not look like a call to '%s'. Line: %s",
-                    caller, sym, file_path, lineno, sym, code_line
-                )
-                continue
-
-            nodes.add(caller)
-            edges_set.add((caller, sym))
-            edges_details[sym][caller].append({
-                "file": file_path,
-                "line": lineno,
-                "code": code_line,
-            })
-            accepted_callers.add(caller)
-
-        # 只扩展通过过滤的 caller
-        for c in accepted_callers:
-            if c not in visited:
-                q.append((c, depth + 1))
+    executor = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    try:
+        while frontier:
+            expand = []
+            for sym in frontier:
+                # 新增：如果当前符号本身不像函数名，跳过扩展
+                if not is_plausible_funcname(sym):
+                    logger.warning("Skip expanding suspicious callee '%s' at depth %d (likely type/keyword from cscope misparse).", sym, depth)
+                    visited.add(sym)
+                    continue
+
+                if sym in visited:
+                    continue
+                visited.add(sym)
+
+                # Depth control: expand only if under limit
+                if max_depth is not None and depth >= max_depth:
+                    logger.info("Depth %d reached limit %d for symbol %s; stop expanding this branch.", depth, max_depth, sym)
+                    continue
+                expand.append(sym)
+
+            if executor is not None and len(expand) > 1:
+                results = executor.map(query, expand)
+            else:
+                results = map(query, expand)
+
+            next_frontier = []
+            queued = set()
+            for sym, callers in zip(expand, results):
+                if not callers:
+                    logger.info("No callers found for %s at depth %d.", sym, depth)
+                    continue
+
+                logger.info("Found %d callers for %s at depth %d.", len(callers), sym, depth)
+
+                accepted_callers = {}
+                for rec in callers:
+                    caller = rec["caller"]
+                    code_line = rec["code"]
+                    file_path = rec["file"]
+                    lineno = rec["line"]
+
+                    # 过滤不合理的 caller 名称（例如 bool）
+                    if not is_plausible_funcname(caller):
+                        logger.warning(
+                            "Discarding cscope caller '%s' for %s at %s:%s; "
+                            "reason: implausible function name (likely type/keyword). Line: %s",
+                            caller, sym, file_path, lineno, code_line
+                        )
+                        continue
+
+                    # 二次确认这是一个调用点：必须出现 callee(
+                    if not looks_like_call(code_line, sym):
+                        logger.warning(
+                            "Discarding cscope caller '%s' for %s at %s:%s; "
+                            "reason: line does not look like a call to '%s'. Line: %s",
+                            caller, sym, file_path, lineno, sym, code_line
+                        )
+                        continue
+
+                    nodes.add(caller)
+                    edges_set.add((caller, sym))
+                    edges_details[sym][caller].append({
+                        "file": file_path,
+                        "line": lineno,
+                        "code": code_line,
+                    })
+                    accepted_callers[caller] = True
+
+                # 只扩展通过过滤的 caller
+                for c in accepted_callers:
+                    if c not in visited and c not in queued:
+                        queued.add(c)
+                        next_frontier.append(c)
+
+            frontier = next_frontier
+            depth += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
     # Build edges list with callsite counts
     edges = []
@@ -292,6 +602,20 @@ def main():
     ap.add_argument("--include", help="Only include callers whose name matches this regex.")
     ap.add_argument("--exclude", help="Exclude callers whose name matches this regex.")
     ap.add_argument("--rebuild-db", action="store_true", help="Force rebuild cscope database.")
+    ap.add_argument("--scope", action="append", metavar="SUBDIR",
+                    help="Index only these subtrees of --src (repeatable or comma-separated), "
+                         "e.g. --scope arch/riscv,kernel,mm. Default: the whole tree.")
+    ap.add_argument("--no-cscope-server", action="store_true",
+                    help="Run one `cscope -L3` process per symbol instead of querying a persistent `cscope -l` process.")
+    ap.add_argument("--no-cache", action="store_true",
+                    help="Do not read or write the persistent cscope query cache (<src>/cscope.L3cache.sqlite).")
+    ap.add_argument("-j", "--jobs", type=int, default=min(4, os.cpu_count() or 1),
+                    help="Number of symbols of one BFS level queried concurrently. Each job keeps its own "
+                         "long-lived `cscope -d -l` process holding a private copy of the inverted index, "
+                         "so memory grows linearly with -j. Default: min(4, number of CPUs).")
+    ap.add_argument("--index", nargs="?", const="", default=None, metavar="PATH",
+                    help="Answer the queries from a native caller index parsed from cscope.out (built on first use, "
+                         "rebuilt when cscope.out changes) instead of cscope. Default path: <src>/cscope.callers.idx")
     ap.add_argument("--img-format", choices=["png", "svg", "pdf"], default="png", help="Graph image format. Default: png")
     args = ap.parse_args()
 
@@ -308,21 +632,49 @@ def main():
     if args.depth is not None:
         logger.info("Max depth: %d", args.depth)
 
-    if not check_cmd_exists("cscope"):
+    # An existing cscope.out is all the caller index needs; cscope itself is only needed to build it
+    have_db = os.path.exists(os.path.join(src_dir, "cscope.out")) and not args.rebuild_db
+    if not check_cmd_exists("cscope") and not (args.index is not None and have_db):
         logger.error("cscope not found. Please install it.")
         sys.exit(1)
 
-    if not ensure_cscope_db(src_dir, logger, force=args.rebuild_db):
+    scopes = [s.strip() for arg in args.scope or [] for s in arg.split(",") if s.strip()]
+    # Always check cscope.out against the source tree before anything is answered from it or from the
+    # query cache below (the cache is emptied when this rebuilds cscope.out)
+    if not ensure_cscope_db(src_dir, logger, force=args.rebuild_db, scopes=scopes):
         sys.exit(1)
 
-    graph = build_callers_graph(
-        src_dir=src_dir,
-        start_symbol=args.symbol,
-        logger=logger,
-        max_depth=args.depth,
-        include_regex=args.include,
-        exclude_regex=args.exclude,
-    )
+    pool = index = cache = None
+    if args.index is not None:
+        index = load_caller_index(src_dir, args.index or default_index_path(src_dir), log=logger.info)
+    else:
+        if not args.no_cache:
+            # Queries answered by earlier runs on the same cscope.out are reused
+            cache = L3Cache(src_dir, logger, reset=args.rebuild_db)
+        if not args.no_cscope_server:
+            # Keep cscope.out loaded in one line-mode cscope process instead of spawning one per symbol
+            pool = CscopePool(src_dir, logger, size=args.jobs)
+    try:
+        graph = build_callers_graph(
+            src_dir=src_dir,
+            start_symbol=args.symbol,
+            logger=logger,
+            max_depth=args.depth,
+            include_regex=args.include,
+            exclude_regex=args.exclude,
+            pool=pool,
+            index=index,
+            # The caller index is answered in-process; threads would only contend for the GIL
+            jobs=1 if index is not None else args.jobs,
+            cache=cache,
+        )
+    finally:
+        if pool is not None:
+            pool.close()
+        if cache is not None:
+            cache.close()
+        if index is not None:
+            index.close()
 
     out_json = os.path.join(out_dir, "callgraph.json")
     write_json(graph, out_json, logger)
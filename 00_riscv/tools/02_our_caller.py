@@ -4,19 +4,26 @@
 用于查找两个函数的调用链,并找出它们的共同调用者
 """
 
+import argparse
+import os
 import subprocess
 import sys
 import re
 from collections import defaultdict, deque
 
+from cscope_index import load_caller_index
+
 class CallChainAnalyzer:
-    def __init__(self, max_depth=10):
+    def __init__(self, max_depth=10, index=None):
         self.max_depth = max_depth
         self.call_graph = defaultdict(set)  # caller -> set of callees
         self.visited = set()
+        self.index = index  # cscope_index.CallerIndex，给了就不再调用 cscope
         
     def get_callers(self, function_name):
         """使用cscope查找调用指定函数的所有函数"""
+        if self.index is not None:
+            return self.index.callers(function_name) - {'<global>', function_name}
         try:
             # -d: 不重新生成数据库
             # -L: 行模式查找
@@ -103,13 +110,19 @@ class CallChainAnalyzer:
         return paths
 
 def main():
-    if len(sys.argv) != 3:
-        print(f"用法: {sys.argv[0]} <函数1> <函数2>")
-        print(f"示例: {sys.argv[0]} packet_pick_tx_queue some_other_function")
-        sys.exit(1)
+    ap = argparse.ArgumentParser(description="查找两个函数的调用链及共同调用者",
+                                 epilog=f"示例: {sys.argv[0]} packet_pick_tx_queue some_other_function")
+    ap.add_argument("func1")
+    ap.add_argument("func2")
+    ap.add_argument("--index", nargs="?", const="", default=None, metavar="PATH",
+                    help="用 cscope_index.py 的调用者索引代替 cscope 查询（默认 ./cscope.callers.idx，没有或过期时从 cscope.out 重建）")
+    args = ap.parse_args()
     
-    func1 = sys.argv[1]
-    func2 = sys.argv[2]
+    func1 = args.func1
+    func2 = args.func2
+    index = None
+    if args.index is not None:
+        index = load_caller_index(os.getcwd(), args.index or None, log=print)
     
     print("=" * 80)
     print(f"分析函数调用链: {func1} 和 {func2}")
@@ -117,12 +130,12 @@ def main():
     
     # 分析第一个函数
     print(f"\n>>> 构建 {func1} 的调用链...")
-    analyzer1 = CallChainAnalyzer(max_depth=8)
+    analyzer1 = CallChainAnalyzer(max_depth=8, index=index)
     analyzer1.build_call_chain(func1)
     callers1 = analyzer1.get_all_callers(func1)
     
     print(f"\n>>> 构建 {func2} 的调用链...")
-    analyzer2 = CallChainAnalyzer(max_depth=8)
+    analyzer2 = CallChainAnalyzer(max_depth=8, index=index)
     analyzer2.build_call_chain(func2)
     callers2 = analyzer2.get_all_callers(func2)
     
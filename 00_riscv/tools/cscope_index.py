@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Native caller index built from cscope.out.
+
+cscope.out is parsed once (no cscope process involved) into a compact file next to it,
+cscope.callers.idx, which is memory-mapped at startup:
+
+    names   interned function names, '\\n'-joined; a function ID is its position in this list
+    files   interned file names, '\\n'-joined
+    ptr     uint32[n_names + 1]: the callsites of callee i are sites[ptr[i]:ptr[i + 1]]
+    sites   uint32[4 * n_sites]: (caller_id, file_id, line, text_id), grouped by callee,
+            in cscope.out order within a callee (the order `cscope -L3` prints them)
+    tptr    uint64[n_sites + 1]: the source line of text_id t is texts[tptr[t]:tptr[t + 1]]
+    texts   source lines of the callsites (UTF-8)
+
+A -L3 query then is a slice of `ptr`/`sites`, and a recursive caller graph is an in-memory traversal.
+The index records the size/mtime of the cscope.out it was built from and is rebuilt when they change.
+
+Usage:
+    python3 cscope_index.py -s <kernel src> [--rebuild] [symbol ...]
+"""
+import argparse
+import json
+import mmap
+import os
+import re
+import sys
+from array import array
+
+INDEX_NAME = "cscope.callers.idx"
+MAGIC = b"KCALLERS 1\n"
+GLOBAL_CALLER = "<global>"
+
+# Text compression used by cscope.out unless it was built with -c (see cscope's build.c / lookup.c):
+# bytes >= 0x80 are digraphs, bytes < 0x20 (other than \t and \n) are keywords.
+DICHAR1 = " teisaprnl(of)=c"
+DICHAR2 = " tnerpla"
+KEYWORDS = [
+    ("", ""), ("#define", " "), ("#include", " "), ("break", ""), ("case", " "), ("char", " "),
+    ("continue", ""), ("default", ""), ("double", " "), ("\t", ""), ("\n", ""), ("else", " "),
+    ("enum", " "), ("extern", " "), ("float", " "), ("for", "("), ("goto", " "), ("if", "("),
+    ("int", " "), ("long", " "), ("register", " "), ("return", ""), ("short", " "), ("sizeof", ""),
+    ("static", " "), ("struct", " "), ("switch", "("), ("typedef", " "), ("union", " "),
+    ("unsigned", " "), ("void", " "), ("while", "("),
+]
+EXPANSIONS = {}
+for _c in range(0x80, 0x100):
+    EXPANSIONS[_c] = (DICHAR1[(_c & 0x7f) // 8] + DICHAR2[_c & 7]).encode()
+for _c, (_text, _delim) in enumerate(KEYWORDS):
+    if _c and _c not in (9, 10):
+        EXPANSIONS[_c] = (_text + (" " if _delim else "")).encode()
+COMPRESSED_RE = re.compile(rb"[\x01-\x08\x0b-\x1f\x80-\xff]")
+LINE_RECORD_RE = re.compile(rb"^(\d+) ?(.*)$", re.S)
+
+def expand_text(data):
+    return COMPRESSED_RE.sub(lambda m: EXPANSIONS[m.group()[0]], data)
+
+def default_index_path(src_dir):
+    return os.path.join(src_dir, INDEX_NAME)
+
+def read_crossref_header(f):
+    """'cscope <version> <dir> [-c] [-q <n>] [-T] <trailer offset>' -> (trailer offset, compressed)"""
+    tokens = f.readline().split()
+    if len(tokens) < 4 or tokens[0] != b"cscope":
+        raise ValueError("not a cscope cross-reference file")
+    return int(tokens[-1]), b"-c" not in tokens[3:-1]
+
+def _line_callsites(file_name, lineno, parts, calls, compressed):
+    if not calls:
+        return
+    text = b"".join(parts)
+    if compressed:
+        text = expand_text(text)
+    text = text.decode("utf-8", errors="replace").strip()
+    for callee, caller in calls:
+        yield file_name, caller.decode() if caller else GLOBAL_CALLER, callee.decode(), lineno, text
+
+def iter_callsites(cscope_out):
+    """
+    Yield (file, caller, callee, line, text) for every function call mark in cscope.out.
+
+    Each source line is stored as "<line> <text>" followed by alternating symbol / text lines and ends
+    with an empty line; marked symbols are "\\t<mark><name>": @ file, $ function, ` call, } function end,
+    # macro, ) macro end. As in `cscope -L3`, the caller is the enclosing macro, else the enclosing
+    function, else <global>.
+    """
+    with open(cscope_out, "rb") as f:
+        trailer, compressed = read_crossref_header(f)
+        pos = f.tell()
+        file_name = func = macro = None
+        lineno = parts = calls = None
+        want_symbol = False
+        for raw in f:
+            if trailer and pos >= trailer:
+                break
+            pos += len(raw)
+            line = raw[:-1] if raw.endswith(b"\n") else raw
+
+            if parts is not None:
+                if not want_symbol:
+                    parts.append(line)
+                    want_symbol = True
+                    continue
+                if line and not line.startswith(b"\t@") and not LINE_RECORD_RE.match(line):
+                    if line[:1] == b"\t" and len(line) > 1:
+                        mark, name = line[1:2], line[2:]
+                        if mark == b"$":
+                            func = name
+                        elif mark == b"`":
+                            calls.append((name, macro or func))
+                        elif mark == b"}":
+                            func = None
+                        elif mark == b"#":
+                            macro = name
+                        elif mark == b")":
+                            macro = None
+                        line = name
+                    parts.append(line)
+                    want_symbol = False
+                    continue
+                # End of this source line
+                yield from _line_callsites(file_name, lineno, parts, calls, compressed)
+                parts = calls = None
+
+            if line.startswith(b"\t@"):
+                file_name = line[2:].decode("utf-8", errors="replace") or None
+                func = macro = None
+                continue
+            m = LINE_RECORD_RE.match(line)
+            if m and file_name is not None:
+                lineno = int(m.group(1))
+                parts = [m.group(2)]
+                calls = []
+                want_symbol = True
+
+        if parts is not None:
+            yield from _line_callsites(file_name, lineno, parts, calls, compressed)
+
+def _source_stamp(cscope_out):
+    st = os.stat(cscope_out)
+    return {"source": os.path.realpath(cscope_out), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def build_index(cscope_out, index_path):
+    """Parse cscope.out and write the caller index (via a temporary file). Returns (n_names, n_sites)."""
+    stamp = _source_stamp(cscope_out)
+    names, files = {}, {}
+    callee_ids, caller_ids, file_ids, lines = array("I"), array("I"), array("I"), array("I")
+    tptr = array("Q", [0])
+    texts = bytearray()
+    for file_name, caller, callee, lineno, text in iter_callsites(cscope_out):
+        callee_ids.append(names.setdefault(callee, len(names)))
+        caller_ids.append(names.setdefault(caller, len(names)))
+        file_ids.append(files.setdefault(file_name, len(files)))
+        lines.append(lineno)
+        texts += text.encode("utf-8")
+        tptr.append(len(texts))
+
+    # CSR by callee; sorted() is stable, so callsites keep their cscope.out order
+    ptr = array("I", [0] * (len(names) + 1))
+    for c in callee_ids:
+        ptr[c + 1] += 1
+    for i in range(len(names)):
+        ptr[i + 1] += ptr[i]
+    sites = array("I")
+    for t in sorted(range(len(callee_ids)), key=callee_ids.__getitem__):
+        sites.extend((caller_ids[t], file_ids[t], lines[t], t))
+
+    sections = [
+        ("names", "\n".join(names).encode("utf-8")),
+        ("files", "\n".join(files).encode("utf-8")),
+        ("ptr", ptr.tobytes()),
+        ("sites", sites.tobytes()),
+        ("tptr", tptr.tobytes()),
+        ("texts", bytes(texts)),
+    ]
+    table, offset = {}, 0
+    for name, data in sections:
+        table[name] = [offset, len(data)]
+        offset += (len(data) + 7) & ~7
+    header = dict(stamp, version=1, byteorder=sys.byteorder, sections=table)
+
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(json.dumps(header).encode() + b"\n")
+        f.write(b"\0" * (-f.tell() % 8))
+        for _, data in sections:
+            f.write(data)
+            f.write(b"\0" * (-len(data) % 8))
+    os.replace(tmp_path, index_path)
+    return len(names), len(callee_ids)
+
+class CallerIndex:
+    """Read-only view of a caller index file; the adjacency arrays stay in the mmap."""
+
+    def __init__(self, index_path):
+        self.path = index_path
+        self._file = open(index_path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm.readline() != MAGIC:
+            self.close()
+            raise ValueError(f"{index_path}: not a caller index")
+        self.header = json.loads(self._mm.readline())
+        if self.header.get("byteorder") != sys.byteorder:
+            self.close()
+            raise ValueError(f"{index_path}: built on a machine with a different byte order")
+        base = self._mm.tell() + (-self._mm.tell() % 8)
+        view = memoryview(self._mm)
+
+        def section(name):
+            offset, size = self.header["sections"][name]
+            return view[base + offset:base + offset + size]
+
+        self.names = bytes(section("names")).decode("utf-8").split("\n") if self.header["sections"]["names"][1] else []
+        self.files = bytes(section("files")).decode("utf-8").split("\n") if self.header["sections"]["files"][1] else []
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.ptr = section("ptr").cast("I")
+        self.sites = section("sites").cast("I")
+        self.tptr = section("tptr").cast("Q")
+        self.texts = section("texts")
+        self._views = [view, self.ptr, self.sites, self.tptr, self.texts]
+
+    def is_current(self, cscope_out):
+        """Whether the index was built from this cscope.out as it is now"""
+        try:
+            stamp = _source_stamp(cscope_out)
+        except OSError:
+            return False
+        return all(self.header.get(k) == v for k, v in stamp.items())
+
+    def sites_of(self, callee_id):
+        """(caller_id, file_id, line, text_id) for every call of callee_id"""
+        sites = self.sites
+        for k in range(self.ptr[callee_id], self.ptr[callee_id + 1]):
+            yield sites[4 * k], sites[4 * k + 1], sites[4 * k + 2], sites[4 * k + 3]
+
+    def text(self, text_id):
+        return bytes(self.texts[self.tptr[text_id]:self.tptr[text_id + 1]]).decode("utf-8")
+
+    def records(self, symbol):
+        """Same records as run_cscope_L3: [{caller, callee, file, line, code}, ...]"""
+        callee_id = self.ids.get(symbol)
+        if callee_id is None:
+            return []
+        return [{
+            "caller": self.names[caller_id],
+            "callee": symbol,
+            "file": self.files[file_id],
+            "line": lineno,
+            "code": self.text(text_id),
+        } for caller_id, file_id, lineno, text_id in self.sites_of(callee_id)]
+
+    def callers(self, symbol):
+        """Names of the functions that call symbol (callsites not decoded)"""
+        callee_id = self.ids.get(symbol)
+        if callee_id is None:
+            return set()
+        return {self.names[caller_id] for caller_id, _, _, _ in self.sites_of(callee_id)}
+
+    def close(self):
+        for v in getattr(self, "_views", []):
+            v.release()
+        self._views = []
+        self._mm.close()
+        self._file.close()
+
+def load_caller_index(src_dir, index_path=None, rebuild=False, log=None):
+    """
+    Open the caller index of src_dir/cscope.out, (re)building it first if it is missing, stale or rebuild=True.
+    log: optional callable(str) for progress messages.
+    """
+    cscope_out = os.path.join(src_dir, "cscope.out")
+    index_path = index_path or default_index_path(src_dir)
+    if not rebuild and os.path.exists(index_path):
+        try:
+            index = CallerIndex(index_path)
+        except (ValueError, KeyError, OSError) as e:
+            if log:
+                log(f"Ignoring unreadable caller index {index_path}: {e}")
+        else:
+            if index.is_current(cscope_out):
+                return index
+            index.close()
+            if log:
+                log(f"Caller index {index_path} is older than {cscope_out}; rebuilding it.")
+    if log:
+        log(f"Building caller index {index_path} from {cscope_out} ...")
+    n_names, n_sites = build_index(cscope_out, index_path)
+    if log:
+        log(f"Caller index built: {n_names} functions, {n_sites} callsites.")
+    return CallerIndex(index_path)
+
+def main():
+    ap = argparse.ArgumentParser(description="Build / query the native caller index of a cscope.out.")
+    ap.add_argument("symbols", nargs="*", help="Print the callsites of these functions (like cscope -L3).")
+    ap.add_argument("-s", "--src", default=".", help="Kernel source root (where cscope.out resides). Default: current dir.")
+    ap.add_argument("--index", help=f"Index file. Default: <src>/{INDEX_NAME}")
+    ap.add_argument("--rebuild", action="store_true", help="Rebuild the index even if it is up to date.")
+    args = ap.parse_args()
+
+    src_dir = os.path.abspath(args.src)
+    index = load_caller_index(src_dir, args.index, rebuild=args.rebuild, log=lambda msg: print(msg, file=sys.stderr))
+    try:
+        for symbol in args.symbols:
+            for rec in index.records(symbol):
+                print(f'{rec["file"]} {rec["caller"]} {rec["line"]} {rec["code"]}')
+    finally:
+        index.close()
+
+if __name__ == "__main__":
+    main()